@@ -0,0 +1,195 @@
+"""
+Archive tier.
+
+Subscribers soft-deleted for longer than SUBSCRIBER_ARCHIVE_RETENTION_DAYS
+move, with all their subscriptions, from the hot collections into
+magazine_subscriber_archive and subscription_archive. Subscriptions that
+ended more than SUBSCRIPTION_ARCHIVE_HORIZON_DAYS ago move even when their
+subscriber stays. Documents are copied unchanged apart from `archived_at`.
+
+Each batch is copied with $merge and then deleted from the hot collection.
+If a run stops between the two steps, a document exists in both tiers.
+Readers prefer the hot copy, and the next run finishes the move.
+
+The inactive tab, subscriber detail and `activate` read across both tiers.
+Activating an archived subscriber moves it back.
+"""
+import heapq
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+
+from .models import ArchivedSubscriber, ArchivedSubscription, MagazineSubscriber, Subscription, Tombstone
+
+
+def _move(source, target, ids, now):
+    """Copies documents `ids` from `source` to `target` and deletes them from `source`."""
+    if not ids:
+        return 0
+    source.aggregate([
+        {'$match': {'_id': {'$in': ids}}},
+        {'$set': {'archived_at': now}},
+        {'$merge': {'into': target.name, 'on': '_id', 'whenMatched': 'replace', 'whenNotMatched': 'insert'}},
+    ])
+    moved = source.delete_many({'_id': {'$in': ids}}).deleted_count
+    # Sync clients only see the hot tier, so an archived document is a deleted one
+    Tombstone.record(source.name, ids, now)
+    return moved
+
+
+def _restore(source, target, ids):
+    if not ids:
+        return 0
+    source.aggregate([
+        {'$match': {'_id': {'$in': ids}}},
+        {'$unset': 'archived_at'},
+        {'$set': {'updated_at': datetime.utcnow()}},
+        {'$merge': {'into': target.name, 'on': '_id', 'whenMatched': 'replace', 'whenNotMatched': 'insert'}},
+    ])
+    Tombstone.clear(target.name, ids)
+    return source.delete_many({'_id': {'$in': ids}}).deleted_count
+
+
+def stamp_deleted_at(now=None):
+    """Starts the retention clock for subscribers deleted before deleted_at existed."""
+    now = now or datetime.utcnow()
+    return MagazineSubscriber._get_collection().update_many(
+        {'isDeleted': True, 'deleted_at': None}, {'$set': {'deleted_at': now, 'updated_at': now}},
+    ).modified_count
+
+
+def archive_subscribers(retention_days=None, batch_size=500, dry_run=False):
+    """Moves long-deleted subscribers and their subscriptions. Returns (subscribers, subscriptions) moved."""
+    retention_days = retention_days if retention_days is not None else settings.SUBSCRIBER_ARCHIVE_RETENTION_DAYS
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    hot_subscribers = MagazineSubscriber._get_collection()
+    query = {'isDeleted': True, 'deleted_at': {'$lt': cutoff}}
+    if dry_run:
+        ids = [doc['_id'] for doc in hot_subscribers.find(query, {'_id': 1})]
+        return len(ids), Subscription._get_collection().count_documents({'subscriber': {'$in': ids}})
+
+    hot_subscriptions = Subscription._get_collection()
+    subscriber_archive = ArchivedSubscriber._get_collection()
+    archive_subscriptions = ArchivedSubscription._get_collection()
+    moved_subscribers = moved_subscriptions = 0
+    while True:
+        ids = [doc['_id'] for doc in hot_subscribers.find(query, {'_id': 1}).limit(batch_size)]
+        if not ids:
+            break
+        now = datetime.utcnow()
+        # Subscriptions first, so a subscriber is never archived while its history is still hot
+        subscription_ids = [doc['_id'] for doc in hot_subscriptions.find({'subscriber': {'$in': ids}}, {'_id': 1})]
+        moved_subscriptions += _move(hot_subscriptions, archive_subscriptions, subscription_ids, now)
+        moved_subscribers += _move(hot_subscribers, subscriber_archive, ids, now)
+    return moved_subscribers, moved_subscriptions
+
+
+def archive_expired_subscriptions(horizon_days=None, batch_size=1000, dry_run=False):
+    """Moves subscriptions that ended before the horizon. Returns the number moved."""
+    horizon_days = horizon_days if horizon_days is not None else settings.SUBSCRIPTION_ARCHIVE_HORIZON_DAYS
+    cutoff = datetime.combine(date.today() - timedelta(days=horizon_days), datetime.min.time())
+    hot = Subscription._get_collection()
+    query = {'end_date': {'$lt': cutoff}}
+    if dry_run:
+        return hot.count_documents(query)
+
+    archive = ArchivedSubscription._get_collection()
+    moved = 0
+    while True:
+        ids = [doc['_id'] for doc in hot.find(query, {'_id': 1}).limit(batch_size)]
+        if not ids:
+            break
+        moved += _move(hot, archive, ids, datetime.utcnow())
+    return moved
+
+
+def archived_subscriber(subscriber_id):
+    """The archived subscriber as a MagazineSubscriber instance, or None."""
+    doc = ArchivedSubscriber._get_collection().find_one({'_id': subscriber_id})
+    if doc is None:
+        return None
+    doc.pop('archived_at', None)
+    subscriber = MagazineSubscriber._from_son(doc, created=False)
+    subscriber._archived = True
+    return subscriber
+
+
+def is_archived(subscriber):
+    return getattr(subscriber, '_archived', False)
+
+
+def restore_subscriber(subscriber_id):
+    """Moves an archived subscriber and its archived subscriptions back to the hot tier."""
+    archive = ArchivedSubscription._get_collection()
+    subscription_ids = [doc['_id'] for doc in archive.find({'subscriber': subscriber_id}, {'_id': 1})]
+    _restore(archive, Subscription._get_collection(), subscription_ids)
+    _restore(ArchivedSubscriber._get_collection(), MagazineSubscriber._get_collection(), [subscriber_id])
+    return MagazineSubscriber.objects.get(pk=subscriber_id)
+
+
+def subscription_history(subscriber_id, fields=None):
+    """
+    All subscriptions of a subscriber from both tiers, newest start_date
+    first. `fields` limits the loaded fields; _id and start_date are always loaded.
+    """
+    hot = Subscription.objects.filter(subscriber=subscriber_id).order_by('-start_date')
+    projection = None
+    if fields:
+        fields = {'_id', 'start_date', *fields}
+        hot = hot.only(*fields)
+        projection = dict.fromkeys(fields, 1)
+    hot = list(hot)
+    seen = {subscription.pk for subscription in hot}
+    archived = []
+    archive = ArchivedSubscription._get_collection()
+    for doc in archive.find({'subscriber': subscriber_id}, projection).sort('start_date', -1):
+        if doc['_id'] not in seen:
+            doc.pop('archived_at', None)
+            archived.append(Subscription._from_son(doc, created=False))
+    return list(heapq.merge(hot, archived, key=lambda subscription: subscription.start_date, reverse=True))
+
+
+class TieredSubscribers:
+    """
+    Deleted subscribers from both tiers in -_id order, sliceable and countable
+    like a queryset so the paginator can page over it. `filters` are raw
+    MongoDB conditions applied to both tiers; `fields` limits the loaded fields.
+    """
+
+    def __init__(self, filters=None, fields=None):
+        self.filters = dict(filters or {}, isDeleted=True)
+        # archived_at tells the tiers apart
+        self.projection = dict.fromkeys([*fields, 'archived_at'], 1) if fields else None
+
+    def count(self):
+        return (
+            MagazineSubscriber._get_collection().count_documents(self.filters)
+            + ArchivedSubscriber._get_collection().count_documents(self.filters)
+        )
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        # Both tiers are sorted by -_id; the first `stop` of each cover the slice
+        hot = MagazineSubscriber._get_collection().find(self.filters, self.projection).sort('_id', -1).limit(stop)
+        archived = ArchivedSubscriber._get_collection().find(self.filters, self.projection).sort('_id', -1).limit(stop)
+        merged, seen = [], set()
+        for doc in heapq.merge(hot, archived, key=lambda doc: doc['_id'], reverse=True):
+            if doc['_id'] in seen:
+                continue
+            seen.add(doc['_id'])
+            merged.append(doc)
+            if len(merged) == stop:
+                break
+
+        page = []
+        for doc in merged[start:]:
+            archived_doc = doc.pop('archived_at', None) is not None
+            subscriber = MagazineSubscriber._from_son(doc, created=False)
+            subscriber._archived = archived_doc
+            page.append(subscriber)
+        return page
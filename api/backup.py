@@ -0,0 +1,234 @@
+"""
+Logical backup and restore of the database (see the dump_data and
+restore_data commands).
+
+A dump is a directory with one gzip file per collection and a manifest.json
+recording each collection's options, indexes and document count. The files
+hold either BSON or NDJSON:
+- <name>.bson.gz: concatenated BSON documents, as mongodump writes them,
+  copied from the server's reply without decoding.
+- <name>.ndjson.gz: one relaxed Extended JSON document per line, readable
+  with zcat and jq, with types (dates, ObjectIds, decimals) preserved.
+
+Collections are dumped in parallel. On a replica set or sharded cluster every
+collection is read at one cluster time with snapshot read concern, so the dump
+is a consistent point in time. The server keeps snapshot history for
+minSnapshotHistoryWindowInSeconds (300 s by default); raise it for dumps that
+take longer. A standalone server has no snapshots, so each collection is read
+as it is at the moment.
+
+A restore inserts unordered batches in parallel while each collection has
+only its _id index. The other indexes are built once all data is loaded.
+"""
+import gzip
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+import bson
+from bson import json_util
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import IndexModel
+from pymongo.errors import BulkWriteError, OperationFailure
+from pymongo.write_concern import WriteConcern
+
+MANIFEST = 'manifest.json'
+FORMATS = {'bson': '.bson.gz', 'ndjson': '.ndjson.gz'}
+RAW = CodecOptions(document_class=RawBSONDocument)
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS
+# list_indexes fields that describe an index rather than configure it
+INDEX_INFO_KEYS = ('v', 'ns', 'key', 'background')
+
+
+class BackupError(Exception):
+    pass
+
+
+def collection_infos(db, only=None, exclude=()):
+    """listCollections entries of the collections to dump (no views or system collections), by name."""
+    infos = {}
+    for info in db.list_collections(filter={'type': 'collection'}):
+        name = info['name']
+        if name.startswith('system.') or name in exclude or (only and name not in only):
+            continue
+        infos[name] = info
+    missing = set(only or ()) - set(infos)
+    if missing:
+        raise BackupError(f"No such collection: {', '.join(sorted(missing))}.")
+    return infos
+
+
+def snapshot_time(db, name):
+    """Cluster time to read every collection at, or None when the server has no snapshot reads."""
+    hello = db.client.admin.command('hello')
+    if 'setName' not in hello and hello.get('msg') != 'isdbgrid':
+        return None
+    try:
+        reply = db.command({'find': name, 'limit': 1, 'singleBatch': True, 'readConcern': {'level': 'snapshot'}})
+    except OperationFailure:
+        # Snapshot reads outside transactions need MongoDB 5.0
+        return None
+    return reply['cursor'].get('atClusterTime')
+
+
+def _batches(db, session, name, read_concern, batch_size):
+    """Raw BSON documents of collection `name`, one server batch at a time."""
+    command = {'find': name, 'batchSize': batch_size}
+    if read_concern:
+        command['readConcern'] = read_concern
+    cursor = db.command(command, session=session, codec_options=RAW)['cursor']
+    cursor_id = cursor['id']
+    try:
+        yield cursor['firstBatch']
+        while cursor_id:
+            cursor = db.command(
+                {'getMore': cursor_id, 'collection': name, 'batchSize': batch_size},
+                session=session, codec_options=RAW,
+            )['cursor']
+            cursor_id = cursor['id']
+            yield cursor['nextBatch']
+    finally:
+        if cursor_id:
+            db.command({'killCursors': name, 'cursors': [cursor_id]}, session=session)
+
+
+def dump_collection(db, name, directory, fmt, at_cluster_time=None, level=6, batch_size=1000):
+    """Writes collection `name` to its file in `directory`; returns the number of documents."""
+    read_concern = {'level': 'snapshot', 'atClusterTime': at_cluster_time} if at_cluster_time else None
+    path = os.path.join(directory, name + FORMATS[fmt])
+    count = 0
+    # getMore must run in the session of its find; causal consistency would add its own read concern
+    with db.client.start_session(causal_consistency=False) as session, \
+            gzip.open(path + '.part', 'wb', compresslevel=level) as out:
+        for batch in _batches(db, session, name, read_concern, batch_size):
+            if fmt == 'bson':
+                out.write(b''.join(doc.raw for doc in batch))
+            else:
+                out.write(''.join(
+                    json_util.dumps(bson.decode(doc.raw), json_options=JSON_OPTIONS) + '\n' for doc in batch
+                ).encode())
+            count += len(batch)
+    os.replace(path + '.part', path)
+    return count
+
+
+def dump(db, directory, infos, fmt='bson', jobs=4, level=6, batch_size=1000, at_cluster_time=None, progress=None):
+    """Dumps the collections in `infos` into `directory` and writes the manifest, which it returns."""
+    os.makedirs(directory, exist_ok=True)
+    # Largest first, so the longest dumps start early
+    names = sorted(infos, key=lambda name: db[name].estimated_document_count(), reverse=True)
+
+    def work(name):
+        started = datetime.utcnow()
+        indexes = [index for index in db[name].list_indexes() if index['name'] != '_id_']
+        count = dump_collection(db, name, directory, fmt, at_cluster_time, level, batch_size)
+        if progress:
+            progress(name, count, (datetime.utcnow() - started).total_seconds())
+        return name, {
+            'file': name + FORMATS[fmt],
+            'count': count,
+            'options': infos[name].get('options', {}),
+            'indexes': indexes,
+        }
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        collections = dict(sorted(pool.map(work, names)))
+    manifest = {
+        'database': db.name,
+        'created_at': datetime.utcnow(),
+        'format': fmt,
+        'snapshot': at_cluster_time,
+        'collections': collections,
+    }
+    with open(os.path.join(directory, MANIFEST), 'w') as out:
+        out.write(json_util.dumps(manifest, json_options=JSON_OPTIONS, indent=2))
+    return manifest
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as manifest:
+            return json_util.loads(manifest.read(), json_options=JSON_OPTIONS)
+    except FileNotFoundError:
+        raise BackupError(f"{directory} has no {MANIFEST}; is it a dump_data directory?")
+
+
+def read_documents(path, fmt):
+    """Documents of a dump file: RawBSONDocuments for BSON, dicts for NDJSON."""
+    with gzip.open(path, 'rb') as source:
+        if fmt == 'bson':
+            yield from bson.decode_file_iter(source, RAW)
+        else:
+            for line in source:
+                if line.strip():
+                    yield json_util.loads(line, json_options=JSON_OPTIONS)
+
+
+def insert_batch(collection, batch):
+    """Inserts `batch` unordered; returns (inserted, failed)."""
+    try:
+        inserted = len(collection.insert_many(batch, ordered=False, bypass_document_validation=True).inserted_ids)
+    except BulkWriteError as exc:
+        inserted = exc.details['nInserted']
+    return inserted, len(batch) - inserted
+
+
+def build_indexes(collection, indexes):
+    models = [
+        IndexModel(list(index['key'].items()), **{k: v for k, v in index.items() if k not in INDEX_INFO_KEYS})
+        for index in indexes
+    ]
+    if models:
+        collection.create_indexes(models)
+    return len(models)
+
+
+def restore(db, directory, manifest, names, jobs=4, batch_size=1000, drop=False, indexes=True):
+    """
+    Loads the collections `names` of a dump into `db`, then builds their
+    indexes. Returns {name: {'inserted', 'failed', 'indexes'}}.
+    """
+    existing = set(db.list_collection_names())
+    if not drop:
+        busy = [name for name in names if name in existing and db[name].estimated_document_count()]
+        if busy:
+            raise BackupError(f"Not empty: {', '.join(busy)}. Use --drop to replace them.")
+
+    results = {name: {'inserted': 0, 'failed': 0, 'indexes': 0} for name in names}
+    # Bounds the batches read ahead of the inserting threads
+    slots = threading.BoundedSemaphore(jobs * 2)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        loads = []
+        for name in names:
+            entry = manifest['collections'][name]
+            if drop and name in existing:
+                db.drop_collection(name)
+            if drop or name not in existing:
+                db.create_collection(name, **entry.get('options', {}))
+            # Acknowledged by the primary only; the data is a copy and can be reloaded
+            collection = db.get_collection(name, write_concern=WriteConcern(w=1))
+            documents = read_documents(os.path.join(directory, entry['file']), manifest['format'])
+            while True:
+                batch = list(islice(documents, batch_size))
+                if not batch:
+                    break
+                slots.acquire()
+                future = pool.submit(insert_batch, collection, batch)
+                future.add_done_callback(lambda _: slots.release())
+                loads.append((name, future))
+        for name, future in loads:
+            inserted, failed = future.result()
+            results[name]['inserted'] += inserted
+            results[name]['failed'] += failed
+
+        if indexes:
+            builds = {
+                name: pool.submit(build_indexes, db[name], manifest['collections'][name]['indexes'])
+                for name in names
+            }
+            for name, future in builds.items():
+                results[name]['indexes'] = future.result()
+    return results
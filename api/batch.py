@@ -0,0 +1,233 @@
+"""
+Batch requests.
+
+POST /api/batch/ runs an ordered list of operations
+
+    {"operations": [{"method": "POST", "path": "/api/subscribers/", "body": {...}}, ...],
+     "atomic": false}
+
+as the already authenticated caller. Each operation is dispatched to the
+view its path resolves to, so it goes through the same viewsets and
+serializers as a standalone call.
+
+Runs of consecutive creates on a collection listed in BULK_CREATES are
+validated one by one with their serializer. The valid ones are then written
+together: one counter update allocates their ids, one insert_many writes the
+documents and one writes their outbox events. If the bulk insert fails
+(e.g. a duplicate phone), the run falls back to dispatching its operations
+one by one, so every operation still gets its own result.
+
+With "atomic": true every operation runs in one transaction. The first
+failure rolls everything back. This needs MONGO_TRANSACTIONS.
+"""
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.test.client import RequestFactory
+from django.urls import Resolver404, resolve
+from mongoengine import ValidationError as DocumentValidationError
+from pymongo.errors import BulkWriteError
+
+from magazine.mongo import transaction
+
+from .models import MagazineSubscriber, OutboxEvent, Subscription
+from .serializers import MagazineSubscriberSerializer, SubscriptionSerializer
+from .utils import generate_id_block
+
+METHODS = {'GET', 'POST', 'PUT', 'PATCH', 'DELETE'}
+
+
+class BatchError(ValueError):
+    pass
+
+
+class Rollback(Exception):
+    """Aborts the atomic transaction after a failed operation."""
+
+
+@dataclass(frozen=True)
+class BulkCreate:
+    serializer_class: type
+    model: type
+    id_prefix: str
+    counter: str
+
+    def after_insert(self, instances):
+        pass
+
+
+class BulkSubscriptionCreate(BulkCreate):
+    def after_insert(self, instances):
+        # One flag update per subscriber; a running subscription settles it without counting
+        by_subscriber = {}
+        for instance in instances:
+            current = by_subscriber.get(instance.subscriber.pk)
+            if current is None or (instance.end_date or datetime.min.date()) > (current.end_date or datetime.min.date()):
+                by_subscriber[instance.subscriber.pk] = instance
+        for subscriber_id, latest in by_subscriber.items():
+            Subscription.update_active_subscription_flag(subscriber_id, saved=latest)
+
+
+# Collection path -> how to create its documents in bulk; ids match the models' defaults
+BULK_CREATES = {
+    '/api/subscribers/': BulkCreate(MagazineSubscriberSerializer, MagazineSubscriber, 'SUBS', 'subscriber'),
+    '/api/subscriptions/': BulkSubscriptionCreate(SubscriptionSerializer, Subscription, 'SUBSCR', 'subscription'),
+}
+
+_factory = RequestFactory()
+
+
+def parse_operations(payload):
+    operations = payload.get('operations')
+    if not isinstance(operations, list) or not operations:
+        raise BatchError("operations must be a non-empty list.")
+    if len(operations) > settings.BATCH_MAX_OPERATIONS:
+        raise BatchError(f"At most {settings.BATCH_MAX_OPERATIONS} operations per batch.")
+
+    parsed = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise BatchError(f"Operation {index} must be an object.")
+        method = str(operation.get('method', 'GET')).upper()
+        path = operation.get('path') or ''
+        if method not in METHODS:
+            raise BatchError(f"Operation {index}: unsupported method {method}.")
+        if not path.startswith('/api/') or urlsplit(path).path.rstrip('/') == '/api/batch':
+            raise BatchError(f"Operation {index}: path must be an /api/ endpoint other than /api/batch/.")
+        parsed.append({'method': method, 'path': path, 'body': operation.get('body')})
+    return parsed
+
+
+def dispatch(request, operation):
+    """Runs one operation through its view as the batch caller; returns {'status', 'body'}."""
+    method, path = operation['method'], operation['path']
+    body = json.dumps(operation['body'] or {}) if method in ('POST', 'PUT', 'PATCH') else ''
+    sub_request = _factory.generic(
+        method, path, data=body, content_type='application/json',
+        HTTP_X_REQUEST_ID=request.META.get('HTTP_X_REQUEST_ID', ''),
+    )
+    # DRF authenticates requests carrying these with ForcedAuthentication
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    # The batch request was throttled as a whole (see api/throttling.py)
+    sub_request.batch_operation = True
+
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        return {'status': 404, 'body': {'detail': 'Not found.'}}
+    response = match.func(sub_request, *match.args, **match.kwargs)
+    return {'status': response.status_code, 'body': getattr(response, 'data', None)}
+
+
+def bulk_create(request, spec, group):
+    """
+    Creates the documents of a run of create operations with bulk writes.
+    `group` is a list of (index, operation); returns {index: result}.
+    """
+    results, pending = {}, []
+    for index, operation in group:
+        serializer = spec.serializer_class(data=operation['body'] or {}, context={'request': request})
+        if serializer.is_valid():
+            pending.append((index, serializer))
+        else:
+            results[index] = {'status': 400, 'body': serializer.errors}
+
+    instances = []
+    if pending:
+        ids = generate_id_block(spec.id_prefix, spec.counter, len(pending))
+        now = datetime.utcnow()
+        for (index, serializer), _id in zip(pending, ids):
+            # Passing _id skips the per-document counter round trip of the default
+            instance = spec.model(_id=_id, updated_at=now, **serializer.validated_data)
+            try:
+                instance.validate()
+            except DocumentValidationError as e:
+                results[index] = {'status': 400, 'body': {'detail': str(e)}}
+                continue
+            instances.append((index, serializer, instance))
+
+    if not instances:
+        return results
+
+    try:
+        with transaction() as session:
+            spec.model._get_collection().insert_many(
+                [instance.to_mongo() for _, _, instance in instances], ordered=True, session=session,
+            )
+            _after_insert(spec, [instance for _, _, instance in instances], session)
+        created, retry = instances, []
+    except BulkWriteError as e:
+        # A transaction rolled everything back; without one the first nInserted documents are in
+        inserted = 0 if settings.MONGO_TRANSACTIONS else e.details.get('nInserted', 0)
+        created, retry = instances[:inserted], instances[inserted:]
+        if created:
+            _after_insert(spec, [instance for _, _, instance in created], None)
+
+    for index, serializer, instance in created:
+        instance._created = False
+        serializer.instance = instance
+        results[index] = {'status': 201, 'body': serializer.data}
+    # Run the rest one by one for exact per-operation errors
+    operations = dict(group)
+    for index, _, _ in retry:
+        results[index] = dispatch(request, operations[index])
+    return results
+
+
+def _after_insert(spec, instances, session):
+    """Outbox events and derived updates for documents written by insert_many."""
+    now = datetime.utcnow()
+    collection_name = spec.model._get_collection_name()
+    OutboxEvent._get_collection().insert_many([
+        {'collection': collection_name, 'op': 'insert', 'doc_id': str(instance.pk),
+         'changed': [], 'data': instance.event_data(), 'ts': now}
+        for instance in instances
+    ], session=session)
+    spec.after_insert(instances)
+
+
+def _bulk_spec(operation, atomic):
+    if atomic or operation['method'] != 'POST':
+        return None
+    return BULK_CREATES.get(urlsplit(operation['path']).path)
+
+
+def run_operations(request, operations, atomic=False):
+    results = [None] * len(operations)
+    index = 0
+    while index < len(operations):
+        spec = _bulk_spec(operations[index], atomic)
+        if spec is None:
+            results[index] = dispatch(request, operations[index])
+            if atomic and results[index]['status'] >= 400:
+                raise Rollback(index, results)
+            index += 1
+            continue
+        end = index
+        while end < len(operations) and _bulk_spec(operations[end], atomic) is spec:
+            end += 1
+        for position, result in bulk_create(request, spec, list(enumerate(operations[index:end], index))).items():
+            results[position] = result
+        index = end
+    return results
+
+
+def run_batch(request, operations, atomic=False):
+    """Returns (committed, results)."""
+    if not atomic:
+        return True, run_operations(request, operations)
+    if not settings.MONGO_TRANSACTIONS:
+        raise BatchError("atomic batches need MongoDB transactions (MONGO_TRANSACTIONS).")
+    try:
+        with transaction():
+            return True, run_operations(request, operations, atomic=True)
+    except Rollback as rollback:
+        failed, results = rollback.args
+        return False, [
+            result if position == failed else {'status': 424, 'body': {'detail': 'Rolled back.'}}
+            for position, result in enumerate(results[:failed + 1])
+        ] + [{'status': 424, 'body': {'detail': 'Not run.'}}] * (len(operations) - failed - 1)
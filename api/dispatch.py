@@ -0,0 +1,160 @@
+"""
+Monthly dispatch manifest.
+
+1. Snapshot: one aggregation selects the subscriptions running on the
+   dispatch date (by start_date/end_date, not the hasActiveSubscriptions
+   flag), groups them per subscriber, joins the address and $merges one
+   DispatchEntry per subscriber for the issue. A re-run for the same issue
+   reuses the snapshot unless forced.
+2. Output: entries stream back in state, district, pincode, name order
+   through the dispatch_manifest_order index, so memory stays flat. A single
+   pass writes the CSV manifest, the label PDF and the per-pincode bundle
+   counts.
+"""
+import csv
+import os
+from datetime import datetime
+
+from django.conf import settings
+
+from .labels import get_template, render_labels, subscriber_label_fields
+from .models import DispatchEntry, DispatchRun, MagazineSubscriber, Subscription
+
+MANIFEST_ORDER = [('issue', 1), ('state', 1), ('district', 1), ('pincode', 1), ('name', 1)]
+LABEL_TEMPLATE = 'a4-portrait-3x8'
+MANIFEST_FIELDS = ['state', 'district', 'pincode', 'name', 'address', 'city_town', 'phone', 'copies', 'subscriber']
+BUNDLE_FIELDS = ['state', 'district', 'pincode', 'subscribers', 'copies']
+
+
+def issue_for(dispatch_date):
+    return f"{dispatch_date:%Y-%m}"
+
+
+def snapshot_pipeline(issue, dispatch_date):
+    day = datetime.combine(dispatch_date, datetime.min.time())
+    return [
+        {'$match': {'end_date': {'$gte': day}, 'start_date': {'$lte': day}}},
+        {'$group': {'_id': '$subscriber', 'copies': {'$sum': 1}}},
+        {'$lookup': {
+            'from': MagazineSubscriber._get_collection_name(),
+            'localField': '_id',
+            'foreignField': '_id',
+            'as': 'subscriber_doc',
+        }},
+        {'$unwind': '$subscriber_doc'},
+        {'$match': {'subscriber_doc.isDeleted': {'$ne': True}}},
+        {'$project': {
+            '_id': {'$concat': [f'{issue}:', '$_id']},
+            'issue': {'$literal': issue},
+            'subscriber': '$_id',
+            'copies': 1,
+            'name': '$subscriber_doc.name',
+            'address': '$subscriber_doc.address',
+            'city_town': '$subscriber_doc.city_town',
+            'district': {'$ifNull': ['$subscriber_doc.district', '']},
+            'state': {'$ifNull': ['$subscriber_doc.state', '']},
+            'pincode': {'$ifNull': ['$subscriber_doc.pincode', '']},
+            'phone': '$subscriber_doc.phone',
+        }},
+        {'$merge': {
+            'into': DispatchEntry._get_collection_name(),
+            'on': '_id',
+            'whenMatched': 'replace',
+            'whenNotMatched': 'insert',
+        }},
+    ]
+
+
+def snapshot(issue, dispatch_date, force=False):
+    """
+    Returns the DispatchRun for `issue`, taking the snapshot unless a finished
+    one exists. An unfinished snapshot (a crashed run) is always retaken.
+    """
+    run = DispatchRun.objects(pk=issue).first()
+    if run and run.status == 'ready' and not force:
+        if run.dispatch_date != dispatch_date:
+            raise ValueError(
+                f"Issue {issue} was snapshotted for {run.dispatch_date}; use force to retake it for {dispatch_date}."
+            )
+        return run
+
+    DispatchRun.objects(pk=issue).update_one(
+        set__dispatch_date=dispatch_date, set__status='snapshotting', set__created_at=datetime.utcnow(),
+        unset__completed_at=True, upsert=True,
+    )
+    entries = DispatchEntry._get_collection()
+    entries.delete_many({'issue': issue})
+    Subscription._get_collection().aggregate(snapshot_pipeline(issue, dispatch_date), allowDiskUse=True)
+
+    pincodes = len(entries.distinct('pincode', {'issue': issue}))
+    DispatchRun.objects(pk=issue).update_one(
+        set__status='ready', set__entries=entries.count_documents({'issue': issue}), set__pincodes=pincodes,
+    )
+    return DispatchRun.objects.get(pk=issue)
+
+
+def manifest_entries(issue):
+    # Served by the dispatch_manifest_order index; allow_disk_use lets the
+    # server fall back to an external sort if the index has not been synced
+    return DispatchEntry._get_collection().find(
+        {'issue': issue}, batch_size=2000, allow_disk_use=True,
+    ).sort(MANIFEST_ORDER)
+
+
+def write_outputs(issue, output_dir=None):
+    """
+    Writes manifest.csv, labels.pdf and bundles.csv for `issue` into
+    `output_dir` (default DISPATCH_OUTPUT_DIR/<issue>) and returns their paths.
+    """
+    output_dir = output_dir or os.path.join(settings.DISPATCH_OUTPUT_DIR, issue)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {name: os.path.join(output_dir, name) for name in ('manifest.csv', 'labels.pdf', 'bundles.csv')}
+
+    with open(paths['manifest.csv'], 'w', newline='', encoding='utf-8') as manifest_file, \
+            open(paths['bundles.csv'], 'w', newline='', encoding='utf-8') as bundle_file:
+        manifest = csv.DictWriter(manifest_file, fieldnames=MANIFEST_FIELDS, extrasaction='ignore')
+        manifest.writeheader()
+        bundles = csv.DictWriter(bundle_file, fieldnames=BUNDLE_FIELDS)
+        bundles.writeheader()
+
+        def labels():
+            # Entries arrive pincode by pincode, so each bundle is closed as soon as the pincode changes
+            bundle = None
+            for entry in manifest_entries(issue):
+                manifest.writerow(entry)
+                key = (entry['state'], entry['district'], entry['pincode'])
+                if bundle is None or bundle['key'] != key:
+                    if bundle:
+                        bundles.writerow(_bundle_row(bundle))
+                    bundle = {'key': key, 'subscribers': 0, 'copies': 0}
+                bundle['subscribers'] += 1
+                bundle['copies'] += entry.get('copies') or 1
+                fields = subscriber_label_fields(
+                    entry.get('name'), entry.get('address'), entry.get('city_town'), entry.get('district'),
+                    entry.get('state'), entry.get('pincode'), None,
+                )
+                for _ in range(entry.get('copies') or 1):
+                    yield fields
+            if bundle:
+                bundles.writerow(_bundle_row(bundle))
+
+        with open(paths['labels.pdf'], 'wb') as label_file:
+            render_labels([(None, labels())], get_template(LABEL_TEMPLATE), output=label_file)
+    return paths
+
+
+def _bundle_row(bundle):
+    state, district, pincode = bundle['key']
+    return {
+        'state': state, 'district': district, 'pincode': pincode,
+        'subscribers': bundle['subscribers'], 'copies': bundle['copies'],
+    }
+
+
+def run_dispatch(dispatch_date, output_dir=None, force=False):
+    issue = issue_for(dispatch_date)
+    run = snapshot(issue, dispatch_date, force=force)
+    paths = write_outputs(issue, output_dir)
+    DispatchRun.objects(pk=issue).update_one(set__outputs=paths, set__completed_at=datetime.utcnow())
+    run.reload()
+    return run
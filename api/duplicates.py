@@ -0,0 +1,246 @@
+"""
+Duplicate subscriber detection.
+
+Fuzzy comparison runs only between members of the same block, so the work
+grows with block sizes, not with the square of the collection. There are
+three blocking keys: the pincode, a phonetic name key and a normalised
+address prefix. Blocking happens in two passes:
+1. Subscribers are streamed in pincode order through an index. Within each
+   pincode they are blocked by name key and by address prefix.
+2. The same name and address keys, across pincodes, pair up records whose
+   pincode was mistyped. Only (_id, pincode) per key is kept in memory from
+   the first pass. The members of cross-pincode blocks are then fetched by
+   _id in chunks.
+
+Pairs that score above the threshold are stored as DuplicateCandidate
+documents, ranked by score.
+"""
+import itertools
+import re
+from datetime import datetime
+from difflib import SequenceMatcher
+
+from pymongo import UpdateOne
+
+from magazine.mongo import analytical_read_preference, transaction
+
+from .models import DuplicateCandidate, MagazineSubscriber, OutboxEvent, Subscription
+
+HONORIFICS = {'sri', 'shri', 'smt', 'sriman', 'srimathi', 'dr', 'mr', 'mrs', 'ms', 'prof', 'late'}
+
+# Spelling variants common in transliterated Indian names
+PHONETIC_REPLACEMENTS = [
+    ('ph', 'f'), ('bh', 'b'), ('dh', 'd'), ('th', 't'), ('kh', 'k'), ('gh', 'g'),
+    ('sh', 's'), ('ch', 'c'), ('w', 'v'), ('z', 'j'), ('q', 'k'), ('x', 'ks'), ('y', 'i'),
+]
+
+ADDRESS_PREFIX_LENGTH = 12
+DEFAULT_THRESHOLD = 0.78
+DEFAULT_MAX_BLOCK_SIZE = 200
+# Cross-pincode blocks whose members are fetched with one $in query
+CROSS_BLOCK_CHUNK = 500
+
+SUBSCRIBER_FIELDS = {'name': 1, 'address': 1, 'pincode': 1, 'phone': 1, 'email': 1}
+
+
+def normalize_name(name):
+    tokens = re.findall(r'[a-z]+', (name or '').lower())
+    return ' '.join(token for token in tokens if token not in HONORIFICS)
+
+
+def phonetic_token(token):
+    for source, target in PHONETIC_REPLACEMENTS:
+        token = token.replace(source, target)
+    token = token.replace('h', '')
+    token = re.sub(r'(.)\1+', r'\1', token)
+    # Keep the first letter, drop the vowels that transliterations disagree on
+    return token[:1] + re.sub(r'[aeiou]', '', token[1:])
+
+
+def phonetic_key(name):
+    tokens = [phonetic_token(token) for token in normalize_name(name).split()]
+    return ' '.join(sorted(token for token in tokens if token))
+
+
+def normalize_address(address):
+    return re.sub(r'[^a-z0-9]', '', (address or '').lower())
+
+
+def blocking_keys(subscriber):
+    keys = []
+    name_key = phonetic_key(subscriber.get('name'))
+    if name_key:
+        keys.append(f"n:{name_key}")
+    address_key = normalize_address(subscriber.get('address'))[:ADDRESS_PREFIX_LENGTH]
+    if len(address_key) >= 4:
+        keys.append(f"a:{address_key}")
+    return keys
+
+
+def similarity(first, second):
+    if not first or not second:
+        return 0.0
+    return SequenceMatcher(None, first, second).ratio()
+
+
+def score_pair(first, second):
+    """Weighted similarity in [0, 1] and the reasons that contributed to it."""
+    name_score = similarity(normalize_name(first.get('name')), normalize_name(second.get('name')))
+    address_score = similarity(normalize_address(first.get('address')), normalize_address(second.get('address')))
+    reasons = []
+    if phonetic_key(first.get('name')) == phonetic_key(second.get('name')):
+        reasons.append('phonetic name match')
+        name_score = max(name_score, 0.9)
+    if name_score >= 0.85:
+        reasons.append(f"name {name_score:.2f}")
+    if address_score >= 0.8:
+        reasons.append(f"address {address_score:.2f}")
+
+    score = 0.55 * name_score + 0.45 * address_score
+    if first.get('email') and first.get('email') == second.get('email'):
+        score = max(score, 0.95)
+        reasons.append('same email')
+    return round(score, 4), reasons
+
+
+def _pairs(members, compared, threshold):
+    for first, second in itertools.combinations(members, 2):
+        pair = DuplicateCandidate.make_id(first['_id'], second['_id'])
+        if pair in compared:
+            continue
+        compared.add(pair)
+        score, reasons = score_pair(first, second)
+        if score >= threshold:
+            yield first, second, score, reasons
+
+
+def _cross_pincode_blocks(keys, max_block_size):
+    """Global name/address blocks whose members live in more than one pincode."""
+    for members in keys.values():
+        if 2 <= len(members) <= max_block_size and len({pincode for _, pincode in members}) > 1:
+            yield members
+
+
+def find_candidates(threshold=DEFAULT_THRESHOLD, max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+    """
+    Yields (first, second, score, reasons) for likely duplicate pairs among
+    active subscribers. Blocks bigger than `max_block_size` are skipped,
+    because they point to a key that is too coarse, not to duplicates.
+    """
+    # A full scan; a slightly stale secondary is fine for finding candidates
+    collection = MagazineSubscriber._get_collection().with_options(read_preference=analytical_read_preference())
+    cursor = collection.find(
+        {'isDeleted': False}, SUBSCRIBER_FIELDS, batch_size=2000
+    ).sort('pincode', 1)
+
+    # Pass 1: name and address blocks within each pincode
+    keys = {}
+    for pincode, group in itertools.groupby(cursor, key=lambda subscriber: subscriber.get('pincode')):
+        blocks = {}
+        for subscriber in group:
+            for key in blocking_keys(subscriber):
+                blocks.setdefault(key, []).append(subscriber)
+                keys.setdefault(key, []).append((subscriber['_id'], pincode))
+
+        compared = set()
+        for members in blocks.values():
+            if 2 <= len(members) <= max_block_size:
+                yield from _pairs(members, compared, threshold)
+
+    # Pass 2: the same keys across pincodes; pairs within one pincode were compared above
+    compared = set()
+    cross_blocks = _cross_pincode_blocks(keys, max_block_size)
+    while True:
+        chunk = list(itertools.islice(cross_blocks, CROSS_BLOCK_CHUNK))
+        if not chunk:
+            break
+        ids = list({subscriber_id for members in chunk for subscriber_id, _ in members})
+        docs = {doc['_id']: doc for doc in collection.find({'_id': {'$in': ids}}, SUBSCRIBER_FIELDS)}
+        for members in chunk:
+            for (first_id, first_pincode), (second_id, second_pincode) in itertools.combinations(members, 2):
+                if first_pincode == second_pincode or first_id not in docs or second_id not in docs:
+                    continue
+                yield from _pairs([docs[first_id], docs[second_id]], compared, threshold)
+
+
+def detect_duplicates(threshold=DEFAULT_THRESHOLD, max_block_size=DEFAULT_MAX_BLOCK_SIZE, batch_size=1000):
+    """Stores candidate pairs, keeping the status of pairs already merged or dismissed. Returns the pair count."""
+    collection = DuplicateCandidate._get_collection()
+    operations, found = [], 0
+    for first, second, score, reasons in find_candidates(threshold, max_block_size):
+        first_id, second_id = sorted((first['_id'], second['_id']))
+        operations.append(UpdateOne(
+            {'_id': DuplicateCandidate.make_id(first_id, second_id)},
+            {
+                '$set': {'score': score, 'reasons': reasons, 'detected_at': datetime.utcnow()},
+                '$setOnInsert': {'subscriber_a': first_id, 'subscriber_b': second_id, 'status': 'open'},
+            },
+            upsert=True,
+        ))
+        found += 1
+        if len(operations) >= batch_size:
+            collection.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    return found
+
+
+def move_subscriptions(from_id, to_id, session=None):
+    """
+    Re-points the subscriptions of subscriber `from_id` at `to_id` and appends
+    one update event per subscription. Returns the number moved.
+    """
+    collection = Subscription._get_collection()
+    docs = list(collection.find(
+        {'subscriber': from_id}, dict.fromkeys(Subscription.event_fields, 1), session=session,
+    ))
+    if not docs:
+        return 0
+    now = datetime.utcnow()
+    collection.update_many(
+        {'_id': {'$in': [doc['_id'] for doc in docs]}},
+        {'$set': {'subscriber': to_id, 'updated_at': now}},
+        session=session,
+    )
+    OutboxEvent._get_collection().insert_many([
+        {'collection': Subscription._get_collection_name(), 'op': 'update', 'doc_id': str(doc['_id']),
+         'changed': ['subscriber'], 'ts': now,
+         'data': dict({field: doc.get(field) for field in Subscription.event_fields}, subscriber=to_id)}
+        for doc in docs
+    ], session=session)
+    return len(docs)
+
+
+def merge_subscribers(survivor, duplicate):
+    """
+    Moves every subscription of `duplicate` onto `survivor`, soft-deletes the
+    duplicate with a note pointing at the survivor and closes its candidate
+    pairs. Returns the number of subscriptions moved.
+    """
+    if survivor.pk == duplicate.pk:
+        raise ValueError("A subscriber cannot be merged into itself.")
+    if survivor.isDeleted:
+        raise ValueError("Cannot merge into an inactive subscriber.")
+
+    now = datetime.utcnow()
+    note = f"Merged into {survivor.pk} on {now:%Y-%m-%d}."
+    # The retirement of the duplicate, the move and their events commit together
+    with transaction() as session:
+        # Only a live duplicate is retired; a concurrent merge or delete loses cleanly
+        if not MagazineSubscriber.conditional_set(
+            duplicate.pk,
+            {'isDeleted': False},
+            {'isDeleted': True, 'deleted_at': now, 'hasActiveSubscriptions': False,
+             'notes': f"{duplicate.notes}\n{note}" if duplicate.notes else note},
+        ):
+            raise ValueError("The duplicate is already inactive.")
+        moved = move_subscriptions(duplicate.pk, survivor.pk, session)
+        Subscription.update_active_subscription_flag(survivor)
+
+    DuplicateCandidate.objects(pk=DuplicateCandidate.make_id(survivor.pk, duplicate.pk)).update(set__status='merged')
+    # Other pairs of the retired record are re-detected against the survivor on the next run
+    DuplicateCandidate.objects(
+        status='open', __raw__={'$or': [{'subscriber_a': duplicate.pk}, {'subscriber_b': duplicate.pk}]}
+    ).update(set__status='dismissed')
+    return moved
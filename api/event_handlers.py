@@ -0,0 +1,30 @@
+"""
+Built-in outbox handlers (see api/outbox.py). Each must be idempotent,
+because events can be delivered more than once.
+"""
+from .models import GeoDirtyPincode, MagazineSubscriber, Subscription
+from .outbox import handler
+
+SUBSCRIBERS = MagazineSubscriber._get_collection_name()
+SUBSCRIPTIONS = Subscription._get_collection_name()
+
+
+def _subscriber_pincode(subscriber_id):
+    doc = MagazineSubscriber._get_collection().find_one({'_id': subscriber_id}, {'pincode': 1})
+    return doc.get('pincode') if doc else None
+
+
+@handler(SUBSCRIBERS)
+def mark_subscriber_pincode_dirty(event):
+    """Geo rollups: a subscriber change affects its pincode, and its old one if it moved."""
+    data = event.get('data') or {}
+    GeoDirtyPincode.mark(data.get('pincode'), data.get('previous_pincode'))
+
+
+@handler(SUBSCRIPTIONS)
+def mark_subscription_pincode_dirty(event):
+    """Geo rollups: adding or removing a subscription can change whether its subscriber counts as active."""
+    subscriber_id = (event.get('data') or {}).get('subscriber')
+    if subscriber_id:
+        GeoDirtyPincode.mark(_subscriber_pincode(subscriber_id))
+
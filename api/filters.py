@@ -1,9 +1,53 @@
-import django_filters
-from .models import SubscriptionMode
+from datetime import date
 
-class SubscriptionModeFilter(django_filters.FilterSet):
-    name = django_filters.CharFilter(field_name='name', lookup_expr='icontains')
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
 
-    class Meta:
-        model = SubscriptionMode
-        fields = ['name']
+from .models import Subscription
+
+
+class SubscriptionFilterBackend(BaseFilterBackend):
+    """
+    Query-string filters for subscriptions, each served by an index in
+    api/indexes.py:
+
+    - subscriber, plan, payment_status, payment_mode: exact match;
+    - start_after / start_before, end_after / end_before: inclusive date ranges;
+    - active_on: subscriptions running on that date.
+    """
+    EXACT = {
+        'subscriber': 'subscriber',
+        'plan': 'subscription_plan',
+        'payment_status': 'payment_status',
+        'payment_mode': 'payment_mode',
+    }
+    RANGES = {
+        'start_after': 'start_date__gte',
+        'start_before': 'start_date__lte',
+        'end_after': 'end_date__gte',
+        'end_before': 'end_date__lte',
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        status_choices = Subscription._fields['payment_status'].choices
+        if params.get('payment_status') and params['payment_status'] not in status_choices:
+            raise ValidationError({'payment_status': f"Must be one of: {', '.join(status_choices)}."})
+
+        for param, field in self.EXACT.items():
+            if params.get(param):
+                queryset = queryset.filter(**{field: params[param]})
+        # Chained so that e.g. start_before and active_on both apply
+        for param, lookup in self.RANGES.items():
+            if params.get(param):
+                queryset = queryset.filter(**{lookup: self.parse_date(param, params[param])})
+        if params.get('active_on'):
+            day = self.parse_date('active_on', params['active_on'])
+            queryset = queryset.filter(start_date__lte=day, end_date__gte=day)
+        return queryset
+
+    def parse_date(self, param, value):
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise ValidationError({param: "Use YYYY-MM-DD."})
@@ -0,0 +1,173 @@
+"""
+Geographic distribution of active subscribers.
+
+Counts of active subscribers (not deleted, with a subscription that has not
+ended) are kept per pincode, category and type in the GeoRollup collection.
+State and district come from the pincode directory where it knows the
+pincode, so spelling differences in hand-typed addresses do not split a
+district.
+
+Subscriber and subscription change events mark pincodes dirty (handlers
+in api/event_handlers.py). A read that misses the cache first refreshes
+the oldest REFRESH_BATCH_SIZE dirty pincodes, so only the pincodes that
+changed are re-aggregated and the request stays within its query budget;
+a larger backlog drains over later misses or `refresh_geo_rollups`.
+Subscriptions that expire without any write are picked up by the daily
+`refresh_geo_rollups --full`. Drill-down answers are cached for
+GEO_ROLLUP_CACHE_SECONDS. Refreshes read the primary. Drill-down reads
+follow the request's read routing, so on a replica set an answer can lag by
+up to MONGO_ANALYTICS_MAX_STALENESS_SECONDS plus the cache time.
+"""
+from datetime import date, datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from pymongo import DeleteMany, InsertOne
+
+from magazine.mongo import reader
+
+from .metrics import record_cache
+from .models import GeoDirtyPincode, GeoRollup, MagazineSubscriber, SubscriberCategory, SubscriberType, Subscription
+from .pincodes import lookup_pincode
+
+LEVELS = ('state', 'district', 'pincode')
+REFRESH_BATCH_SIZE = 200
+UNKNOWN = 'Unknown'
+
+
+def rollup_pipeline(pincodes, as_of=None):
+    """Active subscriber counts per (pincode, category, stype) for the given pincodes."""
+    today = datetime.combine(as_of or date.today(), datetime.min.time())
+    return [
+        {'$match': {'isDeleted': False, 'pincode': {'$in': list(pincodes)}}},
+        {'$lookup': {
+            'from': Subscription._get_collection_name(),
+            'let': {'subscriber': '$_id'},
+            'pipeline': [
+                {'$match': {'$expr': {'$and': [
+                    {'$eq': ['$subscriber', '$$subscriber']},
+                    {'$gte': ['$end_date', today]},
+                ]}}},
+                {'$limit': 1},
+                {'$project': {'_id': 1}},
+            ],
+            'as': 'active',
+        }},
+        {'$match': {'active.0': {'$exists': True}}},
+        {'$group': {
+            '_id': {'pincode': '$pincode', 'category': '$category', 'stype': '$stype'},
+            'count': {'$sum': 1},
+            'state': {'$first': '$state'},
+            'district': {'$first': '$district'},
+        }},
+    ]
+
+
+def refresh_pincodes(pincodes, as_of=None):
+    """Recomputes the rollups of `pincodes` and returns the number of rollup rows written."""
+    pincodes = sorted(set(pincodes))
+    if not pincodes:
+        return 0
+    now = datetime.utcnow()
+    operations = [DeleteMany({'pincode': {'$in': pincodes}})]
+    for row in MagazineSubscriber._get_collection().aggregate(rollup_pipeline(pincodes, as_of)):
+        key = row['_id']
+        entry = lookup_pincode(key['pincode'])
+        operations.append(InsertOne({
+            '_id': f"{key['pincode']}:{key.get('category')}:{key.get('stype')}",
+            'state': (entry and entry.state) or row.get('state') or UNKNOWN,
+            'district': (entry and entry.district) or row.get('district') or UNKNOWN,
+            'pincode': key['pincode'],
+            'category': key.get('category'),
+            'stype': key.get('stype'),
+            'count': row['count'],
+            'refreshed_at': now,
+        }))
+    GeoRollup._get_collection().bulk_write(operations, ordered=True)
+    return len(operations) - 1
+
+
+def refresh_dirty(limit=None):
+    """Refreshes pincodes marked dirty, oldest first. Returns the number of pincodes refreshed."""
+    limit = limit or settings.GEO_ROLLUP_REFRESH_LIMIT
+    started = datetime.utcnow()
+    dirty = GeoDirtyPincode._get_collection()
+    pincodes = [doc['_id'] for doc in dirty.find({}, {'_id': 1}).sort('marked_at', 1).limit(limit)]
+    for start in range(0, len(pincodes), REFRESH_BATCH_SIZE):
+        refresh_pincodes(pincodes[start:start + REFRESH_BATCH_SIZE])
+    if pincodes:
+        # Marks made while refreshing stay for the next pass
+        dirty.delete_many({'_id': {'$in': pincodes}, 'marked_at': {'$lte': started}})
+    return len(pincodes)
+
+
+def rebuild(as_of=None):
+    """Recomputes every pincode and drops rollups of pincodes with no subscribers left. Returns the pincode count."""
+    started = datetime.utcnow()
+    pincodes = sorted(p for p in MagazineSubscriber._get_collection().distinct('pincode', {'isDeleted': False}) if p)
+    for start in range(0, len(pincodes), REFRESH_BATCH_SIZE):
+        refresh_pincodes(pincodes[start:start + REFRESH_BATCH_SIZE], as_of)
+    GeoRollup._get_collection().delete_many({'pincode': {'$nin': pincodes}})
+    GeoDirtyPincode._get_collection().delete_many({'marked_at': {'$lte': started}})
+    return len(pincodes)
+
+
+def cache_key(state=None, district=None):
+    return f"geo:{state or ''}:{district or ''}"
+
+
+def _names(model):
+    return {doc['_id']: doc.get('name') for doc in reader(model).find({}, {'name': 1})}
+
+
+def distribution(state=None, district=None):
+    """
+    One row per state, per district of `state`, or per pincode of `district`,
+    with the total and the split by category and type names.
+    """
+    level = LEVELS[0] if not state else LEVELS[1] if not district else LEVELS[2]
+    match = {}
+    if state:
+        match['state'] = state
+    if district:
+        match['district'] = district
+
+    pipeline = [
+        {'$match': match},
+        {'$group': {
+            '_id': {'name': f'${level}', 'category': '$category', 'stype': '$stype'},
+            'count': {'$sum': '$count'},
+        }},
+    ]
+    categories, types = _names(SubscriberCategory), _names(SubscriberType)
+
+    rows = {}
+    for group in reader(GeoRollup).aggregate(pipeline):
+        key = group['_id']
+        row = rows.setdefault(key['name'], {'name': key['name'], 'count': 0, 'categories': {}, 'types': {}})
+        row['count'] += group['count']
+        category = categories.get(key.get('category')) or UNKNOWN
+        stype = types.get(key.get('stype')) or UNKNOWN
+        row['categories'][category] = row['categories'].get(category, 0) + group['count']
+        row['types'][stype] = row['types'].get(stype, 0) + group['count']
+
+    results = sorted(rows.values(), key=lambda row: (-row['count'], row['name']))
+    return {
+        'level': level,
+        'state': state,
+        'district': district,
+        'total': sum(row['count'] for row in results),
+        'results': results,
+    }
+
+
+def cached_distribution(state=None, district=None):
+    key = cache_key(state, district)
+    data = cache.get(key)
+    record_cache('geo_rollup', data is not None)
+    if data is None:
+        # One batch (a find, an aggregate, a bulk_write and a delete) per request
+        refresh_dirty(limit=REFRESH_BATCH_SIZE)
+        data = distribution(state, district)
+        cache.set(key, data, settings.GEO_ROLLUP_CACHE_SECONDS)
+    return data
@@ -0,0 +1,218 @@
+"""
+Hot query shapes and the indexes that serve them.
+
+`sync_indexes` creates every index in INDEXES and checks with `explain` that
+every shape in QUERY_SHAPES is answered by an index scan. Add a shape and its
+index here when you add a query to a hot path.
+
+Keys use the MongoEngine meta notation: 'field' for ascending, '-field' for
+descending.
+"""
+from datetime import datetime
+
+from django.conf import settings
+
+from .models import (
+    ArchivedSubscriber, ArchivedSubscription, DispatchEntry, MagazineSubscriber, OutboxEvent, PaymentMode,
+    SubscriberCategory, SubscriberType, Subscription, SubscriptionLanguage, SubscriptionMode, SubscriptionPlan,
+    Tombstone, UserToken,
+)
+
+
+class IndexSpec:
+    def __init__(self, model, name, keys, partial=None, unique=False, sparse=False, expire_after_seconds=None):
+        self.model = model
+        self.name = name
+        self.keys = keys
+        self.partial = partial
+        self.unique = unique
+        self.sparse = sparse
+        self.expire_after_seconds = expire_after_seconds
+
+    @property
+    def key_pattern(self):
+        return [(key[1:], -1) if key.startswith('-') else (key, 1) for key in self.keys]
+
+    def options(self):
+        options = {}
+        if self.partial:
+            options['partialFilterExpression'] = self.partial
+        if self.unique:
+            options['unique'] = True
+        if self.sparse:
+            options['sparse'] = True
+        if self.expire_after_seconds is not None:
+            options['expireAfterSeconds'] = self.expire_after_seconds
+        return options
+
+
+class QueryShape:
+    """A query as the application issues it, with representative values for explain."""
+
+    def __init__(self, model, name, filter, sort=None, source=''):
+        self.model = model
+        self.name = name
+        self.filter = filter
+        self.sort = sort or []
+        self.source = source
+
+    @property
+    def sort_spec(self):
+        return [(key[1:], -1) if key.startswith('-') else (key, 1) for key in self.sort]
+
+
+INDEXES = [
+    # Subscriber list tabs: current/renewal filter on hasActiveSubscriptions among
+    # non-deleted subscribers, inactive lists deleted ones; all sort by -_id
+    IndexSpec(MagazineSubscriber, 'subscriber_tabs_live', ['hasActiveSubscriptions', '-_id'],
+              partial={'isDeleted': False}),
+    IndexSpec(MagazineSubscriber, 'subscriber_tab_inactive', ['isDeleted', '-_id'],
+              partial={'isDeleted': True}),
+    IndexSpec(MagazineSubscriber, 'subscriber_report', ['isDeleted', 'stype', 'category', '-_id']),
+    # Duplicate detection streams live subscribers grouped by pincode
+    IndexSpec(MagazineSubscriber, 'subscriber_pincode', ['pincode'], partial={'isDeleted': False}),
+
+    # Archiving selects subscribers deleted before the retention cutoff
+    IndexSpec(MagazineSubscriber, 'subscriber_deleted_at', ['deleted_at'], partial={'isDeleted': True}),
+
+    # Active-flag maintenance counts a subscriber's subscriptions by end_date
+    IndexSpec(Subscription, 'subscription_subscriber_end_date', ['subscriber', 'end_date']),
+    # Subscription list (SubscriptionFilterBackend + KeysetPagination): each
+    # exact-match filter followed by the (start_date, _id) keyset order. The
+    # subscriber one also serves the subscriber detail history.
+    IndexSpec(Subscription, 'subscription_start_date_keyset', ['-start_date', '-_id']),
+    IndexSpec(Subscription, 'subscription_subscriber_keyset', ['subscriber', '-start_date', '-_id']),
+    IndexSpec(Subscription, 'subscription_plan_keyset', ['subscription_plan', '-start_date', '-_id']),
+    IndexSpec(Subscription, 'subscription_payment_status_keyset', ['payment_status', '-start_date', '-_id']),
+    IndexSpec(Subscription, 'subscription_payment_mode_keyset', ['payment_mode', '-start_date', '-_id']),
+    # Overlap/duplicate checks in SubscriptionSerializer.validate
+    IndexSpec(Subscription, 'subscription_overlap', ['subscriber', 'subscription_plan', 'start_date']),
+    # Statement reconciliation looks payments up by reference
+    IndexSpec(Subscription, 'subscription_payment_id', ['payment_id']),
+    # Renewal notices select subscriptions by expiry window
+    IndexSpec(Subscription, 'subscription_end_date', ['end_date']),
+
+    # Archive tier: subscriber detail reads archived subscriptions, the
+    # inactive tab pages archived subscribers by -_id (served by _id)
+    IndexSpec(ArchivedSubscription, 'subscription_archive_subscriber_start_date', ['subscriber', '-start_date']),
+    IndexSpec(ArchivedSubscriber, 'subscriber_archive_deleted', ['isDeleted', '-_id']),
+
+    # Dispatch manifests stream an issue's snapshot in postal bundling order
+    IndexSpec(DispatchEntry, 'dispatch_manifest_order', ['issue', 'state', 'district', 'pincode', 'name']),
+
+    # Consumers read the outbox by _id; events expire after the retention period
+    IndexSpec(OutboxEvent, 'outbox_event_ttl', ['ts'], expire_after_seconds=settings.OUTBOX_RETENTION_DAYS * 86400),
+
+    # Every authenticated request looks its token up
+    IndexSpec(UserToken, 'usertoken_token', ['token']),
+
+    # Delta sync pages every synced collection, then the tombstones, by (timestamp, _id)
+    IndexSpec(SubscriberCategory, 'subscriber_category_sync', ['updated_at', '_id']),
+    IndexSpec(SubscriberType, 'subscriber_type_sync', ['updated_at', '_id']),
+    IndexSpec(SubscriptionLanguage, 'subscription_language_sync', ['updated_at', '_id']),
+    IndexSpec(SubscriptionMode, 'subscription_mode_sync', ['updated_at', '_id']),
+    IndexSpec(SubscriptionPlan, 'subscription_plan_sync', ['updated_at', '_id']),
+    IndexSpec(PaymentMode, 'payment_mode_sync', ['updated_at', '_id']),
+    IndexSpec(MagazineSubscriber, 'subscriber_sync', ['updated_at', '_id']),
+    IndexSpec(Subscription, 'subscription_sync', ['updated_at', '_id']),
+    IndexSpec(Tombstone, 'tombstone_sync', ['deleted_at', '_id']),
+    IndexSpec(Tombstone, 'tombstone_ttl', ['deleted_at'],
+              expire_after_seconds=settings.SYNC_TOMBSTONE_RETENTION_DAYS * 86400),
+]
+
+QUERY_SHAPES = [
+    QueryShape(MagazineSubscriber, 'subscribers.current',
+               {'isDeleted': False, 'hasActiveSubscriptions': True}, ['-_id'],
+               source='MagazineSubscriberViewSet.list (page_current)'),
+    QueryShape(MagazineSubscriber, 'subscribers.renewal',
+               {'isDeleted': False, 'hasActiveSubscriptions': False}, ['-_id'],
+               source='MagazineSubscriberViewSet.list (page_renewal)'),
+    QueryShape(MagazineSubscriber, 'subscribers.inactive',
+               {'isDeleted': True}, ['-_id'],
+               source='MagazineSubscriberViewSet.list (page_inactive)'),
+    QueryShape(MagazineSubscriber, 'subscribers.report',
+               {'isDeleted': False, 'stype': 'STYPE000001'}, ['-_id'],
+               source='MagazineSubscriberViewSet.report'),
+    QueryShape(MagazineSubscriber, 'subscribers.by_pincode',
+               {'isDeleted': False}, ['pincode'],
+               source='api.duplicates.find_candidates'),
+    QueryShape(MagazineSubscriber, 'subscribers.pincode_set',
+               {'isDeleted': False, 'pincode': {'$in': ['560001', '576101']}},
+               source='api.geo.rollup_pipeline'),
+    QueryShape(MagazineSubscriber, 'subscribers.archive_due',
+               {'isDeleted': True, 'deleted_at': {'$lt': datetime(2025, 1, 1)}},
+               source='api.archive.archive_subscribers'),
+    QueryShape(ArchivedSubscriber, 'archive.subscribers_inactive',
+               {'isDeleted': True}, ['-_id'],
+               source='api.archive.TieredSubscribers'),
+    QueryShape(ArchivedSubscription, 'archive.subscriptions_by_subscriber',
+               {'subscriber': 'SUBS000001'}, ['-start_date'],
+               source='api.archive.subscription_history'),
+    QueryShape(Subscription, 'subscriptions.active_count',
+               {'subscriber': 'SUBS000001', 'end_date': {'$gte': datetime(2025, 1, 1)}},
+               source='Subscription.update_active_subscription_flag'),
+    QueryShape(Subscription, 'subscriptions.by_subscriber',
+               {'subscriber': 'SUBS000001'}, ['-start_date'],
+               source='MagazineSubscriberSerializer.get_subscriptions'),
+    QueryShape(Subscription, 'subscriptions.list',
+               {}, ['-start_date', '-_id'],
+               source='SubscriptionViewSet.list'),
+    QueryShape(Subscription, 'subscriptions.list_page',
+               {'$or': [{'start_date': {'$lt': datetime(2025, 1, 10)}},
+                        {'start_date': datetime(2025, 1, 10), '_id': {'$lt': 'SUBSCR000100'}}]},
+               ['-start_date', '-_id'],
+               source='KeysetPagination (next page)'),
+    QueryShape(Subscription, 'subscriptions.list_by_subscriber',
+               {'subscriber': 'SUBS000001'}, ['-start_date', '-_id'],
+               source='SubscriptionViewSet.get_by_subscriber'),
+    QueryShape(Subscription, 'subscriptions.list_by_plan',
+               {'subscription_plan': 'SPLAN000001', 'start_date': {'$gte': datetime(2025, 1, 1)}},
+               ['-start_date', '-_id'],
+               source='SubscriptionViewSet.list (plan, start_after)'),
+    QueryShape(Subscription, 'subscriptions.list_by_payment_status',
+               {'payment_status': 'Pending'}, ['-start_date', '-_id'],
+               source='SubscriptionViewSet.list (payment_status)'),
+    QueryShape(Subscription, 'subscriptions.list_by_payment_mode',
+               {'payment_mode': 'PMODE000001'}, ['-start_date', '-_id'],
+               source='SubscriptionViewSet.list (payment_mode)'),
+    QueryShape(Subscription, 'subscriptions.list_active_on',
+               {'start_date': {'$lte': datetime(2026, 1, 5)}, 'end_date': {'$gte': datetime(2026, 1, 5)}},
+               ['-start_date', '-_id'],
+               source='SubscriptionViewSet.list (active_on)'),
+    QueryShape(Subscription, 'subscriptions.overlap',
+               {'subscriber': 'SUBS000001', 'subscription_plan': 'SPLAN000001',
+                'start_date': {'$lte': datetime(2026, 12, 31)}, 'end_date': {'$gte': datetime(2025, 1, 10)}},
+               source='SubscriptionSerializer.validate'),
+    QueryShape(Subscription, 'subscriptions.renewal_window',
+               {'end_date': {'$gte': datetime(2026, 1, 1), '$lt': datetime(2026, 2, 1)}},
+               source='api.renewals.candidates_pipeline'),
+    QueryShape(Subscription, 'subscriptions.running_on',
+               {'end_date': {'$gte': datetime(2026, 1, 5)}, 'start_date': {'$lte': datetime(2026, 1, 5)}},
+               source='api.dispatch.snapshot_pipeline'),
+    QueryShape(Subscription, 'subscriptions.by_payment_id',
+               {'payment_id': {'$in': ['UTR000000000001', 'UTR000000000002']}},
+               source='api.reconciliation.reconcile'),
+    QueryShape(Subscription, 'subscriptions.unpaid',
+               {'payment_status': {'$in': ['Pending', 'Failed']}},
+               source='api.reconciliation.UnpaidPool'),
+    QueryShape(DispatchEntry, 'dispatch.manifest',
+               {'issue': '2026-01'}, ['issue', 'state', 'district', 'pincode', 'name'],
+               source='api.dispatch.manifest_entries'),
+    QueryShape(MagazineSubscriber, 'sync.subscribers',
+               {'updated_at': {'$gte': datetime(2026, 1, 1), '$lte': datetime(2026, 1, 2)}}, ['updated_at', '_id'],
+               source='api.sync.sync_page'),
+    QueryShape(Subscription, 'sync.subscriptions_page',
+               {'$and': [{'updated_at': {'$gte': datetime(2026, 1, 1), '$lte': datetime(2026, 1, 2)}},
+                         {'$or': [{'updated_at': {'$gt': datetime(2026, 1, 1, 12)}},
+                                  {'updated_at': datetime(2026, 1, 1, 12), '_id': {'$gt': 'SUBSCR000100'}}]}]},
+               ['updated_at', '_id'],
+               source='api.sync.sync_page (next page)'),
+    QueryShape(Tombstone, 'sync.tombstones',
+               {'deleted_at': {'$gte': datetime(2026, 1, 1), '$lte': datetime(2026, 1, 2)},
+                'collection': {'$in': ['magazine_subscriber', 'subscription']}},
+               ['deleted_at', '_id'],
+               source='api.sync.sync_page (deleted)'),
+    QueryShape(UserToken, 'tokens.lookup',
+               {'token': '00000000-0000-0000-0000-000000000000'},
+               source='TokenAuthentication.authenticate'),
+]
@@ -0,0 +1,167 @@
+"""
+Per-request MongoDB command instrumentation.
+
+A pymongo CommandListener records every command issued while a request (or a
+`track_queries()` block) is active. State lives in a ContextVar, so threaded
+workers keep their numbers apart and commands issued outside a request cost a
+single lookup.
+"""
+import contextvars
+import heapq
+import itertools
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+_current_stats = contextvars.ContextVar('db_request_stats', default=None)
+
+# Driver housekeeping that says nothing about the code being measured
+IGNORED_COMMANDS = {'endSessions', 'killCursors'}
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a block or endpoint issues more MongoDB commands than it declared."""
+
+
+class CommandRecord:
+    __slots__ = ('name', 'collection', 'duration_ms', 'failed')
+
+    def __init__(self, name, collection, duration_ms, failed=False):
+        self.name = name
+        self.collection = collection
+        self.duration_ms = duration_ms
+        self.failed = failed
+
+    def as_dict(self):
+        return {
+            'command': self.name,
+            'collection': self.collection,
+            'duration_ms': round(self.duration_ms, 3),
+            'failed': self.failed,
+        }
+
+
+class RequestDbStats:
+    """Command count, total time and the slowest commands seen in one request."""
+
+    def __init__(self, keep_slowest=5):
+        self.count = 0
+        self.failures = 0
+        self.total_ms = 0.0
+        self.keep_slowest = keep_slowest
+        self.view = None
+        self.action = None
+        self._slowest = []
+        self._tiebreak = itertools.count()
+        self._started = {}
+
+    def command_started(self, event):
+        self._started[(event.connection_id, event.request_id)] = (
+            event.command_name, command_collection(event.command_name, event.command)
+        )
+
+    def command_finished(self, event, failed):
+        name, collection = self._started.pop(
+            (event.connection_id, event.request_id), (event.command_name, None)
+        )
+        duration_ms = event.duration_micros / 1000.0
+        self.count += 1
+        self.total_ms += duration_ms
+        if failed:
+            self.failures += 1
+        entry = (duration_ms, next(self._tiebreak), CommandRecord(name, collection, duration_ms, failed))
+        if len(self._slowest) < self.keep_slowest:
+            heapq.heappush(self._slowest, entry)
+        elif duration_ms > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    @property
+    def slowest(self):
+        return [record for _, _, record in sorted(self._slowest, reverse=True)]
+
+    def as_dict(self):
+        return {
+            'view': self.view,
+            'action': self.action,
+            'queries': self.count,
+            'failures': self.failures,
+            'db_ms': round(self.total_ms, 3),
+            'slowest': [record.as_dict() for record in self.slowest],
+        }
+
+
+def command_collection(command_name, command):
+    if command_name == 'getMore':
+        return command.get('collection')
+    target = command.get(command_name)
+    return target if isinstance(target, str) else None
+
+
+class CommandTracker(monitoring.CommandListener):
+    """Feeds command events into the stats of the request that issued them."""
+
+    def started(self, event):
+        stats = _current_stats.get()
+        if stats is not None and event.command_name not in IGNORED_COMMANDS:
+            stats.command_started(event)
+
+    def succeeded(self, event):
+        stats = _current_stats.get()
+        if stats is not None and event.command_name not in IGNORED_COMMANDS:
+            stats.command_finished(event, failed=False)
+
+    def failed(self, event):
+        stats = _current_stats.get()
+        if stats is not None and event.command_name not in IGNORED_COMMANDS:
+            stats.command_finished(event, failed=True)
+
+
+command_tracker = CommandTracker()
+
+
+def current_stats():
+    return _current_stats.get()
+
+
+@contextmanager
+def track_queries(keep_slowest=5):
+    """Collects the MongoDB commands issued inside the block."""
+    stats = RequestDbStats(keep_slowest=keep_slowest)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+@contextmanager
+def assert_max_queries(budget):
+    """
+    Fails when the block issues more than `budget` MongoDB commands, e.g.
+
+        with assert_max_queries(3):
+            client.get('/api/subscribers/')
+    """
+    with track_queries(keep_slowest=10) as stats:
+        yield stats
+    if stats.count > budget:
+        details = ', '.join(f"{r.name}({r.collection}) {r.duration_ms:.1f}ms" for r in stats.slowest)
+        raise QueryBudgetExceeded(f"{stats.count} MongoDB commands issued, budget is {budget}. Slowest: {details}")
+
+
+def resolve_view_action(view_func, request):
+    """
+    Returns (view name, action) for a resolved view. DRF viewsets expose their
+    class and method-to-action mapping on the view function.
+    """
+    view_class = getattr(view_func, 'cls', None)
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    view_name = view_class.__name__ if view_class else getattr(view_func, '__name__', 'unknown')
+    return view_class, view_name, action
+
+
+def query_budget_for(view_class, action):
+    """Budgets are declared per viewset as `query_budgets = {'list': 3, ...}`."""
+    budgets = getattr(view_class, 'query_budgets', None) or {}
+    return budgets.get(action)
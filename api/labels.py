@@ -0,0 +1,236 @@
+"""
+Mailing label engine.
+
+A named LabelTemplate describes the sheet: page size, grid, margins and font.
+Box origins and line capacity are computed once per template. Text is
+wrapped by rendered width, using per-character glyph widths cached per font,
+and always fits its box: the address wraps into the spare lines and anything
+that still does not fit is ellipsized. Pages are drawn with the reportlab
+canvas.
+"""
+import io
+from dataclasses import dataclass, replace
+from functools import lru_cache
+
+from reportlab.lib.units import mm
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+ELLIPSIS = '...'
+
+
+@dataclass(frozen=True)
+class LabelTemplate:
+    name: str
+    page_width_mm: float
+    page_height_mm: float
+    columns: int
+    rows: int
+    margin_mm: float = 10
+    header_height_mm: float = 15
+    padding_mm: float = 2
+    font_name: str = 'Helvetica'
+    font_size: float = 8
+    line_height_mm: float = 3.5
+    header_font_name: str = 'Helvetica-Bold'
+    header_font_size: float = 10
+    draw_borders: bool = True
+
+    def with_grid(self, columns=None, rows=None):
+        return replace(self, columns=columns or self.columns, rows=rows or self.rows)
+
+
+TEMPLATES = {
+    # Subscriber report sheet: 5 columns of 30mm boxes on A4 landscape
+    'a4-landscape-5col': LabelTemplate('a4-landscape-5col', 297, 210, columns=5, rows=5, line_height_mm=4.5),
+    # Preview sheet used by generate_report_dummy
+    'a4-landscape-4x6': LabelTemplate('a4-landscape-4x6', 297, 210, columns=4, rows=6, line_height_mm=3.5),
+    # Standard 3x8 (70 x 37mm) self-adhesive label sheet
+    'a4-portrait-3x8': LabelTemplate(
+        'a4-portrait-3x8', 210, 297, columns=3, rows=8, margin_mm=0, header_height_mm=0,
+        padding_mm=3, font_size=9, line_height_mm=4, draw_borders=False,
+    ),
+}
+DEFAULT_TEMPLATE = 'a4-landscape-5col'
+
+
+def get_template(name=None):
+    try:
+        return TEMPLATES[name or DEFAULT_TEMPLATE]
+    except KeyError:
+        raise ValueError(f"Unknown label template: {name}")
+
+
+class LabelGeometry:
+    """Box size, text box and the origin of every slot on a page, in points."""
+
+    def __init__(self, template):
+        self.page_width = template.page_width_mm * mm
+        self.page_height = template.page_height_mm * mm
+        margin = template.margin_mm * mm
+        header = template.header_height_mm * mm
+        padding = template.padding_mm * mm
+
+        self.box_width = (self.page_width - 2 * margin) / template.columns
+        self.box_height = (self.page_height - 2 * margin - header) / template.rows
+        self.text_width = self.box_width - 2 * padding
+        self.line_height = template.line_height_mm * mm
+        self.max_lines = max(1, int((self.box_height - 2 * padding) // self.line_height))
+        self.header_y = self.page_height - margin - header / 2 - template.header_font_size / 3
+        self.slots_per_page = template.columns * template.rows
+
+        # (box x, box bottom y, first baseline x, first baseline y)
+        self.slots = []
+        for index in range(self.slots_per_page):
+            column, row = index % template.columns, index // template.columns
+            x = margin + column * self.box_width
+            top = self.page_height - margin - header - row * self.box_height
+            self.slots.append((x, top - self.box_height, x + padding, top - padding - template.font_size))
+
+
+@lru_cache(maxsize=None)
+def layout_for(template):
+    return LabelGeometry(template)
+
+
+class FontMetrics:
+    """Glyph widths for one font and size, measured once per character."""
+
+    def __init__(self, font_name, font_size):
+        self.font_name = font_name
+        self.font_size = font_size
+        self._widths = {}
+
+    def char_width(self, char):
+        width = self._widths.get(char)
+        if width is None:
+            width = self._widths[char] = stringWidth(char, self.font_name, self.font_size)
+        return width
+
+    def width(self, text):
+        widths = self._widths
+        total = 0.0
+        for char in text:
+            width = widths.get(char)
+            total += width if width is not None else self.char_width(char)
+        return total
+
+
+@lru_cache(maxsize=None)
+def get_metrics(font_name, font_size):
+    return FontMetrics(font_name, font_size)
+
+
+def ellipsize(text, width, metrics):
+    if metrics.width(text) <= width:
+        return text
+    budget = width - metrics.width(ELLIPSIS)
+    used = 0.0
+    for index, char in enumerate(text):
+        used += metrics.char_width(char)
+        if used > budget:
+            return text[:index].rstrip() + ELLIPSIS
+    return text
+
+
+def wrap_text(text, width, metrics, max_lines):
+    """Greedy word wrap by rendered width; the last allowed line is ellipsized."""
+    lines, current, current_width = [], '', 0.0
+    space = metrics.char_width(' ')
+    for word in text.split():
+        word_width = metrics.width(word)
+        if current and current_width + space + word_width <= width:
+            current, current_width = f"{current} {word}", current_width + space + word_width
+            continue
+        if current:
+            lines.append(current)
+        # Words wider than the box are broken at the character that overflows
+        while word_width > width:
+            used, cut = 0.0, 0
+            for cut, char in enumerate(word):
+                used += metrics.char_width(char)
+                if used > width:
+                    break
+            cut = max(cut, 1)
+            lines.append(word[:cut])
+            word = word[cut:]
+            word_width = metrics.width(word)
+        current, current_width = word, word_width
+    if current:
+        lines.append(current)
+
+    if len(lines) > max_lines:
+        rest = ' '.join(lines[max_lines - 1:])
+        lines = lines[:max_lines - 1] + [ellipsize(rest, width, metrics)]
+    return lines
+
+
+def fit_label(fields, width, max_lines, metrics, wrap_field=1):
+    """
+    Lays out one label. Every non-empty field takes one line, ellipsized if
+    too wide. The field at `wrap_field` (the address) wraps into whatever
+    lines are left.
+    """
+    fields = [(index, str(value)) for index, value in enumerate(fields) if value not in (None, '', 'null', 'None')]
+    fixed = [index for index, _ in fields if index != wrap_field]
+    spare = max(1, max_lines - len(fixed))
+
+    lines = []
+    for index, value in fields:
+        if index == wrap_field:
+            lines.extend(wrap_text(value, width, metrics, spare))
+        else:
+            lines.append(ellipsize(value, width, metrics))
+    return lines[:max_lines]
+
+
+def subscriber_label_fields(name, address, city, district, state, pincode, phone):
+    return [
+        name,
+        address,
+        ', '.join(part for part in (city, district) if part),
+        ', '.join(part for part in (state, pincode) if part),
+        phone,
+    ]
+
+
+def render_labels(sections, template, output=None):
+    """
+    Draws labels onto `output` (a path or file object) or returns the PDF bytes.
+    `sections` yields (header, labels) pairs; each label is a list of field
+    values as built by subscriber_label_fields, and each section starts a new
+    page. Labels are consumed lazily, so generators keep memory flat.
+    """
+    geometry = layout_for(template)
+    metrics = get_metrics(template.font_name, template.font_size)
+    buffer = output or io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=(geometry.page_width, geometry.page_height), pageCompression=1)
+
+    started = False
+    for header, labels in sections:
+        slot = geometry.slots_per_page
+        for fields in labels:
+            if slot == geometry.slots_per_page:
+                if started:
+                    pdf.showPage()
+                started = True
+                if header and template.header_height_mm:
+                    pdf.setFont(template.header_font_name, template.header_font_size)
+                    pdf.drawCentredString(geometry.page_width / 2, geometry.header_y, header)
+                pdf.setFont(template.font_name, template.font_size)
+                slot = 0
+
+            box_x, box_y, text_x, text_y = geometry.slots[slot]
+            if template.draw_borders:
+                pdf.rect(box_x, box_y, geometry.box_width, geometry.box_height)
+            text = pdf.beginText(text_x, text_y)
+            text.setLeading(geometry.line_height)
+            for line in fit_label(fields, geometry.text_width, geometry.max_lines, metrics):
+                text.textLine(line)
+            pdf.drawText(text)
+            slot += 1
+
+    if not started:
+        pdf.setFont(template.font_name, template.font_size)
+    pdf.save()
+    return None if output else buffer.getvalue()
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.archive import archive_expired_subscriptions, archive_subscribers, stamp_deleted_at
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves subscribers deleted longer than the retention period (with their subscriptions) "
+        "and subscriptions that ended before the horizon into the archive collections."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=settings.SUBSCRIBER_ARCHIVE_RETENTION_DAYS,
+                            help='Archive subscribers deleted more than this many days ago.')
+        parser.add_argument('--horizon-days', type=int, default=settings.SUBSCRIPTION_ARCHIVE_HORIZON_DAYS,
+                            help='Archive subscriptions that ended more than this many days ago.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Documents moved per batch.')
+        parser.add_argument('--dry-run', action='store_true', help='Count what would move without moving it.')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        if not dry_run:
+            stamped = stamp_deleted_at()
+            if stamped:
+                self.stdout.write(f"Started the retention clock for {stamped} subscribers deleted without deleted_at.")
+
+        subscribers, subscriptions = archive_subscribers(
+            retention_days=options['retention_days'], batch_size=options['batch_size'], dry_run=dry_run,
+        )
+        expired = archive_expired_subscriptions(
+            horizon_days=options['horizon_days'], batch_size=options['batch_size'] * 2, dry_run=dry_run,
+        )
+
+        verb = "Would archive" if dry_run else "Archived"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {subscribers} subscribers with {subscriptions} subscriptions, "
+            f"and {expired} expired subscriptions."
+        ))
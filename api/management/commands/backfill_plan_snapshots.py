@@ -0,0 +1,71 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from api.models import ArchivedSubscription, Subscription, SubscriptionLanguage, SubscriptionMode, SubscriptionPlan
+
+
+def plan_snapshots():
+    """Plan id -> embedded snapshot document, for every plan, in one aggregation."""
+    pipeline = [
+        {'$lookup': {
+            'from': SubscriptionLanguage._get_collection_name(),
+            'localField': 'subscription_language',
+            'foreignField': '_id',
+            'as': 'language',
+        }},
+        {'$lookup': {
+            'from': SubscriptionMode._get_collection_name(),
+            'localField': 'subscription_mode',
+            'foreignField': '_id',
+            'as': 'mode',
+        }},
+        {'$project': {
+            'name': 1,
+            'version': 1,
+            'price': '$subscription_price',
+            'duration_in_months': 1,
+            'language': {'$first': '$language.name'},
+            'mode': {'$first': '$mode.name'},
+        }},
+    ]
+    return {doc.pop('_id'): doc for doc in SubscriptionPlan._get_collection().aggregate(pipeline)}
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the embedded plan snapshot into subscriptions (hot and archived) that lack one, "
+        "with one update per plan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Rewrite existing snapshots from the current plan documents.')
+        parser.add_argument('--dry-run', action='store_true', help='Count what would be written.')
+
+    def handle(self, *args, **options):
+        snapshots = plan_snapshots()
+        for label, collection in (
+            ('subscriptions', Subscription._get_collection()),
+            ('archived subscriptions', ArchivedSubscription._get_collection()),
+        ):
+            written = 0
+            for plan_id, snapshot in snapshots.items():
+                query = {'subscription_plan': plan_id}
+                if not options['force']:
+                    query['plan'] = {'$exists': False}
+                if options['dry_run']:
+                    written += collection.count_documents(query)
+                else:
+                    written += collection.update_many(
+                        query, {'$set': {'plan': snapshot, 'updated_at': datetime.utcnow()}},
+                    ).modified_count
+
+            missing = collection.count_documents({'plan': {'$exists': False}, 'subscription_plan': {'$ne': None}})
+            verb = "Would write" if options['dry_run'] else "Wrote"
+            self.stdout.write(f"{verb} {written} {label} snapshots.")
+            if missing and not options['dry_run']:
+                self.stdout.write(self.style.WARNING(
+                    f"{missing} {label} reference a plan that no longer exists and have no snapshot."
+                ))
+        self.stdout.write(self.style.SUCCESS("Plan snapshot backfill done."))
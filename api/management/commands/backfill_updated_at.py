@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from api.sync import SYNCED
+
+
+class Command(BaseCommand):
+    help = (
+        "Stamps updated_at on synced documents written before it existed, so delta sync "
+        "(api/sync.py) can page them. Run once after deploying, before clients first sync."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Count what would be stamped.')
+
+    def handle(self, *args, **options):
+        # One stamp for everything: no client holds a watermark from before the field existed
+        now = datetime.utcnow()
+        query = {'updated_at': {'$exists': False}}
+        for name, model, _ in SYNCED:
+            collection = model._get_collection()
+            if options['dry_run']:
+                count = collection.count_documents(query)
+            else:
+                count = collection.update_many(query, {'$set': {'updated_at': now}}).modified_count
+            verb = "Would stamp" if options['dry_run'] else "Stamped"
+            self.stdout.write(f"{verb} {count} {name}.")
+        self.stdout.write(self.style.SUCCESS("updated_at backfill done."))
@@ -0,0 +1,48 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.pincodes import SAMPLE_SOURCE, PincodeDirectory, build_directory
+
+
+class Command(BaseCommand):
+    help = (
+        "Compiles a pincode directory CSV (e.g. the India Post all-India pincode list) "
+        "into the memory-mapped file used for pincode validation and autofill."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=None,
+                            help='Directory CSV, plain or .gz; defaults to PINCODE_DIRECTORY_SOURCE.')
+        parser.add_argument('--sample', action='store_true',
+                            help='Compile the synthetic sample that matches seed_data; for development only.')
+        parser.add_argument('--output', default=None,
+                            help='Compiled file; defaults to PINCODE_DIRECTORY_PATH.')
+
+    def handle(self, *args, **options):
+        if options['sample']:
+            source = SAMPLE_SOURCE
+        else:
+            source = options['source'] or settings.PINCODE_DIRECTORY_SOURCE
+        if not source:
+            raise CommandError(
+                "No directory CSV: pass --source or set PINCODE_DIRECTORY_SOURCE "
+                "(--sample compiles synthetic data for development)."
+            )
+        output = Path(options['output'] or settings.PINCODE_DIRECTORY_PATH)
+
+        started = time.monotonic()
+        try:
+            count = build_directory(source, output)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        directory = PincodeDirectory(output)
+        self.stdout.write(self.style.SUCCESS(
+            f"Compiled {count} pincodes from {source} into {output} "
+            f"({output.stat().st_size / 1024:.0f} KiB) in {time.monotonic() - started:.1f}s."
+        ))
+        if len(directory) != count:
+            raise CommandError(f"{output} holds {len(directory)} pincodes, expected {count}.")
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import MagazineSubscriber
+from magazine.mongo import analytical_reads, reader
+
+
+class Command(BaseCommand):
+    help = (
+        "Shows which member serves interactive and analytical reads. Run it against a replica "
+        "set (e.g. docker-compose.replicaset.yml) to check that analytical reads reach a secondary."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--require-secondary', action='store_true',
+                            help='Fail if analytical reads are served by the primary.')
+
+    def handle(self, *args, **options):
+        client = MagazineSubscriber._get_db().client
+        hello = client.admin.command('hello')
+        if 'setName' in hello:
+            self.stdout.write(
+                f"Replica set {hello['setName']}: primary {hello.get('primary')}, "
+                f"members {', '.join(hello.get('hosts', []))}"
+            )
+        else:
+            self.stdout.write(self.style.WARNING("Not a replica set; every read goes to the one server."))
+
+        interactive = self.served_by(reader(MagazineSubscriber))
+        with analytical_reads():
+            collection = reader(MagazineSubscriber)
+            analytical = self.served_by(collection)
+
+        self.stdout.write(f"  interactive reads: {self.describe(client, interactive)}")
+        self.stdout.write(
+            f"  analytical reads:  {self.describe(client, analytical)} "
+            f"(read preference {collection.read_preference.document})"
+        )
+        if options['require_secondary'] and analytical not in client.secondaries:
+            raise CommandError("Analytical reads were served by the primary.")
+        self.stdout.write(self.style.SUCCESS("Read routing check done."))
+
+    def served_by(self, collection):
+        cursor = collection.find({}, {'_id': 1}).limit(1)
+        list(cursor)
+        return cursor.address
+
+    def describe(self, client, address):
+        host, port = address
+        role = 'secondary' if address in client.secondaries else 'primary' if address == client.primary else 'server'
+        return f"{role} {host}:{port}"
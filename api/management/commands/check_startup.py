@@ -0,0 +1,59 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter so nothing is already imported or cached
+PROBE = """
+import json, os, sys, threading, time
+started = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', sys.argv[1])
+from magazine.wsgi import application
+elapsed = time.perf_counter() - started
+# Fork-aware helpers (e.g. the logging listener) restart themselves; driver threads do not
+threads = [t.name for t in threading.enumerate() if 'pymongo' in t.name]
+print(json.dumps({'seconds': elapsed, 'threads': threads}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures cold start (importing the WSGI application in a fresh interpreter) "
+        "and fails if it exceeds STARTUP_TIME_TARGET_SECONDS or starts MongoDB driver threads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3, help='Number of cold starts to measure.')
+        parser.add_argument('--target', type=float, default=None,
+                            help='Target in seconds; defaults to settings.STARTUP_TIME_TARGET_SECONDS.')
+
+    def handle(self, *args, **options):
+        target = options['target'] or settings.STARTUP_TIME_TARGET_SECONDS
+        settings_module = os.environ.get('DJANGO_SETTINGS_MODULE', 'magazine.settings')
+
+        timings, threads = [], []
+        for run in range(max(1, options['runs'])):
+            result = subprocess.run(
+                [sys.executable, '-c', PROBE, settings_module],
+                capture_output=True, text=True, cwd=settings.BASE_DIR,
+            )
+            if result.returncode:
+                raise CommandError(f"Application failed to import:\n{result.stderr}")
+            probe = json.loads(result.stdout.strip().splitlines()[-1])
+            timings.append(probe['seconds'])
+            threads = probe['threads']
+            self.stdout.write(f"  run {run + 1}: {probe['seconds']:.3f}s")
+
+        median = statistics.median(timings)
+        self.stdout.write(f"Median cold start {median:.3f}s (target {target:.3f}s)")
+
+        # MongoDB monitor threads started at import time break --preload
+        if threads:
+            raise CommandError(f"MongoDB driver threads started during import: {', '.join(threads)}")
+        if median > target:
+            raise CommandError(f"Cold start {median:.3f}s exceeds the {target:.3f}s target.")
+        self.stdout.write(self.style.SUCCESS("Startup check passed."))
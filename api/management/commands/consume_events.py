@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api.outbox import Consumer, load_handlers
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs an outbox consumer: dispatches change events to the registered handlers "
+        "(OUTBOX_HANDLER_MODULES) with at-least-once delivery, resuming from its stored offset."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumer', default='default',
+                            help='Consumer name; each name keeps its own offset.')
+        parser.add_argument('--mode', choices=['auto', 'poll', 'watch'], default='auto',
+                            help='watch uses a change stream (replica sets); auto falls back to poll.')
+        parser.add_argument('--batch-size', type=int, default=100, help='Events handled per offset update.')
+        parser.add_argument('--once', action='store_true', help='Handle one batch of settled events and exit.')
+
+    def handle(self, *args, **options):
+        consumer = Consumer(options['consumer'], batch_size=options['batch_size'])
+        if options['once']:
+            load_handlers()
+            handled = consumer.poll(once=True)
+            self.stdout.write(self.style.SUCCESS(f"Handled {handled} events."))
+            return
+        self.stdout.write(f"Consumer {options['consumer']} running in {options['mode']} mode.")
+        consumer.run(mode=options['mode'])
@@ -0,0 +1,32 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.dispatch import run_dispatch
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds the mailing manifest for an issue: snapshots subscribers with a subscription "
+        "running on the dispatch date and writes manifest.csv, labels.pdf and bundles.csv "
+        "sorted by state, district and pincode. Re-runs for the same issue reuse the snapshot."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, default=None,
+                            help='Dispatch date (YYYY-MM-DD); defaults to today. The issue is its month.')
+        parser.add_argument('--output-dir', default=None,
+                            help='Where to write the files; defaults to DISPATCH_OUTPUT_DIR/<issue>.')
+        parser.add_argument('--force', action='store_true', help='Retake the snapshot even if one exists.')
+
+    def handle(self, *args, **options):
+        try:
+            run = run_dispatch(options['date'] or date.today(), output_dir=options['output_dir'], force=options['force'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for name, path in run.outputs.items():
+            self.stdout.write(f"  {name}: {path}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Issue {run.pk}: {run.entries} subscribers in {run.pincodes} pincode bundles."
+        ))
@@ -0,0 +1,68 @@
+import os
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from mongoengine.connection import get_db
+
+from api.backup import FORMATS, BackupError, collection_infos, dump, snapshot_time
+
+
+class Command(BaseCommand):
+    help = (
+        "Dumps every collection (or the ones given) in parallel into a directory of gzip "
+        "BSON or NDJSON files, read at one point in time on replica sets and sharded clusters."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', nargs='?',
+                            help='Output directory (default: var/dumps/<database>-<UTC timestamp>).')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='bson',
+                            help='bson is fastest and exact; ndjson is readable with zcat and jq.')
+        parser.add_argument('--collections', help='Comma-separated collections to dump (default: all).')
+        parser.add_argument('--exclude', default='', help='Comma-separated collections to leave out.')
+        parser.add_argument('--jobs', type=int, default=4, help='Collections dumped at the same time.')
+        parser.add_argument('--compress-level', type=int, default=6, choices=range(1, 10), metavar='1-9',
+                            help='gzip level; lower is faster.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Documents fetched per round trip.')
+        parser.add_argument('--no-snapshot', action='store_true',
+                            help='Read each collection as it is, without a common snapshot.')
+
+    def handle(self, *args, **options):
+        db = get_db()
+        directory = options['directory'] or os.path.join(
+            'var', 'dumps', f"{db.name}-{datetime.utcnow():%Y%m%dT%H%M%SZ}"
+        )
+        if os.path.exists(os.path.join(directory, 'manifest.json')):
+            raise CommandError(f"{directory} already holds a dump.")
+        only = [name for name in (options['collections'] or '').split(',') if name]
+        exclude = [name for name in options['exclude'].split(',') if name]
+        try:
+            infos = collection_infos(db, only=only, exclude=exclude)
+        except BackupError as exc:
+            raise CommandError(str(exc))
+        if not infos:
+            raise CommandError("Nothing to dump.")
+
+        at_cluster_time = None
+        if not options['no_snapshot']:
+            at_cluster_time = snapshot_time(db, next(iter(infos)))
+            if at_cluster_time is None:
+                self.stdout.write(self.style.WARNING(
+                    "The server has no snapshot reads; collections are not read at one point in time."
+                ))
+            else:
+                self.stdout.write(f"Reading at cluster time {at_cluster_time.time}.{at_cluster_time.inc}")
+
+        def progress(name, count, seconds):
+            self.stdout.write(f"  {name}: {count} documents in {seconds:.1f}s")
+
+        started = datetime.utcnow()
+        manifest = dump(
+            db, directory, infos, fmt=options['format'], jobs=options['jobs'], level=options['compress_level'],
+            batch_size=options['batch_size'], at_cluster_time=at_cluster_time, progress=progress,
+        )
+        total = sum(entry['count'] for entry in manifest['collections'].values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Dumped {total} documents from {len(manifest['collections'])} collections to {directory} "
+            f"in {(datetime.utcnow() - started).total_seconds():.1f}s."
+        ))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.duplicates import DEFAULT_MAX_BLOCK_SIZE, DEFAULT_THRESHOLD, detect_duplicates
+
+
+class Command(BaseCommand):
+    help = (
+        "Finds likely duplicate subscribers by comparing records that share a blocking key "
+        "(phonetic name or address prefix, within a pincode and then across pincodes) and stores "
+        "ranked candidate pairs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='Minimum similarity score (0-1) for a candidate pair.')
+        parser.add_argument('--max-block-size', type=int, default=DEFAULT_MAX_BLOCK_SIZE,
+                            help='Skip blocks larger than this; they indicate a key that is too coarse.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        found = detect_duplicates(threshold=options['threshold'], max_block_size=options['max_block_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {found} candidate pairs in {time.monotonic() - started:.1f}s."
+        ))
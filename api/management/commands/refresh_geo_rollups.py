@@ -0,0 +1,31 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from api.geo import rebuild, refresh_dirty
+
+
+class Command(BaseCommand):
+    help = (
+        "Refreshes the geographic subscriber rollups. By default only pincodes marked dirty "
+        "by subscriber changes are recomputed; --full recomputes every pincode (run daily "
+        "so expired subscriptions drop out)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every pincode.')
+        parser.add_argument('--as-of', type=date.fromisoformat, default=None,
+                            help='With --full: count subscriptions active on this date (YYYY-MM-DD).')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Maximum dirty pincodes to refresh; defaults to GEO_ROLLUP_REFRESH_LIMIT.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['full']:
+            count = rebuild(as_of=options['as_of'])
+        else:
+            count = refresh_dirty(limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Refreshed {count} pincodes in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,59 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from mongoengine.connection import get_db
+
+from api.backup import BackupError, read_manifest, restore
+
+
+class Command(BaseCommand):
+    help = (
+        "Restores a dump_data directory into the configured database with parallel unordered "
+        "batch inserts, building the indexes after the data is loaded."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory written by dump_data.')
+        parser.add_argument('--collections', help='Comma-separated collections to restore (default: all).')
+        parser.add_argument('--drop', action='store_true',
+                            help='Drop collections that already exist instead of refusing to load into them.')
+        parser.add_argument('--jobs', type=int, default=4, help='Insert batches in flight at the same time.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Documents per insert.')
+        parser.add_argument('--skip-indexes', action='store_true', help='Load the data only.')
+
+    def handle(self, *args, **options):
+        db = get_db()
+        try:
+            manifest = read_manifest(options['directory'])
+        except BackupError as exc:
+            raise CommandError(str(exc))
+        names = list(manifest['collections'])
+        if options['collections']:
+            names = [name for name in options['collections'].split(',') if name]
+            missing = set(names) - set(manifest['collections'])
+            if missing:
+                raise CommandError(f"Not in the dump: {', '.join(sorted(missing))}.")
+
+        self.stdout.write(
+            f"Restoring {len(names)} collections of {manifest['database']} "
+            f"(dumped {manifest['created_at']:%Y-%m-%d %H:%M} UTC) into {db.name}"
+        )
+        started = datetime.utcnow()
+        try:
+            results = restore(
+                db, options['directory'], manifest, names, jobs=options['jobs'],
+                batch_size=options['batch_size'], drop=options['drop'], indexes=not options['skip_indexes'],
+            )
+        except BackupError as exc:
+            raise CommandError(str(exc))
+
+        for name, result in results.items():
+            expected = manifest['collections'][name]['count']
+            line = f"  {name}: {result['inserted']}/{expected} documents, {result['indexes']} indexes"
+            if result['failed']:
+                self.stdout.write(self.style.WARNING(f"{line}, {result['failed']} rejected"))
+            else:
+                self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS(
+            f"Restore done in {(datetime.utcnow() - started).total_seconds():.1f}s."
+        ))
@@ -0,0 +1,336 @@
+import calendar
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import BulkWriteError
+
+from api.models import (
+    MagazineSubscriber,
+    PaymentMode,
+    PlanSnapshot,
+    SubscriberCategory,
+    SubscriberType,
+    Subscription,
+    SubscriptionLanguage,
+    SubscriptionMode,
+    SubscriptionPlan,
+)
+from api.utils import generate_id_block
+
+# (state, [(district, pincode prefix, [cities])])
+REGIONS = [
+    ("Karnataka", [
+        ("Bengaluru Urban", 560, ["Bengaluru", "Yelahanka", "Anekal"]),
+        ("Mysuru", 570, ["Mysuru", "Nanjangud", "Hunsur"]),
+        ("Udupi", 576, ["Udupi", "Kundapura", "Karkala"]),
+        ("Dakshina Kannada", 575, ["Mangaluru", "Puttur", "Bantwal"]),
+        ("Dharwad", 580, ["Dharwad", "Hubballi"]),
+        ("Belagavi", 590, ["Belagavi", "Gokak", "Chikodi"]),
+    ]),
+    ("Tamil Nadu", [
+        ("Chennai", 600, ["Chennai", "Tambaram"]),
+        ("Coimbatore", 641, ["Coimbatore", "Pollachi"]),
+        ("Madurai", 625, ["Madurai", "Melur"]),
+        ("Thanjavur", 613, ["Thanjavur", "Kumbakonam"]),
+    ]),
+    ("Andhra Pradesh", [
+        ("Tirupati", 517, ["Tirupati", "Srikalahasti"]),
+        ("Visakhapatnam", 530, ["Visakhapatnam", "Anakapalli"]),
+    ]),
+    ("Telangana", [
+        ("Hyderabad", 500, ["Hyderabad", "Secunderabad"]),
+    ]),
+    ("Kerala", [
+        ("Thiruvananthapuram", 695, ["Thiruvananthapuram", "Neyyattinkara"]),
+        ("Ernakulam", 682, ["Kochi", "Aluva"]),
+    ]),
+    ("Maharashtra", [
+        ("Mumbai", 400, ["Mumbai"]),
+        ("Pune", 411, ["Pune", "Pimpri"]),
+    ]),
+    ("Delhi", [
+        ("New Delhi", 110, ["New Delhi"]),
+    ]),
+    ("Uttar Pradesh", [
+        ("Varanasi", 221, ["Varanasi"]),
+        ("Lucknow", 226, ["Lucknow"]),
+    ]),
+    ("West Bengal", [
+        ("Kolkata", 700, ["Kolkata"]),
+    ]),
+    ("Gujarat", [
+        ("Ahmedabad", 380, ["Ahmedabad"]),
+    ]),
+    ("Rajasthan", [
+        ("Jaipur", 302, ["Jaipur"]),
+    ]),
+    ("Madhya Pradesh", [
+        ("Bhopal", 462, ["Bhopal"]),
+    ]),
+]
+
+FIRST_NAMES = [
+    "Aditya", "Ananya", "Arjun", "Bhavana", "Chaitanya", "Deepa", "Ganesh", "Gayatri",
+    "Harish", "Jayanthi", "Karthik", "Lakshmi", "Madhav", "Meenakshi", "Narayana", "Padma",
+    "Prakash", "Radha", "Raghavendra", "Sarala", "Shankar", "Shreya", "Srinivas", "Sudha",
+    "Suresh", "Uma", "Venkatesh", "Vidya", "Vishnu", "Yamuna",
+]
+
+LAST_NAMES = [
+    "Acharya", "Bhat", "Hegde", "Iyer", "Iyengar", "Joshi", "Kamath", "Kulkarni", "Murthy",
+    "Nayak", "Pai", "Rao", "Reddy", "Sastry", "Sharma", "Shenoy", "Subramanian", "Upadhyaya",
+]
+
+STREETS = [
+    "Temple Street", "Main Road", "Cross Road", "Agrahara", "Station Road", "Car Street",
+    "Gandhi Road", "Market Road", "Park Road", "Ashram Road",
+]
+
+LOCALITIES = [
+    "Near Sri Krishna Matha", "Opp Post Office", "Behind Bus Stand", "1st Stage", "2nd Block",
+    "Extension", "Layout", "Nagar", "Colony",
+]
+
+CATEGORIES = [("Domestic", 80), ("NRI", 6), ("Institution", 10), ("Complimentary", 4)]
+TYPES = [("Regular", 85), ("Donor", 8), ("Life Member", 5), ("Patron", 2)]
+LANGUAGES = ["Sanskrit", "Kannada", "Telugu", "Tamil", "Hindi", "English"]
+# (mode, price per year)
+MODES = [("Post", 300), ("Courier", 450), ("Digital", 200)]
+DURATIONS = [12, 24, 36, 60]
+PAYMENT_MODES = ["Cash", "Cheque", "UPI", "NEFT", "Money Order"]
+
+# Multiplier coprime with PHONE_SPACE, so phones derived from distinct ids never collide
+PHONE_SPACE = 4_000_000_000
+PHONE_MULTIPLIER = 2_654_435_761
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a deterministic synthetic dataset of subscribers, plans and "
+        "multi-year subscription histories for load testing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=10000, help='Number of subscribers to generate.')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed; the same seed reproduces the same data.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Subscribers per insert_many batch.')
+        parser.add_argument('--max-history-years', type=int, default=10, help='How far back subscription histories go.')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent insert threads.')
+        parser.add_argument('--deleted-ratio', type=float, default=0.03, help='Fraction of soft-deleted subscribers.')
+        parser.add_argument('--as-of', type=date.fromisoformat, default=None,
+                            help='Reference "today" (YYYY-MM-DD) for histories; defaults to the current date.')
+
+    def handle(self, *args, **options):
+        total = options['subscribers']
+        batch_size = options['batch_size']
+        if total <= 0 or batch_size <= 0:
+            raise CommandError("--subscribers and --batch-size must be greater than zero.")
+
+        rng = random.Random(options['seed'])
+        self.seeded_at = datetime.utcnow()
+        as_of = options['as_of'] or date.today()
+        max_years = options['max_history_years']
+        deleted_ratio = options['deleted_ratio']
+
+        reference = self.ensure_reference_data()
+        plan_groups = self.ensure_plans()
+        phone_offset = rng.randrange(PHONE_SPACE)
+
+        subscriber_collection = MagazineSubscriber._get_collection()
+        subscription_collection = Subscription._get_collection()
+
+        started = time.monotonic()
+        inserted = {'subscribers': 0, 'subscriptions': 0}
+        failed = {'subscribers': 0, 'subscriptions': 0}
+        pending = deque()
+
+        def insert(collection, docs, key):
+            try:
+                collection.insert_many(docs, ordered=False)
+                return key, len(docs), 0
+            except BulkWriteError as exc:
+                errors = len(exc.details.get('writeErrors', []))
+                return key, len(docs) - errors, errors
+
+        def drain(limit):
+            while len(pending) > limit:
+                key, ok, errors = pending.popleft().result()
+                inserted[key] += ok
+                failed[key] += errors
+
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            remaining = total
+            while remaining > 0:
+                size = min(batch_size, remaining)
+                subscriber_ids = generate_id_block('SUBS', 'subscriber', size)
+
+                subscribers, subscriptions = [], []
+                for subscriber_id in subscriber_ids:
+                    subscriber, history = self.build_subscriber(
+                        rng, subscriber_id, reference, plan_groups, phone_offset, as_of, max_years, deleted_ratio
+                    )
+                    subscribers.append(subscriber)
+                    subscriptions.extend(history)
+
+                if subscriptions:
+                    subscription_ids = generate_id_block('SUBSCR', 'subscription', len(subscriptions))
+                    for subscription, subscription_id in zip(subscriptions, subscription_ids):
+                        subscription['_id'] = subscription_id
+
+                pending.append(executor.submit(insert, subscriber_collection, subscribers, 'subscribers'))
+                if subscriptions:
+                    pending.append(executor.submit(insert, subscription_collection, subscriptions, 'subscriptions'))
+                # Keep a bounded number of batches in flight so memory stays flat
+                drain(options['workers'] * 2)
+
+                remaining -= size
+                self.stdout.write(f"Generated {total - remaining}/{total} subscribers")
+
+            drain(0)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Inserted {inserted['subscribers']} subscribers and {inserted['subscriptions']} subscriptions "
+            f"in {elapsed:.1f}s ({inserted['subscribers'] / max(elapsed, 1e-6):.0f} subscribers/s)"
+        ))
+        if failed['subscribers'] or failed['subscriptions']:
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {failed['subscribers']} subscribers and {failed['subscriptions']} subscriptions "
+                "because of write errors (usually duplicate keys)."
+            ))
+
+    def ensure_reference_data(self):
+        def get_or_create(model, name):
+            return (model.objects(name=name).first() or model(name=name).save()).pk
+
+        return {
+            'categories': ([get_or_create(SubscriberCategory, name) for name, _ in CATEGORIES],
+                           [weight for _, weight in CATEGORIES]),
+            'types': ([get_or_create(SubscriberType, name) for name, _ in TYPES],
+                      [weight for _, weight in TYPES]),
+            'payment_modes': [get_or_create(PaymentMode, name) for name in PAYMENT_MODES],
+        }
+
+    def ensure_plans(self):
+        """
+        Returns one list of (plan id, duration, price) per language/mode pair,
+        creating the plans that do not exist yet. Fills self.plan_snapshots.
+        """
+        self.plan_snapshots = {}
+        languages = {name: SubscriptionLanguage.objects(name=name).first() or SubscriptionLanguage(name=name).save()
+                     for name in LANGUAGES}
+        modes = {name: SubscriptionMode.objects(name=name).first() or SubscriptionMode(name=name).save()
+                 for name, _ in MODES}
+
+        groups = []
+        for language_name in LANGUAGES:
+            for mode_name, yearly_price in MODES:
+                group = []
+                for duration in DURATIONS:
+                    plan = SubscriptionPlan.objects(
+                        subscription_language=languages[language_name],
+                        subscription_mode=modes[mode_name],
+                        duration_in_months=duration,
+                    ).order_by('-version').first()
+                    if not plan:
+                        years = duration // 12
+                        # Longer plans get a small multi-year discount
+                        price = yearly_price * years * (1 - 0.05 * (years - 1))
+                        plan = SubscriptionPlan(
+                            start_date=date(2000, 1, 1),
+                            subscription_price=round(price, 2),
+                            subscription_language=languages[language_name],
+                            subscription_mode=modes[mode_name],
+                            duration_in_months=duration,
+                        )
+                        plan.save()
+                    group.append((plan.pk, plan.duration_in_months, float(plan.subscription_price)))
+                    self.plan_snapshots[plan.pk] = PlanSnapshot.of(plan).to_mongo().to_dict()
+                groups.append(group)
+        return groups
+
+    def build_subscriber(self, rng, subscriber_id, reference, plan_groups, phone_offset, as_of, max_years, deleted_ratio):
+        number = int(subscriber_id[len('SUBS'):])
+        state, districts = rng.choice(REGIONS)
+        district, prefix, cities = rng.choice(districts)
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        category_ids, category_weights = reference['categories']
+        type_ids, type_weights = reference['types']
+
+        history = self.build_history(rng, subscriber_id, rng.choice(plan_groups), reference['payment_modes'], as_of, max_years)
+        if history:
+            created_at = history[0]['start_date'] - timedelta(days=rng.randint(1, 30))
+        else:
+            created_at = datetime.combine(as_of, datetime.min.time()) - timedelta(days=rng.randint(0, 365 * max_years))
+
+        subscriber = {
+            '_id': subscriber_id,
+            'name': f"{first_name} {last_name}",
+            'registration_number': f"TC/{number}",
+            'address': f"{rng.randint(1, 999)}, {rng.choice(STREETS)}, {rng.choice(LOCALITIES)}",
+            'city_town': rng.choice(cities),
+            'district': district,
+            'state': state,
+            'pincode': f"{prefix * 1000 + rng.randint(1, 99):06d}",
+            'phone': str(6_000_000_000 + (number * PHONE_MULTIPLIER + phone_offset) % PHONE_SPACE),
+            'email': f"{first_name}.{last_name}.{number}@example.in".lower(),
+            'category': rng.choices(category_ids, category_weights)[0],
+            'stype': rng.choices(type_ids, type_weights)[0],
+            'hasActiveSubscriptions': any(subscription['active'] for subscription in history),
+            'isDeleted': rng.random() < deleted_ratio,
+            'created_at': created_at,
+            'updated_at': self.seeded_at,
+        }
+        return subscriber, history
+
+    def build_history(self, rng, subscriber_id, plans, payment_mode_ids, as_of, max_years):
+        if rng.random() < 0.08:
+            return []  # registered but never subscribed
+
+        history = []
+        plan_id, duration, _ = rng.choice(plans)
+        month_index = as_of.year * 12 + (as_of.month - 1) - rng.randint(0, max_years) * 12 - rng.randint(0, 11)
+        last_start = as_of + timedelta(days=62)
+
+        while True:
+            start = date(month_index // 12, month_index % 12 + 1, 10)
+            if start > last_start:
+                break
+            end_index = month_index + duration - 1
+            end_year, end_month = end_index // 12, end_index % 12 + 1
+            end = date(end_year, end_month, calendar.monthrange(end_year, end_month)[1])
+
+            if start <= as_of:
+                payment_status = rng.choices(["Paid", "Pending", "Failed"], [93, 5, 2])[0]
+            else:
+                payment_status = rng.choice(["Paid", "Pending"])
+            payment_date = None
+            if payment_status == "Paid":
+                payment_date = min(as_of, start - timedelta(days=rng.randint(0, 40)))
+
+            history.append({
+                'subscriber': subscriber_id,
+                'subscription_plan': plan_id,
+                'plan': self.plan_snapshots[plan_id],
+                'start_date': datetime.combine(start, datetime.min.time()),
+                'end_date': datetime.combine(end, datetime.min.time()),
+                'active': as_of <= end,
+                'payment_status': payment_status,
+                'payment_mode': rng.choice(payment_mode_ids),
+                'payment_id': f"PAY{rng.getrandbits(48):012X}",
+                'payment_date': datetime.combine(payment_date, datetime.min.time()) if payment_date else None,
+                'updated_at': self.seeded_at,
+            })
+
+            month_index += duration
+            if rng.random() < 0.15:
+                break  # churned
+            if rng.random() < 0.1:
+                month_index += rng.randint(1, 6)  # lapsed for a few months before renewing
+            if rng.random() < 0.2:
+                plan_id, duration, _ = rng.choice(plans)
+        return history
@@ -0,0 +1,32 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from api.renewals import DEFAULT_WINDOWS, run_renewal_notices
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends renewal notices to subscribers whose latest subscription ends within "
+        "the given windows (days). Already-sent notices are skipped, so reruns are incremental."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--windows', type=int, nargs='+', default=list(DEFAULT_WINDOWS),
+                            help='Expiry windows in days, e.g. --windows 30 60 90.')
+        parser.add_argument('--as-of', type=date.fromisoformat, default=None,
+                            help='Reference date (YYYY-MM-DD); defaults to today.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Notices per sender batch.')
+        parser.add_argument('--dry-run', action='store_true', help='Count pending notices without sending.')
+
+    def handle(self, *args, **options):
+        sent = run_renewal_notices(
+            windows=options['windows'],
+            as_of=options['as_of'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        verb = "Pending" if options['dry_run'] else "Sent"
+        for window_days, count in sent.items():
+            self.stdout.write(f"  {window_days:>3} days: {count}")
+        self.stdout.write(self.style.SUCCESS(f"{verb} {sum(sent.values())} renewal notices."))
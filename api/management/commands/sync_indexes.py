@@ -0,0 +1,117 @@
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+from api.indexes import INDEXES, QUERY_SHAPES
+from api.slowlog import summarize_plan, winning_plan
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates the indexes declared in api/indexes.py, reports indexes that "
+        "$indexStats shows as unused and verifies every declared query shape uses an index."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without creating indexes.')
+        parser.add_argument('--replace-conflicting', action='store_true',
+                            help='Drop and recreate indexes whose name matches but whose definition differs.')
+        parser.add_argument('--skip-unused', action='store_true', help='Do not report unused indexes.')
+        parser.add_argument('--skip-verify', action='store_true', help='Do not explain the declared query shapes.')
+
+    def handle(self, *args, **options):
+        self.sync(options['dry_run'], options['replace_conflicting'])
+        if not options['skip_unused']:
+            self.report_unused()
+        if not options['skip_verify']:
+            failures = self.verify()
+            if failures:
+                raise CommandError(f"{failures} query shape(s) are not served by an index.")
+
+    def sync(self, dry_run, replace_conflicting):
+        self.stdout.write(self.style.MIGRATE_HEADING("Indexes"))
+        for spec in INDEXES:
+            collection = spec.model._get_collection()
+            existing = collection.index_information()
+            label = f"{collection.name}.{spec.name}"
+
+            current = existing.get(spec.name)
+            if current and self.matches(current, spec):
+                self.stdout.write(f"  ok       {label}")
+                continue
+
+            same_keys = [name for name, info in existing.items() if self.matches(info, spec)]
+            if same_keys:
+                self.stdout.write(f"  ok       {label} (exists as {same_keys[0]})")
+                continue
+
+            if current:
+                if not replace_conflicting:
+                    self.stdout.write(self.style.WARNING(
+                        f"  conflict {label}: exists with a different definition, use --replace-conflicting"
+                    ))
+                    continue
+                if not dry_run:
+                    collection.drop_index(spec.name)
+
+            if dry_run:
+                self.stdout.write(f"  create   {label} {spec.key_pattern} {spec.options()}")
+                continue
+            try:
+                collection.create_indexes([
+                    IndexModel(spec.key_pattern, name=spec.name, background=True, **spec.options())
+                ])
+                self.stdout.write(self.style.SUCCESS(f"  created  {label}"))
+            except OperationFailure as exc:
+                self.stdout.write(self.style.ERROR(f"  failed   {label}: {exc}"))
+
+    @staticmethod
+    def matches(info, spec):
+        # Index keys may come back as floats (1.0) depending on who created them
+        key_pattern = [(field, int(direction)) if isinstance(direction, (int, float)) else (field, direction)
+                       for field, direction in info['key']]
+        return (
+            key_pattern == spec.key_pattern
+            and info.get('partialFilterExpression') == spec.partial
+            and bool(info.get('unique')) == spec.unique
+            and bool(info.get('sparse')) == spec.sparse
+            and info.get('expireAfterSeconds') == spec.expire_after_seconds
+        )
+
+    def report_unused(self):
+        self.stdout.write(self.style.MIGRATE_HEADING("Unused indexes"))
+        seen = set()
+        for model in {spec.model for spec in INDEXES} | {shape.model for shape in QUERY_SHAPES}:
+            collection = model._get_collection()
+            if collection.name in seen:
+                continue
+            seen.add(collection.name)
+            try:
+                stats = list(collection.aggregate([{'$indexStats': {}}]))
+            except OperationFailure as exc:
+                self.stdout.write(self.style.WARNING(f"  {collection.name}: $indexStats unavailable ({exc})"))
+                continue
+            for entry in stats:
+                if entry['name'] == '_id_' or entry['accesses']['ops']:
+                    continue
+                self.stdout.write(self.style.WARNING(
+                    f"  unused   {collection.name}.{entry['name']} (no operations since {entry['accesses']['since']:%Y-%m-%d %H:%M})"
+                ))
+
+    def verify(self):
+        self.stdout.write(self.style.MIGRATE_HEADING("Query shapes"))
+        failures = 0
+        for shape in QUERY_SHAPES:
+            cursor = shape.model._get_collection().find(shape.filter)
+            if shape.sort:
+                cursor = cursor.sort(shape.sort_spec)
+            plan = summarize_plan(winning_plan(cursor.explain()))
+            uses_index = 'IXSCAN' in plan['stages'] and not plan['collection_scan']
+            if uses_index:
+                self.stdout.write(f"  ok       {shape.name} -> {', '.join(plan['indexes'])}")
+            else:
+                failures += 1
+                self.stdout.write(self.style.ERROR(
+                    f"  scan     {shape.name} ({shape.source}): {' <- '.join(plan['stages'])}"
+                ))
+        return failures
@@ -0,0 +1,147 @@
+"""
+Prometheus metrics.
+
+Under gunicorn every worker is a separate process, so the metrics run in
+prometheus_client's multiprocess mode. Each worker writes its samples to files
+in PROMETHEUS_MULTIPROC_DIR (set by gunicorn.conf.py), and /metrics merges
+them. Without that variable, e.g. under runserver, the default in-process
+registry is used.
+"""
+import os
+
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+REQUEST_LATENCY = Histogram(
+    'api_request_duration_seconds', 'Request latency by viewset and action.',
+    ['view', 'action', 'method', 'status'], buckets=LATENCY_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    'api_response_size_bytes', 'Response body size by viewset and action.',
+    ['view', 'action'], buckets=SIZE_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'api_requests_in_flight', 'Requests currently being handled.',
+    multiprocess_mode='livesum',
+)
+REQUEST_DB_COMMANDS = Histogram(
+    'api_request_db_commands', 'MongoDB commands issued per request.',
+    ['view', 'action'], buckets=(1, 2, 3, 5, 10, 20, 50, 100, 500),
+)
+REQUEST_DB_TIME = Histogram(
+    'api_request_db_seconds', 'Time spent in MongoDB per request.',
+    ['view', 'action'], buckets=LATENCY_BUCKETS,
+)
+
+POOL_CONNECTIONS_OPEN = Gauge(
+    'mongodb_pool_connections_open', 'Open connections in the MongoDB pool.',
+    ['address'], multiprocess_mode='livesum',
+)
+POOL_CONNECTIONS_CHECKED_OUT = Gauge(
+    'mongodb_pool_connections_checked_out', 'Connections currently checked out of the MongoDB pool.',
+    ['address'], multiprocess_mode='livesum',
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    'mongodb_pool_checkout_wait_seconds', 'Time spent waiting for a pooled MongoDB connection.',
+    ['address'], buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+POOL_CHECKOUT_FAILURES = Counter(
+    'mongodb_pool_checkout_failures_total', 'Failed MongoDB connection checkouts.',
+    ['address', 'reason'],
+)
+
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Cache lookups by cache and result (hit or miss).',
+    ['cache', 'result'],
+)
+THROTTLED_REQUESTS = Counter(
+    'api_throttled_requests_total', 'Requests refused by the rate throttle or the concurrency limiter.',
+    ['scope', 'reason'],
+)
+JOB_QUEUE_DEPTH = Gauge(
+    'background_job_queue_depth', 'Jobs waiting in in-process background queues.',
+    ['queue'], multiprocess_mode='livesum',
+)
+JOBS_DROPPED = Counter(
+    'background_jobs_dropped_total', 'Jobs dropped because a background queue was full.',
+    ['queue'],
+)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def _address(event):
+    host, port = event.address
+    return f"{host}:{port}"
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Tracks pool usage and checkout wait time for every MongoClient."""
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        POOL_CONNECTIONS_OPEN.labels(_address(event)).inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        POOL_CONNECTIONS_OPEN.labels(_address(event)).dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        address = _address(event)
+        POOL_CHECKOUT_FAILURES.labels(address, str(event.reason)).inc()
+        duration = getattr(event, 'duration', None)
+        if duration is not None:
+            POOL_CHECKOUT_WAIT.labels(address).observe(duration)
+
+    def connection_checked_out(self, event):
+        address = _address(event)
+        POOL_CONNECTIONS_CHECKED_OUT.labels(address).inc()
+        duration = getattr(event, 'duration', None)
+        if duration is not None:
+            POOL_CHECKOUT_WAIT.labels(address).observe(duration)
+
+    def connection_checked_in(self, event):
+        POOL_CONNECTIONS_CHECKED_OUT.labels(_address(event)).dec()
+
+
+pool_metrics_listener = PoolMetricsListener()
+
+
+def metrics_view(request):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,243 @@
+import logging
+import re
+import time
+import uuid
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.http import HttpResponseRedirect, JsonResponse
+from django.urls import Resolver404, resolve
+
+from magazine.log import request_id_var
+from magazine.mongo import analytical_reads
+
+from .instrumentation import (
+    QueryBudgetExceeded,
+    current_stats,
+    query_budget_for,
+    resolve_view_action,
+    track_queries,
+)
+from .metrics import (
+    REQUEST_DB_COMMANDS,
+    REQUEST_DB_TIME,
+    REQUEST_LATENCY,
+    REQUESTS_IN_FLIGHT,
+    RESPONSE_SIZE,
+    THROTTLED_REQUESTS,
+)
+from .throttling import get_store, throttle_scope_for
+
+db_logger = logging.getLogger('api.db')
+
+# Accept caller-supplied ids only if they are short and header-safe
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+class RequestIdMiddleware:
+    """
+    Gives every request a correlation id, taken from X-Request-ID when the
+    caller (or proxy) sent a usable one. It is attached to every log record
+    and echoed back in the response.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.headers.get('X-Request-ID', '')
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+        token = request_id_var.set(request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response['X-Request-ID'] = request_id
+        return response
+
+
+class LongRunningRouteMiddleware:
+    """
+    Keeps settings.LONG_RUNNING_ROUTES off the "api" gunicorn role, whose
+    short timeout would kill them. They are redirected (307, so the method and
+    body are kept) to the same path on REPORTS_BASE_URL, or refused with 421
+    Misdirected Request when no reports pool is configured. Other roles serve
+    every route.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.routes = [re.compile(pattern) for pattern in settings.LONG_RUNNING_ROUTES]
+        self.active = settings.SERVER_ROLE == 'api'
+
+    def __call__(self, request):
+        if self.active and any(route.match(request.path) for route in self.routes):
+            if settings.REPORTS_BASE_URL:
+                response = HttpResponseRedirect(settings.REPORTS_BASE_URL + request.get_full_path())
+                response.status_code = 307
+                return response
+            return JsonResponse(
+                {'detail': "This route runs on the reports pool, which is not configured here."}, status=421,
+            )
+        return self.get_response(request)
+
+
+class DbInstrumentationMiddleware:
+    """
+    Counts the MongoDB commands issued by each request and reports them in a
+    `Server-Timing` header and one structured log line. Endpoints that go over
+    the budget declared on their viewset are logged, or rejected when
+    DB_QUERY_BUDGET_STRICT is on (used by the test settings).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.keep_slowest = getattr(settings, 'DB_INSTRUMENTATION_SLOWEST', 3)
+        self.strict = getattr(settings, 'DB_QUERY_BUDGET_STRICT', False)
+
+    def __call__(self, request):
+        with track_queries(keep_slowest=self.keep_slowest) as stats:
+            response = self.get_response(request)
+
+        response['Server-Timing'] = self.server_timing(stats, response.get('Server-Timing'))
+
+        labels = (stats.view or 'unmatched', stats.action or 'none')
+        REQUEST_DB_COMMANDS.labels(*labels).observe(stats.count)
+        REQUEST_DB_TIME.labels(*labels).observe(stats.total_ms / 1000.0)
+
+        payload = stats.as_dict()
+        payload.update(method=request.method, path=request.path, status=response.status_code)
+        db_logger.info(
+            "db_request view=%s action=%s queries=%d db_ms=%.1f",
+            stats.view, stats.action, stats.count, stats.total_ms,
+            extra={'db': payload},
+        )
+
+        budget = getattr(request, '_db_query_budget', None)
+        if budget is not None and stats.count > budget:
+            message = (
+                f"{stats.view}.{stats.action} issued {stats.count} MongoDB commands, "
+                f"budget is {budget}"
+            )
+            if self.strict:
+                raise QueryBudgetExceeded(message)
+            db_logger.warning(message, extra={'db': payload})
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = current_stats()
+        view_class, view_name, action = resolve_view_action(view_func, request)
+        if stats is not None:
+            stats.view, stats.action = view_name, action
+        request._db_query_budget = query_budget_for(view_class, action)
+        return None
+
+    def server_timing(self, stats, existing=None):
+        entries = [f'db;dur={stats.total_ms:.2f};desc="{stats.count} queries"']
+        for index, record in enumerate(stats.slowest):
+            name = f"db-{index + 1}-{record.name}"
+            description = f"{record.name} {record.collection or ''}".strip()
+            entries.append(f'{name};dur={record.duration_ms:.2f};desc="{description}"')
+        if existing:
+            entries.insert(0, existing)
+        return ', '.join(entries)
+
+
+class MetricsMiddleware:
+    """Records latency, response size and in-flight requests for /metrics."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+        elapsed = time.perf_counter() - started
+
+        # Unrouted paths share one label set to keep cardinality bounded
+        view, action = getattr(request, '_metrics_labels', ('unmatched', 'none'))
+        REQUEST_LATENCY.labels(view, action, request.method, str(response.status_code)).observe(elapsed)
+        if not response.streaming:
+            RESPONSE_SIZE.labels(view, action).observe(len(response.content))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _, view_name, action = resolve_view_action(view_func, request)
+        request._metrics_labels = (view_name, action)
+        return None
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    Sheds load on expensive actions: at most CONCURRENCY_LIMITS[scope]
+    requests of a throttle scope run at once across all workers. Further ones
+    get 503 with Retry-After instead of waiting for a free thread.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            lease_id = getattr(request, '_concurrency_lease', None)
+            if lease_id is not None:
+                try:
+                    get_store().release(lease_id)
+                except Exception:
+                    # The lease expires on its own
+                    db_logger.warning("Could not release concurrency lease %s", lease_id, exc_info=True)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.THROTTLE_ENABLED:
+            return None
+        view_class, _, action = resolve_view_action(view_func, request)
+        scope = throttle_scope_for(view_class, action, request.method)
+        limit = settings.CONCURRENCY_LIMITS.get(scope)
+        if limit is None:
+            return None
+        try:
+            lease_id = get_store().acquire(scope, limit, settings.CONCURRENCY_LEASE_SECONDS)
+        except Exception:
+            db_logger.warning("Throttle store unavailable; not limiting %s", scope, exc_info=True)
+            return None
+        if lease_id is None:
+            THROTTLED_REQUESTS.labels(scope, 'concurrency').inc()
+            response = JsonResponse(
+                {'detail': f"Too many {scope} requests are running; try again shortly."}, status=503,
+            )
+            response['Retry-After'] = str(settings.CONCURRENCY_RETRY_AFTER_SECONDS)
+            return response
+        request._concurrency_lease = lease_id
+        return None
+
+
+class ReadRoutingMiddleware:
+    """
+    Runs the actions a viewset lists in `analytical_actions` inside
+    analytical_reads(), so their reads can be served by secondaries
+    (see magazine/mongo.py). All other actions read from the primary.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with analytical_reads() if self.is_analytical(request) else nullcontext():
+            return self.get_response(request)
+
+    def is_analytical(self, request):
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+        view_class, _, action = resolve_view_action(match.func, request)
+        return action in (getattr(view_class, 'analytical_actions', None) or ())
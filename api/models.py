@@ -1,35 +1,132 @@
 import mongoengine as me
-from datetime import datetime, date
+from datetime import datetime, date, time
 import calendar
 from .utils import generate_id
 import pytz
 import uuid
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 
-class SubscriberCategory(me.Document):
+from magazine.mongo import current_session, transaction
+
+
+class ChangeEventMixin:
+    """
+    Appends an OutboxEvent for every save and delete of the document, in the
+    same transaction when transactions are available. `event_fields` are
+    copied into the event so consumers rarely need to read the document.
+    Queryset-level .update()/.delete() bypass this and must append their own
+    events with OutboxEvent.append.
+
+    Documents using the mixin declare `updated_at`, which every write stamps
+    and delta sync (api/sync.py) pages by; deletes leave a Tombstone. Raw
+    writes must set updated_at and record tombstones themselves.
+    """
+    event_fields = ()
+
+    def event_data(self):
+        if not self.event_fields:
+            return {}
+        son = self.to_mongo()
+        return {field: son.get(field) for field in self.event_fields}
+
+    def save(self, *args, **kwargs):
+        op = 'insert' if self._created else 'update'
+        changed = [] if op == 'insert' else sorted({field.split('.')[0] for field in self._get_changed_fields()})
+        if op == 'update' and not changed:
+            return super().save(*args, **kwargs)
+        self.updated_at = datetime.utcnow()
+        with transaction() as session:
+            if session is None:
+                result = super().save(*args, **kwargs)
+            else:
+                result = self._save_in_session(session, kwargs.get('validate', True), kwargs.get('clean', True))
+            OutboxEvent.append(self._get_collection_name(), op, self.pk, changed, self.event_data())
+        return result
+
+    def _save_in_session(self, session, validate=True, clean=True):
+        """save() with pymongo, which unlike MongoEngine can write in the transaction's session."""
+        if validate:
+            self.validate(clean=clean)
+        collection = self._get_collection()
+        try:
+            if self._created:
+                self.pk = collection.insert_one(self.to_mongo(), session=session).inserted_id
+            else:
+                update = self._get_update_doc()
+                if update:
+                    collection.update_one({'_id': self.pk}, update, session=session)
+        except DuplicateKeyError as err:
+            raise me.NotUniqueError(f"Tried to save duplicate unique keys ({err})")
+        self._clear_changed_fields()
+        self._created = False
+        return self
+
+    def delete(self, *args, **kwargs):
+        with transaction() as session:
+            # Delete rules (reverse_delete_rule cascades) only run through MongoEngine, outside the session
+            if session is None or self._meta.get('delete_rules'):
+                result = super().delete(*args, **kwargs)
+            else:
+                result = self._get_collection().delete_one({'_id': self.pk}, session=session)
+            OutboxEvent.append(self._get_collection_name(), 'delete', self.pk, [], self.event_data())
+            Tombstone.record(self._get_collection_name(), [self.pk])
+        return result
+
+    @classmethod
+    def conditional_set(cls, pk, expected, changes, unset=()):
+        """
+        Applies `changes` ($set) and `unset` to document `pk` with one
+        findAndModify, only if it also matches `expected`, and appends the
+        update event. Returns True if the document was written.
+        """
+        update = {'$set': dict(changes, updated_at=datetime.utcnow())}
+        if unset:
+            update['$unset'] = {field: '' for field in unset}
+        projection = {field: 1 for field in cls.event_fields} or {'_id': 1}
+        with transaction():
+            doc = cls._get_collection().find_one_and_update(
+                dict(expected, _id=pk), update, projection=projection,
+                return_document=ReturnDocument.AFTER, session=current_session(),
+            )
+            if doc is None:
+                return False
+            OutboxEvent.append(
+                cls._get_collection_name(), 'update', pk, sorted([*changes, *unset]),
+                {field: doc.get(field) for field in cls.event_fields},
+            )
+        return True
+
+
+class SubscriberCategory(ChangeEventMixin, me.Document):
     _id = me.StringField(primary_key=True, default=lambda: generate_id('SCAT', 'subscriber_category'))
     name = me.StringField(max_length=255, unique=True)
+    updated_at = me.DateTimeField()
 
     meta = {'indexes': ['name']}
 
-class SubscriberType(me.Document):
+class SubscriberType(ChangeEventMixin, me.Document):
     _id = me.StringField(primary_key=True, default=lambda: generate_id('STYPE', 'subscriber_type'))
     name = me.StringField(max_length=255, unique=True)
+    updated_at = me.DateTimeField()
 
     meta = {'indexes': ['name']}
 
-class SubscriptionLanguage(me.Document):
+class SubscriptionLanguage(ChangeEventMixin, me.Document):
     _id = me.StringField(primary_key=True, default=lambda: generate_id('SLANG', 'subscription_language'))
     name = me.StringField(max_length=50, unique=True)
+    updated_at = me.DateTimeField()
 
     meta = {'indexes': ['name']}
 
-class SubscriptionMode(me.Document):
+class SubscriptionMode(ChangeEventMixin, me.Document):
     _id = me.StringField(primary_key=True, default=lambda: generate_id('SMODE', 'subscription_mode'))
     name = me.StringField(max_length=50, unique=True)
+    updated_at = me.DateTimeField()
 
     meta = {'indexes': ['name']}
 
-class SubscriptionPlan(me.Document):
+class SubscriptionPlan(ChangeEventMixin, me.Document):
     _id = me.StringField(primary_key=True, default=lambda: generate_id('SPLAN', 'subscription_plan'))
     version = me.StringField(max_length=10)
     name = me.StringField(max_length=255)
@@ -38,6 +135,7 @@ class SubscriptionPlan(me.Document):
     subscription_language = me.ReferenceField(SubscriptionLanguage, required=True)
     subscription_mode = me.ReferenceField(SubscriptionMode, required=True)
     duration_in_months = me.IntField(required=True)
+    updated_at = me.DateTimeField()
 
     meta = {
         'indexes': [
@@ -82,14 +180,15 @@ class SubscriptionPlan(me.Document):
             return f"v{latest_version_number + 1}"
         return "v1"
 
-class PaymentMode(me.Document):
+class PaymentMode(ChangeEventMixin, me.Document):
     _id = me.StringField(primary_key=True, default=lambda: generate_id('PMODE', 'payment_mode'))
     name = me.StringField(max_length=255)
     details = me.StringField(max_length=400)
+    updated_at = me.DateTimeField()
 
     meta = {'indexes': ['name']}
 
-class MagazineSubscriber(me.Document):
+class MagazineSubscriber(ChangeEventMixin, me.Document):
     _id = me.StringField(primary_key=True, default=lambda: generate_id('SUBS', 'subscriber'))
     name = me.StringField(max_length=255, required=True)
     registration_number = me.StringField(max_length=255, unique=True, required=False)
@@ -105,20 +204,59 @@ class MagazineSubscriber(me.Document):
     notes = me.StringField(required=False)
     hasActiveSubscriptions = me.BooleanField(default=False, required=False)
     isDeleted = me.BooleanField(default=False, required=False)
+    deleted_at = me.DateTimeField(null=True)
     created_at = me.DateTimeField(default=datetime.utcnow)
+    updated_at = me.DateTimeField()
 
     meta = {
         'indexes': ['registration_number', 'phone', 'email']
     }
 
+    event_fields = ('pincode', 'isDeleted', 'hasActiveSubscriptions')
+
+    def save(self, *args, **kwargs):
+        # Consumers that group by pincode (geo rollups) need the old one too
+        self._previous_pincode = None
+        if self.pk and not self._created and 'pincode' in self._get_changed_fields():
+            self._previous_pincode = MagazineSubscriber.objects(pk=self.pk).scalar('pincode').first()
+        return super().save(*args, **kwargs)
+
+    def event_data(self):
+        data = super().event_data()
+        if getattr(self, '_previous_pincode', None):
+            data['previous_pincode'] = self._previous_pincode
+        return data
+
     def get_subscriptions(self):
         # eager load subscription_plan & payment_mode to reduce queries downstream
         return Subscription.objects(subscriber=self).select_related('subscription_plan', 'payment_mode')
 
-class Subscription(me.Document):
+class PlanSnapshot(me.EmbeddedDocument):
+    """The plan as it was when the subscription was bought; later plan edits do not change it."""
+    name = me.StringField(max_length=255)
+    version = me.StringField(max_length=10)
+    price = me.DecimalField()
+    duration_in_months = me.IntField()
+    language = me.StringField(max_length=255)
+    mode = me.StringField(max_length=255)
+
+    @classmethod
+    def of(cls, plan):
+        return cls(
+            name=plan.name,
+            version=plan.version,
+            price=plan.subscription_price,
+            duration_in_months=plan.duration_in_months,
+            language=getattr(plan.subscription_language, 'name', None),
+            mode=getattr(plan.subscription_mode, 'name', None),
+        )
+
+class Subscription(ChangeEventMixin, me.Document):
     _id = me.StringField(primary_key=True, default=lambda: generate_id('SUBSCR', 'subscription'))
     subscriber = me.ReferenceField(MagazineSubscriber, reverse_delete_rule=me.CASCADE)
     subscription_plan = me.ReferenceField(SubscriptionPlan, null=True)
+    # Written when the plan is set; readers use it instead of dereferencing subscription_plan
+    plan = me.EmbeddedDocumentField(PlanSnapshot)
     start_date = me.DateField(required=True)
     end_date = me.DateField()
     active = me.BooleanField(default=True)
@@ -126,6 +264,9 @@ class Subscription(me.Document):
     payment_mode = me.ReferenceField(PaymentMode, null=True)
     payment_id = me.StringField(max_length=100)
     payment_date = me.DateField(null=True)
+    updated_at = me.DateTimeField()
+
+    event_fields = ('subscriber', 'subscription_plan', 'start_date', 'end_date')
 
     meta = {
         'indexes': [
@@ -138,6 +279,8 @@ class Subscription(me.Document):
     }
 
     def clean(self):
+        if self.subscription_plan and (self.plan is None or 'subscription_plan' in self._get_changed_fields()):
+            self.plan = PlanSnapshot.of(self.subscription_plan)
         if not self.start_date or not isinstance(self.start_date, date):
             self.start_date = self.calculate_start_date()
         self.end_date = self.calculate_end_date()
@@ -145,16 +288,40 @@ class Subscription(me.Document):
 
     def save(self, *args, **kwargs):
         self.clean()
-        super().save(*args, **kwargs)
-        self.update_active_subscription_flag(self.subscriber)
+        # The subscription, its event and the subscriber flag commit together
+        with transaction():
+            result = super().save(*args, **kwargs)
+            self.update_active_subscription_flag(self.subscriber, saved=self)
+        return result
+
+    def delete(self, *args, **kwargs):
+        with transaction():
+            result = super().delete(*args, **kwargs)
+            self.update_active_subscription_flag(self.subscriber)
+        return result
 
     @classmethod
-    def update_active_subscription_flag(cls, subscriber):
+    def update_active_subscription_flag(cls, subscriber, saved=None):
+        """
+        Sets hasActiveSubscriptions with a conditional $set, so nothing is
+        written unless the value changes. A just-saved subscription that is
+        itself running settles the answer without counting.
+        """
+        subscriber_id = getattr(subscriber, 'pk', subscriber)
         now = datetime.now(pytz.timezone('Asia/Kolkata'))
-        active_count = cls.objects(subscriber=subscriber, end_date__gte=now).count()
-        if subscriber.hasActiveSubscriptions != (active_count > 0):
-            subscriber.hasActiveSubscriptions = active_count > 0
-            subscriber.save()
+        if saved is not None and saved.end_date and datetime.combine(saved.end_date, time.min, tzinfo=pytz.utc) >= now:
+            active = True
+        else:
+            # In the transaction's session, so a subscription deleted in it no longer counts
+            active = cls._get_collection().count_documents(
+                {'subscriber': subscriber_id, 'end_date': {'$gte': now}}, limit=1, session=current_session(),
+            ) > 0
+        MagazineSubscriber.conditional_set(
+            subscriber_id, {'hasActiveSubscriptions': {'$ne': active}}, {'hasActiveSubscriptions': active},
+        )
+        if isinstance(subscriber, MagazineSubscriber):
+            subscriber.hasActiveSubscriptions = active
+        return active
 
     def calculate_start_date(self):
         today = date.today()
@@ -163,7 +330,7 @@ class Subscription(me.Document):
         return date(next_year, next_month, 10)
 
     def calculate_end_date(self):
-        duration = self.subscription_plan.duration_in_months if self.subscription_plan else 0
+        duration = self.plan.duration_in_months if self.plan else 0
         start_date = self.start_date or date.today()
         end_year = start_date.year + ((start_date.month + duration - 1) // 12)
         end_month = (start_date.month + duration - 1) % 12 + 1
@@ -189,15 +356,15 @@ class AdminUser(me.Document):
 
     def update_last_login(self):
         self.last_login = datetime.utcnow()
-        self.save()
+        AdminUser.objects(pk=self.pk).update_one(set__last_login=self.last_login)
 
     def deactivate_account(self):
         self.active = False
-        self.save()
+        AdminUser.objects(pk=self.pk, active__ne=False).update_one(set__active=False)
 
     def activate_account(self):
         self.active = True
-        self.save()
+        AdminUser.objects(pk=self.pk, active__ne=True).update_one(set__active=True)
 
     def is_active(self):
         return self.active
@@ -215,4 +382,169 @@ class UserToken(me.Document):
     @staticmethod
     def get_user_by_token(token):
         user_token = UserToken.objects(token=token).first()
-        return user_token.user if user_token else None
\ No newline at end of file
+        return user_token.user if user_token else None
+
+class RenewalNotice(me.Document):
+    # Natural key "<subscription id>:<window days>" makes reruns idempotent
+    _id = me.StringField(primary_key=True)
+    subscription = me.StringField(required=True)
+    subscriber = me.StringField(required=True)
+    window_days = me.IntField(required=True)
+    end_date = me.DateField(required=True)
+    batch_id = me.StringField(required=True)
+    sent_at = me.DateTimeField(default=datetime.utcnow)
+
+    meta = {
+        'indexes': ['subscriber', 'batch_id']
+    }
+
+    @staticmethod
+    def make_id(subscription_id, window_days):
+        return f"{subscription_id}:{window_days}"
+
+
+class DuplicateCandidate(me.Document):
+    # Natural key "<lower id>:<higher id>" so each pair is stored once
+    _id = me.StringField(primary_key=True)
+    subscriber_a = me.StringField(required=True)
+    subscriber_b = me.StringField(required=True)
+    score = me.FloatField(required=True)
+    reasons = me.ListField(me.StringField())
+    status = me.StringField(max_length=20, choices=["open", "merged", "dismissed"], default="open")
+    detected_at = me.DateTimeField(default=datetime.utcnow)
+
+    meta = {
+        'indexes': [('status', '-score'), 'subscriber_a', 'subscriber_b']
+    }
+
+    @staticmethod
+    def make_id(first_id, second_id):
+        return ':'.join(sorted((first_id, second_id)))
+
+
+class GeoRollup(me.Document):
+    # Active subscribers per pincode, category and type; see api/geo.py
+    _id = me.StringField(primary_key=True)
+    state = me.StringField(required=True)
+    district = me.StringField(required=True)
+    pincode = me.StringField(required=True)
+    category = me.StringField(null=True)
+    stype = me.StringField(null=True)
+    count = me.IntField(default=0)
+    refreshed_at = me.DateTimeField(default=datetime.utcnow)
+
+    meta = {
+        'indexes': [('state', 'district', 'pincode'), 'pincode']
+    }
+
+
+class GeoDirtyPincode(me.Document):
+    # Pincodes whose rollups are stale
+    _id = me.StringField(primary_key=True)
+    marked_at = me.DateTimeField(default=datetime.utcnow)
+
+    @classmethod
+    def mark(cls, *pincodes):
+        now = datetime.utcnow()
+        for pincode in {pincode for pincode in pincodes if pincode}:
+            cls.objects(pk=pincode).update_one(set__marked_at=now, upsert=True)
+
+
+class DispatchRun(me.Document):
+    # One manifest per issue ("YYYY-MM"); entries live in DispatchEntry
+    _id = me.StringField(primary_key=True)
+    dispatch_date = me.DateField(required=True)
+    status = me.StringField(max_length=20, choices=["snapshotting", "ready"], default="snapshotting")
+    entries = me.IntField(default=0)
+    pincodes = me.IntField(default=0)
+    outputs = me.DictField()
+    created_at = me.DateTimeField(default=datetime.utcnow)
+    completed_at = me.DateTimeField(null=True)
+
+
+class DispatchEntry(me.Document):
+    # Snapshot row "<issue>:<subscriber id>"; indexed for manifest order in api/indexes.py
+    _id = me.StringField(primary_key=True)
+    issue = me.StringField(required=True)
+    subscriber = me.StringField(required=True)
+    name = me.StringField()
+    address = me.StringField()
+    city_town = me.StringField()
+    district = me.StringField()
+    state = me.StringField()
+    pincode = me.StringField()
+    phone = me.StringField()
+    copies = me.IntField(default=1)
+
+
+class ArchivedSubscriber(me.DynamicDocument):
+    # Subscribers moved out of the hot collection by api/archive.py, stored as they were
+    _id = me.StringField(primary_key=True)
+    archived_at = me.DateTimeField()
+
+    meta = {'collection': 'magazine_subscriber_archive'}
+
+
+class ArchivedSubscription(me.DynamicDocument):
+    # Subscriptions of archived subscribers and long-expired ones, stored as they were
+    _id = me.StringField(primary_key=True)
+    archived_at = me.DateTimeField()
+
+    meta = {'collection': 'subscription_archive'}
+
+
+class OutboxEvent(me.Document):
+    # Compact change events, consumed in _id order by api/outbox.py; TTL index in api/indexes.py
+    collection = me.StringField(required=True)
+    op = me.StringField(max_length=10, choices=["insert", "update", "delete"], required=True)
+    doc_id = me.StringField(required=True)
+    changed = me.ListField(me.StringField())
+    data = me.DictField()
+    ts = me.DateTimeField(default=datetime.utcnow)
+
+    meta = {'collection': 'outbox_event'}
+
+    @classmethod
+    def append(cls, collection, op, doc_id, changed=(), data=None):
+        # Inserted with pymongo so it commits with the enclosing transaction, if any
+        event = cls(collection=collection, op=op, doc_id=str(doc_id), changed=list(changed), data=data or {})
+        event.pk = cls._get_collection().insert_one(event.to_mongo(), session=current_session()).inserted_id
+        event._created = False
+        return event
+
+
+class Tombstone(me.Document):
+    # Deleted and archived documents, for delta sync (api/sync.py); TTL index in api/indexes.py
+    _id = me.StringField(primary_key=True)  # '<collection>:<doc_id>'
+    collection = me.StringField(required=True)
+    doc_id = me.StringField(required=True)
+    deleted_at = me.DateTimeField(required=True)
+
+    meta = {'collection': 'tombstone'}
+
+    @classmethod
+    def record(cls, collection, doc_ids, deleted_at=None):
+        """Upserts the tombstones of `doc_ids`, in the enclosing transaction if any."""
+        deleted_at = deleted_at or datetime.utcnow()
+        operations = [
+            UpdateOne({'_id': f'{collection}:{doc_id}'},
+                      {'$set': {'collection': collection, 'doc_id': str(doc_id), 'deleted_at': deleted_at}},
+                      upsert=True)
+            for doc_id in doc_ids
+        ]
+        if operations:
+            cls._get_collection().bulk_write(operations, ordered=False, session=current_session())
+
+    @classmethod
+    def clear(cls, collection, doc_ids):
+        """Removes the tombstones of documents that exist again."""
+        if doc_ids:
+            cls._get_collection().delete_many({'_id': {'$in': [f'{collection}:{doc_id}' for doc_id in doc_ids]}})
+
+
+class OutboxOffset(me.Document):
+    # Per-consumer position: last event _id handled and, in change-stream mode, the resume token
+    _id = me.StringField(primary_key=True)
+    last_id = me.ObjectIdField(null=True)
+    resume_token = me.DictField(null=True)
+    updated_at = me.DateTimeField(default=datetime.utcnow)
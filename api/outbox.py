@@ -0,0 +1,139 @@
+"""
+Change-event bus.
+
+Models with ChangeEventMixin append an OutboxEvent for every save and
+delete. A Consumer reads the events in _id order and passes each one to the
+handlers registered for its collection. Its position is stored in
+OutboxOffset after every batch. Delivery is at-least-once: a crash before
+the offset is saved replays the batch, so handlers must be idempotent.
+
+Poll mode works on any server. It only reads events older than
+OUTBOX_SETTLE_SECONDS, so an event whose _id was allocated before a
+neighbour's but committed after it is not skipped. On a replica set, watch
+mode tails the outbox with a change stream and resumes from the stored
+token.
+"""
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from importlib import import_module
+
+from django.conf import settings
+from pymongo.errors import OperationFailure
+
+from .models import OutboxEvent, OutboxOffset
+
+logger = logging.getLogger(__name__)
+
+# collection name -> [(handler name, function)]
+HANDLERS = defaultdict(list)
+
+# Server error codes meaning change streams are unavailable (standalone server)
+CHANGE_STREAM_UNSUPPORTED = {40573, 40324}
+
+
+def handler(*collections):
+    """Registers `func(event)` for events of the given collections; `event` is the raw document."""
+    def register(func):
+        for collection in collections:
+            HANDLERS[collection].append((f"{func.__module__}.{func.__qualname__}", func))
+        return func
+    return register
+
+
+def load_handlers():
+    for module in settings.OUTBOX_HANDLER_MODULES:
+        import_module(module)
+
+
+class Consumer:
+    def __init__(self, name, batch_size=100, settle_seconds=None, poll_interval=None):
+        self.name = name
+        self.batch_size = batch_size
+        self.settle_seconds = settings.OUTBOX_SETTLE_SECONDS if settle_seconds is None else settle_seconds
+        self.poll_interval = settings.OUTBOX_POLL_INTERVAL_SECONDS if poll_interval is None else poll_interval
+        self.offsets = OutboxOffset._get_collection()
+        self.events = OutboxEvent._get_collection()
+
+    def position(self):
+        return self.offsets.find_one({'_id': self.name}) or {}
+
+    def save_position(self, last_id, resume_token=None):
+        update = {'last_id': last_id, 'updated_at': datetime.utcnow()}
+        if resume_token is not None:
+            update['resume_token'] = resume_token
+        self.offsets.update_one({'_id': self.name}, {'$set': update}, upsert=True)
+
+    def dispatch(self, event):
+        for name, func in HANDLERS.get(event['collection'], ()):
+            try:
+                func(event)
+            except Exception:
+                logger.exception("Outbox handler %s failed on event %s", name, event['_id'])
+                raise
+
+    def poll_once(self, settle_seconds=None):
+        """Handles one batch of settled events; returns how many were handled."""
+        settle_seconds = self.settle_seconds if settle_seconds is None else settle_seconds
+        query = {'ts': {'$lte': datetime.utcnow() - timedelta(seconds=settle_seconds)}}
+        last_id = self.position().get('last_id')
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+
+        handled = 0
+        for event in self.events.find(query).sort('_id', 1).limit(self.batch_size):
+            self.dispatch(event)
+            last_id = event['_id']
+            handled += 1
+        if handled:
+            self.save_position(last_id)
+        return handled
+
+    def poll(self, once=False):
+        while True:
+            try:
+                handled = self.poll_once()
+            except Exception:
+                # The batch is retried from the stored offset
+                logger.exception("Outbox consumer %s failed; retrying", self.name)
+                handled = 0
+            if once:
+                return handled
+            if handled < self.batch_size:
+                time.sleep(self.poll_interval)
+
+    def watch(self):
+        """Tails the outbox with a change stream. Raises OperationFailure if unsupported."""
+        resume_token = self.position().get('resume_token')
+        options = {'resume_after': resume_token} if resume_token else {}
+        pending, event = 0, None
+        with self.events.watch(
+            [{'$match': {'operationType': 'insert'}}], max_await_time_ms=int(self.poll_interval * 1000), **options,
+        ) as stream:
+            if not resume_token:
+                # First run: the stream is open, so draining the outbox now cannot
+                # leave a gap. Events in both are handled twice, which at-least-once allows.
+                while self.poll_once(settle_seconds=0) == self.batch_size:
+                    pass
+            while stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    event = change['fullDocument']
+                    self.dispatch(event)
+                    pending += 1
+                # Save the position every batch, and whenever the stream goes quiet
+                if pending and (change is None or pending >= self.batch_size):
+                    self.save_position(event['_id'], stream.resume_token)
+                    pending = 0
+
+    def run(self, mode='auto'):
+        load_handlers()
+        if mode in ('auto', 'watch'):
+            try:
+                return self.watch()
+            except OperationFailure as e:
+                if mode == 'watch' or e.code not in CHANGE_STREAM_UNSUPPORTED:
+                    raise
+                logger.info("Change streams unavailable (%s); polling the outbox instead.", e)
+        return self.poll()
@@ -0,0 +1,109 @@
+"""
+Keyset pagination.
+
+A page is read with a range condition on its sort key instead of skip(), so
+any page costs the same as the first. Rows inserted while a client pages do
+not shift the later pages. Rows are ordered by (ordering field, _id), which
+is unique and stable. The opaque cursor carries both values of the last row
+on the page.
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    # Orderings callers may ask for; the first is the default
+    orderings = ('-start_date', 'start_date')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request)
+        field = self.ordering.lstrip('-')
+        descending = self.ordering.startswith('-')
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            value, last_id = cursor
+            op = '$lt' if descending else '$gt'
+            queryset = queryset.filter(__raw__={'$or': [
+                {field: {op: value}},
+                {field: value, '_id': {op: last_id}},
+            ]})
+        # A sparse projection (?fields=) must still load the keys of the cursor
+        if queryset._loaded_fields:
+            queryset = queryset.only(field)
+
+        sign = '-' if descending else '+'
+        rows = list(queryset.order_by(f'{sign}{field}', f'{sign}_id').limit(self.page_size + 1))
+        self.next_cursor = None
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            self.next_cursor = self.encode_cursor(getattr(rows[-1], field), rows[-1].pk)
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({'results': data, 'next': self.get_next_link()})
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: "Must be an integer."})
+        return max(1, min(size, self.max_page_size))
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param) or self.orderings[0]
+        if ordering not in self.orderings:
+            raise ValidationError({self.ordering_query_param: f"Must be one of: {', '.join(self.orderings)}."})
+        return ordering
+
+    def encode_cursor(self, value, last_id):
+        if isinstance(value, datetime):
+            kind = 'datetime'
+        elif isinstance(value, date):
+            kind = 'date'
+        else:
+            kind = 'value'
+        payload = {
+            'o': self.ordering,
+            'k': kind,
+            'v': value.isoformat() if kind != 'value' else value,
+            'id': last_id,
+        }
+        return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+
+    def decode_cursor(self, request):
+        """(sort value as stored in MongoDB, last _id), or None on the first page."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            value = payload['v']
+            if payload['k'] in ('date', 'datetime'):
+                # DateFields are stored as midnight datetimes
+                value = datetime.fromisoformat(value)
+            last_id = payload['id']
+        except (binascii.Error, ValueError, KeyError, TypeError):
+            raise ValidationError({self.cursor_query_param: "Invalid cursor."})
+        if payload.get('o') != self.ordering:
+            raise ValidationError({self.cursor_query_param: "The cursor belongs to a different ordering."})
+        return value, last_id
@@ -0,0 +1,11 @@
+from rest_framework.permissions import BasePermission
+
+from .models import AdminUser
+
+
+class IsAdminUser(BasePermission):
+    """Allows access only to requests authenticated as an active AdminUser."""
+
+    def has_permission(self, request, view):
+        user = request.user
+        return isinstance(user, AdminUser) and user.is_active()
@@ -0,0 +1,218 @@
+"""
+Pincode directory.
+
+The India Post office list (one row per post office) is compiled into a small
+binary file: a sorted uint32 array of pincodes, three uint32 string ids per
+pincode (city, district, state) and a table of the distinct place names. The
+file is memory-mapped read-only, so every worker shares the same page-cache
+copy, and a lookup is a bisect over the pincode array.
+
+`build_pincode_directory` compiles the file from a CSV; if it is missing it is
+compiled from PINCODE_DIRECTORY_SOURCE on first use. With neither the file
+nor a source the directory is unavailable: lookups return None, so there is
+no autofill or strict validation, and /api/pincodes/ answers 503.
+
+api/seed/sample_pincodes.csv.gz is synthetic (99 sequential pincodes per
+seeded district, matching seed_data) for development and tests only; it is
+never used unless asked for with `build_pincode_directory --sample`.
+"""
+import csv
+import gzip
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+
+# Synthetic, for development and tests; not a real pincode list
+SAMPLE_SOURCE = Path(__file__).resolve().parent / 'seed' / 'sample_pincodes.csv.gz'
+
+MAGIC = b'PINDIR1' + (b'L' if sys.byteorder == 'little' else b'B')
+# magic, pincode count, string count
+HEADER = struct.Struct('=8sII')
+UINT32 = 4
+
+# Accepted column names, first match wins (India Post directory names first)
+COLUMNS = {
+    'pincode': ('pincode', 'pin'),
+    'city': ('taluk', 'city', 'city_town', 'officename'),
+    'district': ('districtname', 'district'),
+    'state': ('statename', 'state'),
+}
+
+PincodeEntry = namedtuple('PincodeEntry', ['pincode', 'city_town', 'district', 'state'])
+
+
+def _clean(value):
+    value = ' '.join((value or '').split())
+    if not value or value.upper() == 'NA':
+        return ''
+    return value.title() if value.isupper() else value
+
+
+def _column(header, field):
+    lowered = {name.strip().lower(): name for name in header}
+    for candidate in COLUMNS[field]:
+        if candidate in lowered:
+            return lowered[candidate]
+    return None
+
+
+def read_source(path):
+    """Yields (pincode, city, district, state, is_delivery_office) per row of a directory CSV (plain or .gz)."""
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as handle:
+        reader = csv.DictReader(handle)
+        columns = {field: _column(reader.fieldnames or [], field) for field in COLUMNS}
+        missing = [field for field in ('pincode', 'district', 'state') if columns[field] is None]
+        if missing:
+            raise ValueError(f"{path}: missing column(s) {', '.join(missing)}")
+        city_column = columns['city']
+        delivery_column = next(
+            (name for name in reader.fieldnames if name.strip().lower() == 'deliverystatus'), None
+        )
+
+        for row in reader:
+            pincode = (row[columns['pincode']] or '').strip()
+            if not (len(pincode) == 6 and pincode.isdigit() and pincode[0] != '0'):
+                continue
+            delivery = not delivery_column or (row[delivery_column] or '').strip().lower() != 'non-delivery'
+            yield (
+                int(pincode),
+                _clean(row[city_column]) if city_column else '',
+                _clean(row[columns['district']]),
+                _clean(row[columns['state']]),
+                delivery,
+            )
+
+
+def build_directory(source, output):
+    """
+    Compiles `source` into the binary directory at `output` and returns the
+    number of pincodes. A pincode served by several post offices takes the
+    place names of its first delivery office. The file is written to a
+    temporary name and renamed, so concurrent readers never see a partial file.
+    """
+    places = {}
+    for pincode, city, district, state, delivery in read_source(source):
+        current = places.get(pincode)
+        if current is None or (delivery and not current[3]):
+            places[pincode] = (city, district, state, delivery)
+
+    strings, string_ids = [], {}
+
+    def intern(value):
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value.encode('utf-8'))
+        return string_ids[value]
+
+    intern('')
+    codes = sorted(places)
+    fields = []
+    for pincode in codes:
+        city, district, state, _ = places[pincode]
+        fields.extend((intern(city), intern(district), intern(state)))
+
+    offsets, position = [], 0
+    for encoded in strings:
+        offsets.append(position)
+        position += len(encoded)
+    offsets.append(position)
+
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=output.parent, prefix=output.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(HEADER.pack(MAGIC, len(codes), len(strings)))
+            for values in (codes, fields, offsets):
+                handle.write(struct.pack(f'={len(values)}I', *values))
+            handle.write(b''.join(strings))
+        os.replace(temp_path, output)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return len(codes)
+
+
+class PincodeDirectory:
+    """Read-only view over a compiled directory file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, string_count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a pincode directory built on this platform")
+
+        view = memoryview(self._map)
+        start = HEADER.size
+        self._codes = view[start:start + count * UINT32].cast('I')
+        start += count * UINT32
+        self._fields = view[start:start + 3 * count * UINT32].cast('I')
+        start += 3 * count * UINT32
+        self._offsets = view[start:start + (string_count + 1) * UINT32].cast('I')
+        self._strings = view[start + (string_count + 1) * UINT32:]
+        self._place = lru_cache(maxsize=4096)(self._decode)
+
+    def __len__(self):
+        return len(self._codes)
+
+    def _decode(self, string_id):
+        return str(self._strings[self._offsets[string_id]:self._offsets[string_id + 1]], 'utf-8')
+
+    def lookup(self, pincode):
+        """The PincodeEntry for a six-digit pincode string, or None."""
+        if not (isinstance(pincode, str) and len(pincode) == 6 and pincode.isdigit()):
+            return None
+        code = int(pincode)
+        index = bisect_left(self._codes, code)
+        if index == len(self._codes) or self._codes[index] != code:
+            return None
+        base = 3 * index
+        city, district, state = self._fields[base], self._fields[base + 1], self._fields[base + 2]
+        return PincodeEntry(pincode, self._place(city), self._place(district), self._place(state))
+
+    def __contains__(self, pincode):
+        return self.lookup(pincode) is not None
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def get_directory():
+    """
+    The process-wide directory, compiled from PINCODE_DIRECTORY_SOURCE if the
+    file is missing, or None when there is neither.
+    """
+    global _directory
+    if _directory is None:
+        with _directory_lock:
+            if _directory is None:
+                path = Path(settings.PINCODE_DIRECTORY_PATH)
+                if not path.exists():
+                    if not settings.PINCODE_DIRECTORY_SOURCE:
+                        return None
+                    build_directory(settings.PINCODE_DIRECTORY_SOURCE, path)
+                _directory = PincodeDirectory(path)
+    return _directory
+
+
+def directory_available():
+    return get_directory() is not None
+
+
+def lookup_pincode(pincode):
+    """The PincodeEntry for `pincode`, or None when it is unknown or there is no directory."""
+    directory = get_directory()
+    return directory.lookup(pincode) if directory is not None else None
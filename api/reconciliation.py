@@ -0,0 +1,276 @@
+"""
+Payment reconciliation from bank and UPI statements.
+
+A statement is a CSV with a header row. Columns are found by name (see
+COLUMNS): an amount, a date and, usually, a reference (UTR, UPI ref or our
+payment id). Lines are handled in chunks of CHUNK_SIZE. Each chunk costs one
+$in query on the payment_id index, then, in one transaction, a read of the
+matches still unpaid, one unordered bulk_write and an insert of their
+outbox events.
+
+Each line is matched like this:
+1. By reference, to the subscription with that payment_id. If the amount
+   differs from the price in its plan snapshot, the line is ambiguous.
+2. Otherwise by amount and date, to an unpaid (Pending or Failed)
+   subscription. Its plan price must equal the amount, and its start_date
+   must fall between MATCH_DAYS_AFTER_START before the payment date and
+   MATCH_DAYS_BEFORE_START after it. One candidate is a match; several make
+   the line ambiguous.
+
+A subscription is matched at most once per statement. A match sets
+payment_status to Paid and payment_date, and fills payment_id when it is
+empty. Subscriptions already Paid are reported but not written.
+"""
+import csv
+import re
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from pymongo import UpdateOne
+
+from magazine.mongo import transaction
+
+from .models import OutboxEvent, Subscription
+
+CHUNK_SIZE = 5000
+# Payments usually arrive before the subscription starts (the 10th of the next month)
+MATCH_DAYS_BEFORE_START = 45
+MATCH_DAYS_AFTER_START = 30
+UNPAID = ['Pending', 'Failed']
+
+# Header names (lower case, punctuation collapsed to single spaces) per column
+COLUMNS = {
+    'reference': ('payment id', 'reference', 'reference no', 'ref no', 'utr', 'utr no', 'transaction id',
+                  'txn id', 'upi ref', 'upi ref no', 'upi transaction id', 'rrn', 'cheque ref no'),
+    'amount': ('amount', 'credit', 'credit amount', 'cr amount', 'deposit', 'deposit amount', 'amount inr'),
+    'date': ('date', 'txn date', 'transaction date', 'value date', 'payment date', 'posting date'),
+}
+DATE_FORMATS = ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y', '%d-%b-%Y', '%d %b %Y', '%d-%m-%y', '%d/%m/%y')
+
+
+class StatementError(ValueError):
+    pass
+
+
+def _normalise(name):
+    return re.sub(r'[^a-z0-9]+', ' ', name.lower()).strip()
+
+
+def column_map(header):
+    """Column name -> index in the header row; amount and date are required."""
+    normalised = [_normalise(name) for name in header]
+    found = {}
+    for column, names in COLUMNS.items():
+        for index, name in enumerate(normalised):
+            if name in names:
+                found[column] = index
+                break
+    missing = {'amount', 'date'} - set(found)
+    if missing:
+        raise StatementError(f"Statement has no {' or '.join(sorted(missing))} column.")
+    return found
+
+
+def to_paise(value):
+    """Amount as an integer number of paise, or None if it is not a positive amount."""
+    if value is None:
+        return None
+    text = re.sub(r'(?i)inr|rs\.?|cr$|[₹,\s]', '', str(value))
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        return None
+    return int((amount * 100).to_integral_value()) if amount > 0 else None
+
+
+def parse_date(value):
+    value = value.strip()
+    for candidate in (value, value.split(' ')[0]):
+        for fmt in DATE_FORMATS:
+            try:
+                return datetime.strptime(candidate, fmt).date()
+            except ValueError:
+                continue
+    return None
+
+
+def read_statement(rows):
+    """Yields (line number, reference, amount in paise, date) for each row after the header."""
+    reader = csv.reader(rows)
+    try:
+        header = next(reader)
+    except StopIteration:
+        raise StatementError("Statement is empty.")
+    columns = column_map(header)
+    reference_index = columns.get('reference')
+    for line, row in enumerate(reader, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        cell = lambda name: row[columns[name]] if columns[name] < len(row) else ''
+        reference = ''
+        if reference_index is not None and reference_index < len(row):
+            reference = row[reference_index].strip()
+        yield line, reference, to_paise(cell('amount')), parse_date(cell('date'))
+
+
+class UnpaidPool:
+    """Unpaid subscriptions by plan price, sorted by start_date, for amount and date matching."""
+
+    def __init__(self):
+        self.by_amount = defaultdict(list)
+        self.payment_ids = {}
+        cursor = Subscription._get_collection().find(
+            {'payment_status': {'$in': UNPAID}}, {'plan.price': 1, 'start_date': 1, 'payment_id': 1},
+        )
+        for doc in cursor:
+            price = to_paise((doc.get('plan') or {}).get('price'))
+            if price is None or doc.get('start_date') is None:
+                continue
+            self.by_amount[price].append((doc['start_date'].date(), doc['_id']))
+            self.payment_ids[doc['_id']] = doc.get('payment_id')
+        for entries in self.by_amount.values():
+            entries.sort()
+        self.starts = {amount: [start for start, _ in entries] for amount, entries in self.by_amount.items()}
+
+    def candidates(self, amount, paid_on, claimed):
+        entries = self.by_amount.get(amount)
+        if not entries:
+            return []
+        starts = self.starts[amount]
+        low = bisect_left(starts, paid_on - timedelta(days=MATCH_DAYS_AFTER_START))
+        high = bisect_right(starts, paid_on + timedelta(days=MATCH_DAYS_BEFORE_START))
+        return [subscription_id for _, subscription_id in entries[low:high] if subscription_id not in claimed]
+
+
+def _by_reference(references):
+    """payment_id -> [subscription docs] for the references of one chunk."""
+    found = defaultdict(list)
+    if references:
+        cursor = Subscription._get_collection().find(
+            {'payment_id': {'$in': list(references)}}, {'payment_id': 1, 'payment_status': 1, 'plan.price': 1},
+        )
+        for doc in cursor:
+            found[doc['payment_id']].append(doc)
+    return found
+
+
+def _paid_changes(paid_on, reference=None):
+    changes = {'payment_status': 'Paid', 'payment_date': datetime.combine(paid_on, datetime.min.time())}
+    if reference:
+        changes['payment_id'] = reference
+    return changes
+
+
+def apply_updates(updates):
+    """
+    Marks the subscriptions in `updates` (id -> changes) paid, unless they
+    already are, and appends an update event for each one written. Returns
+    the number written.
+    """
+    collection = Subscription._get_collection()
+    with transaction() as session:
+        docs = list(collection.find(
+            {'_id': {'$in': list(updates)}, 'payment_status': {'$ne': 'Paid'}},
+            dict.fromkeys(Subscription.event_fields, 1), session=session,
+        ))
+        if not docs:
+            return 0
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne({'_id': doc['_id'], 'payment_status': {'$ne': 'Paid'}},
+                      {'$set': dict(updates[doc['_id']], updated_at=now)})
+            for doc in docs
+        ]
+        modified = collection.bulk_write(operations, ordered=False, session=session).modified_count
+        OutboxEvent._get_collection().insert_many([
+            {'collection': Subscription._get_collection_name(), 'op': 'update', 'doc_id': str(doc['_id']),
+             'changed': sorted(updates[doc['_id']]), 'ts': now,
+             'data': {field: doc.get(field) for field in Subscription.event_fields}}
+            for doc in docs
+        ], session=session)
+    return modified
+
+
+def reconcile(rows, apply=True, chunk_size=CHUNK_SIZE):
+    """
+    Matches statement `rows` (an iterable of CSV text lines) to subscriptions
+    and, with `apply`, marks the matches paid. Returns the summary and the
+    matched, ambiguous and unmatched lines.
+    """
+    result = {'matched': [], 'ambiguous': [], 'unmatched': []}
+    claimed, pool, updated = set(), None, 0
+    lines = read_statement(rows)
+
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            break
+        by_reference = _by_reference({reference for _, reference, _, _ in chunk if reference})
+        updates = {}
+        for line, reference, amount, paid_on in chunk:
+            entry = {
+                'line': line,
+                'reference': reference,
+                'amount': str(Decimal(amount) / 100) if amount else None,
+                'date': paid_on.isoformat() if paid_on else None,
+            }
+            if amount is None or paid_on is None:
+                result['unmatched'].append(dict(entry, reason='No credit amount or unreadable date.'))
+                continue
+
+            docs = by_reference.get(reference) if reference else None
+            if docs:
+                if len(docs) > 1:
+                    result['ambiguous'].append(dict(
+                        entry, reason='Several subscriptions have this payment id.', candidates=[d['_id'] for d in docs],
+                    ))
+                    continue
+                doc = docs[0]
+                if doc['_id'] in claimed:
+                    result['ambiguous'].append(dict(entry, reason='Subscription already matched by another line.',
+                                                    candidates=[doc['_id']]))
+                    continue
+                price = to_paise((doc.get('plan') or {}).get('price'))
+                if price is not None and price != amount:
+                    result['ambiguous'].append(dict(entry, reason='Amount differs from the plan price.',
+                                                    candidates=[doc['_id']]))
+                    continue
+                claimed.add(doc['_id'])
+                already_paid = doc.get('payment_status') == 'Paid'
+                if not already_paid:
+                    updates[doc['_id']] = _paid_changes(paid_on)
+                result['matched'].append(dict(entry, subscription=doc['_id'], method='reference',
+                                              already_paid=already_paid))
+                continue
+
+            if pool is None:
+                pool = UnpaidPool()
+            candidates = pool.candidates(amount, paid_on, claimed)
+            if len(candidates) == 1:
+                subscription_id = candidates[0]
+                claimed.add(subscription_id)
+                fill_reference = reference if reference and not pool.payment_ids.get(subscription_id) else None
+                updates[subscription_id] = _paid_changes(paid_on, fill_reference)
+                result['matched'].append(dict(entry, subscription=subscription_id, method='amount_date',
+                                              already_paid=False))
+            elif candidates:
+                result['ambiguous'].append(dict(entry, reason='Several unpaid subscriptions match amount and date.',
+                                                candidates=candidates))
+            else:
+                result['unmatched'].append(dict(entry, reason='No subscription matches.'))
+
+        if apply and updates:
+            updated += apply_updates(updates)
+
+    result['summary'] = {
+        'lines': sum(len(result[key]) for key in ('matched', 'ambiguous', 'unmatched')),
+        'matched': len(result['matched']),
+        'ambiguous': len(result['ambiguous']),
+        'unmatched': len(result['unmatched']),
+        'updated': updated,
+        'applied': apply,
+    }
+    return result
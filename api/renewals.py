@@ -0,0 +1,218 @@
+"""
+Renewal reminder pipeline.
+
+One aggregation per expiry window:
+1. selects subscriptions by end_date range, which the subscription_end_date
+   index serves;
+2. drops subscribers who already hold a later subscription;
+3. drops notices that were already sent;
+4. joins subscriber contact data; the plan name comes from the
+   subscription's plan snapshot.
+
+Results stream in batches to a pluggable sender. Each notice is recorded in
+RenewalNotice only after its batch is sent, so reruns pick up where the last
+run stopped. The order (send, then record) makes delivery at-least-once.
+"""
+import abc
+import csv
+import io
+import os
+import uuid
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from fpdf import FPDF
+from pymongo.errors import BulkWriteError
+
+from .models import MagazineSubscriber, RenewalNotice, Subscription
+
+# Notice tiers: subscriptions ending within 30 days, 31-60 days and 61-90 days
+DEFAULT_WINDOWS = (30, 60, 90)
+
+
+def window_bounds(window_days, as_of, windows=DEFAULT_WINDOWS):
+    """Returns the [start, end) end_date range of a tier, e.g. (as_of+31, as_of+61) for 60."""
+    previous = max([w for w in windows if w < window_days], default=0)
+    start = datetime.combine(as_of + timedelta(days=previous + 1), datetime.min.time())
+    end = datetime.combine(as_of + timedelta(days=window_days + 1), datetime.min.time())
+    return start, end
+
+
+def candidates_pipeline(window_days, as_of, windows=DEFAULT_WINDOWS):
+    start, end = window_bounds(window_days, as_of, windows)
+    subscriptions = Subscription._get_collection_name()
+    return [
+        {'$match': {'end_date': {'$gte': start, '$lt': end}}},
+        # A subscriber who already renewed has a subscription ending later
+        {'$lookup': {
+            'from': subscriptions,
+            'let': {'subscriber': '$subscriber', 'end_date': '$end_date'},
+            'pipeline': [
+                {'$match': {'$expr': {'$and': [
+                    {'$eq': ['$subscriber', '$$subscriber']},
+                    {'$gt': ['$end_date', '$$end_date']},
+                ]}}},
+                {'$limit': 1},
+                {'$project': {'_id': 1}},
+            ],
+            'as': 'later',
+        }},
+        {'$match': {'later': {'$size': 0}}},
+        {'$lookup': {
+            'from': RenewalNotice._get_collection_name(),
+            'let': {'notice_id': {'$concat': ['$_id', f':{window_days}']}},
+            'pipeline': [{'$match': {'$expr': {'$eq': ['$_id', '$$notice_id']}}}, {'$project': {'_id': 1}}],
+            'as': 'sent',
+        }},
+        {'$match': {'sent': {'$size': 0}}},
+        {'$lookup': {
+            'from': MagazineSubscriber._get_collection_name(),
+            'localField': 'subscriber',
+            'foreignField': '_id',
+            'as': 'subscriber_doc',
+        }},
+        {'$unwind': '$subscriber_doc'},
+        {'$match': {'subscriber_doc.isDeleted': {'$ne': True}}},
+        {'$project': {
+            '_id': 0,
+            'subscription': '$_id',
+            'end_date': 1,
+            'subscriber': '$subscriber_doc._id',
+            'name': '$subscriber_doc.name',
+            'address': '$subscriber_doc.address',
+            'city_town': '$subscriber_doc.city_town',
+            'district': '$subscriber_doc.district',
+            'state': '$subscriber_doc.state',
+            'pincode': '$subscriber_doc.pincode',
+            'phone': '$subscriber_doc.phone',
+            'email': '$subscriber_doc.email',
+            'plan_name': '$plan.name',
+        }},
+        {'$sort': {'end_date': 1, 'subscription': 1}},
+    ]
+
+
+def renewal_candidates(window_days, as_of=None, windows=DEFAULT_WINDOWS, batch_size=500):
+    as_of = as_of or date.today()
+    pipeline = candidates_pipeline(window_days, as_of, windows)
+    return Subscription._get_collection().aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+
+
+def render_letters(notices, window_days):
+    pdf = FPDF(orientation='P', unit='mm', format='A4')
+    pdf.set_auto_page_break(auto=True, margin=20)
+
+    def text(value):
+        # FPDF core fonts are latin-1 only
+        return str(value or '').encode('latin-1', 'replace').decode('latin-1')
+
+    for notice in notices:
+        pdf.add_page()
+        pdf.set_font("Arial", size=11)
+        for line in (
+            notice['name'],
+            notice['address'],
+            f"{notice.get('city_town') or ''}, {notice.get('district') or ''}".strip(', '),
+            f"{notice.get('state') or ''} - {notice.get('pincode') or ''}",
+        ):
+            pdf.multi_cell(0, 6, text(line))
+        pdf.ln(10)
+        pdf.set_font("Arial", size=12, style='B')
+        pdf.cell(0, 8, "Subscription renewal reminder", ln=True)
+        pdf.set_font("Arial", size=11)
+        pdf.ln(4)
+        end_date = notice['end_date']
+        pdf.multi_cell(0, 6, text(
+            f"Dear {notice['name']},\n\n"
+            f"Your subscription ({notice.get('plan_name') or 'current plan'}) ends on "
+            f"{end_date:%d %B %Y}, within the next {window_days} days. "
+            "Please renew to continue receiving the magazine without interruption.\n\n"
+            f"Subscription reference: {notice['subscription']}"
+        ))
+    return pdf.output(dest='S').encode('latin1')
+
+
+def render_contacts_csv(notices):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['subscriber', 'subscription', 'name', 'phone', 'email', 'end_date', 'plan'])
+    for notice in notices:
+        writer.writerow([
+            notice['subscriber'], notice['subscription'], notice['name'], notice.get('phone') or '',
+            notice.get('email') or '', f"{notice['end_date']:%Y-%m-%d}", notice.get('plan_name') or '',
+        ])
+    return buffer.getvalue()
+
+
+class NoticeSender(abc.ABC):
+    """Delivers one batch of renewal notices. Subclass and point RENEWAL_NOTICE_SENDER at it."""
+
+    @abc.abstractmethod
+    def send_batch(self, batch_id, window_days, notices, letters_pdf, contacts_csv):
+        """Delivers `notices` with their letters (PDF bytes) and contact list (CSV text); raises on failure."""
+
+
+class FileNoticeSender(NoticeSender):
+    """Local stand-in that writes each batch's letters and contact list to a directory."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or getattr(settings, 'RENEWAL_NOTICE_OUTPUT_DIR', 'renewal_notices')
+
+    def send_batch(self, batch_id, window_days, notices, letters_pdf, contacts_csv):
+        os.makedirs(self.directory, exist_ok=True)
+        prefix = os.path.join(self.directory, f"{batch_id}-{window_days}d")
+        with open(f"{prefix}-letters.pdf", 'wb') as handle:
+            handle.write(letters_pdf)
+        with open(f"{prefix}-contacts.csv", 'w', newline='') as handle:
+            handle.write(contacts_csv)
+
+
+def get_sender():
+    sender_path = getattr(settings, 'RENEWAL_NOTICE_SENDER', 'api.renewals.FileNoticeSender')
+    return import_string(sender_path)()
+
+
+def record_sent(batch_id, window_days, notices):
+    documents = [{
+        '_id': RenewalNotice.make_id(notice['subscription'], window_days),
+        'subscription': notice['subscription'],
+        'subscriber': notice['subscriber'],
+        'window_days': window_days,
+        'end_date': notice['end_date'],
+        'batch_id': batch_id,
+        'sent_at': datetime.utcnow(),
+    } for notice in notices]
+    try:
+        RenewalNotice._get_collection().insert_many(documents, ordered=False)
+    except BulkWriteError as exc:
+        # Duplicate keys mean a concurrent run already recorded them
+        if any(error['code'] != 11000 for error in exc.details.get('writeErrors', [])):
+            raise
+
+
+def run_renewal_notices(windows=DEFAULT_WINDOWS, as_of=None, batch_size=500, sender=None, dry_run=False):
+    """Sends every pending notice and returns {window_days: notices sent}."""
+    as_of = as_of or date.today()
+    sender = sender or get_sender()
+    windows = tuple(sorted(windows))
+    sent = {}
+    for window_days in windows:
+        sent[window_days] = 0
+        batch = []
+        for notice in renewal_candidates(window_days, as_of, windows, batch_size):
+            batch.append(notice)
+            if len(batch) >= batch_size:
+                sent[window_days] += _flush(batch, window_days, sender, dry_run)
+                batch = []
+        if batch:
+            sent[window_days] += _flush(batch, window_days, sender, dry_run)
+    return sent
+
+
+def _flush(notices, window_days, sender, dry_run):
+    if not dry_run:
+        batch_id = f"{date.today():%Y%m%d}-{uuid.uuid4().hex[:8]}"
+        sender.send_batch(batch_id, window_days, notices, render_letters(notices, window_days), render_contacts_csv(notices))
+        record_sent(batch_id, window_days, notices)
+    return len(notices)
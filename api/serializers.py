@@ -1,35 +1,86 @@
-from rest_framework_mongoengine.serializers import DocumentSerializer
+from rest_framework_mongoengine.serializers import DocumentSerializer, EmbeddedDocumentSerializer
 from rest_framework import serializers
-from .models import MagazineSubscriber, Subscription, SubscriptionPlan, SubscriberCategory, SubscriberType, SubscriptionLanguage, SubscriptionMode, PaymentMode, AdminUser
+from rest_framework.relations import PKOnlyObject
+from .models import MagazineSubscriber, PlanSnapshot, Subscription, SubscriptionPlan, SubscriberCategory, SubscriberType, SubscriptionLanguage, SubscriptionMode, PaymentMode, AdminUser
 from datetime import date, datetime
+from django.conf import settings
 
 import re
 
-class SubscriberCategorySerializer(DocumentSerializer):
+from .archive import subscription_history
+from .pincodes import directory_available, lookup_pincode
+
+
+def parse_fields(value):
+    """The `?fields=` value as a set of field names, or None when not given."""
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    Takes an optional `fields` argument (field names, dotted for nested
+    serializers) and drops every other field. The part after the dot is kept
+    in `nested_fields` for fields that serialize related documents.
+    """
+    def __init__(self, *args, **kwargs):
+        selected = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        self.nested_fields = {}
+        if selected is None:
+            return
+        top = {}
+        for name in selected:
+            head, _, rest = name.partition('.')
+            top.setdefault(head, set())
+            if rest:
+                top[head].add(rest)
+        unknown = set(top) - set(self.fields)
+        if unknown:
+            raise serializers.ValidationError({'fields': f"Unknown field(s): {', '.join(sorted(unknown))}."})
+        for name in set(self.fields) - set(top):
+            self.fields.pop(name)
+        self.nested_fields = {name: rest for name, rest in top.items() if rest}
+
+class ReferenceIdField(serializers.PrimaryKeyRelatedField):
+    """
+    Reads like a primary key field without dereferencing the document (one
+    query per row otherwise); writes look the document up as usual.
+    """
+    def get_attribute(self, instance):
+        value = instance._data.get(self.source)
+        if value is None:
+            return None
+        # A DBRef until something dereferences it, then the document
+        return PKOnlyObject(pk=getattr(value, 'pk', None) or value.id)
+
+
+class SubscriberCategorySerializer(SparseFieldsMixin, DocumentSerializer):
     _id = serializers.CharField(read_only=True)
     class Meta:
         model = SubscriberCategory
         fields = ('_id', 'name')
 
-class SubscriberTypeSerializer(DocumentSerializer):
+class SubscriberTypeSerializer(SparseFieldsMixin, DocumentSerializer):
     _id = serializers.CharField(read_only=True)
     class Meta:
         model = SubscriberType
         fields = ('_id', 'name')
 
-class SubscriptionLanguageSerializer(DocumentSerializer):
+class SubscriptionLanguageSerializer(SparseFieldsMixin, DocumentSerializer):
     _id = serializers.CharField(read_only=True)
     class Meta:
         model = SubscriptionLanguage
         fields = ('_id', 'name')
 
-class SubscriptionModeSerializer(DocumentSerializer):
+class SubscriptionModeSerializer(SparseFieldsMixin, DocumentSerializer):
     _id = serializers.CharField(read_only=True)
     class Meta:
         model = SubscriptionMode
         fields = ('_id', 'name')
 
-class SubscriptionPlanSerializer(DocumentSerializer):
+class SubscriptionPlanSerializer(SparseFieldsMixin, DocumentSerializer):
     _id = serializers.CharField(read_only=True)
     subscription_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=True)
     duration_in_months = serializers.IntegerField(required=True, min_value=1)
@@ -57,7 +108,7 @@ class SubscriptionPlanSerializer(DocumentSerializer):
         return data
 
 
-class PaymentModeSerializer(DocumentSerializer):
+class PaymentModeSerializer(SparseFieldsMixin, DocumentSerializer):
     _id = serializers.CharField(read_only=True)
     class Meta:
         model = PaymentMode
@@ -73,11 +124,22 @@ from rest_framework import serializers
 from datetime import date, datetime
 from .models import Subscription, SubscriptionPlan, PaymentMode
 
-class SubscriptionSerializer(DocumentSerializer):
+class PlanSnapshotSerializer(EmbeddedDocumentSerializer):
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        model = PlanSnapshot
+        fields = ('name', 'version', 'price', 'duration_in_months', 'language', 'mode')
+
+class SubscriptionSerializer(SparseFieldsMixin, DocumentSerializer):
     _id = serializers.CharField(read_only=True)
-    subscription_plan = serializers.PrimaryKeyRelatedField(queryset=SubscriptionPlan.objects.all())
-    payment_mode = serializers.PrimaryKeyRelatedField(queryset=PaymentMode.objects.all())
+    subscriber = ReferenceIdField(queryset=MagazineSubscriber.objects.all(), required=False, allow_null=True)
+    subscription_plan = ReferenceIdField(queryset=SubscriptionPlan.objects.all())
+    # Taken from subscription_plan on save
+    plan = PlanSnapshotSerializer(read_only=True)
+    payment_mode = ReferenceIdField(queryset=PaymentMode.objects.all())
     payment_id = serializers.CharField(required=True)
+    updated_at = serializers.DateTimeField(read_only=True)
 
     class Meta:
         model = Subscription
@@ -163,15 +225,18 @@ class SubscriptionSerializer(DocumentSerializer):
 
         return data
 
-class MagazineSubscriberSerializer(DocumentSerializer):
+class MagazineSubscriberSerializer(SparseFieldsMixin, DocumentSerializer):
     _id = serializers.CharField(read_only=True)
     created_at = serializers.DateTimeField(read_only=True)
-    category = serializers.PrimaryKeyRelatedField(queryset=SubscriberCategory.objects.all(), required=True)
-    stype = serializers.PrimaryKeyRelatedField(queryset=SubscriberType.objects.all(), required=True)
+    updated_at = serializers.DateTimeField(read_only=True)
+    category = ReferenceIdField(queryset=SubscriberCategory.objects.all(), required=True)
+    stype = ReferenceIdField(queryset=SubscriberType.objects.all(), required=True)
     email = serializers.EmailField(required=False, allow_blank=True, allow_null=True)
     address = serializers.CharField(required=True)
-    city_town = serializers.CharField(required=True)
-    state = serializers.CharField(required=True)
+    # city_town, district and state are filled from the pincode directory when omitted
+    city_town = serializers.CharField(required=False)
+    district = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    state = serializers.CharField(required=False)
     pincode = serializers.CharField(required=True)
     phone = serializers.CharField(required=True)
     notes = serializers.CharField(required=False, allow_blank=True, allow_null=True)
@@ -180,14 +245,22 @@ class MagazineSubscriberSerializer(DocumentSerializer):
     subscriptions = serializers.SerializerMethodField()
 
     def __init__(self, *args, **kwargs):
-        include_subscriptions = kwargs.pop('include_subscriptions', False)
+        # Set before SparseFieldsMixin checks `fields`, so `subscriptions.*` is unknown where it is not rendered
+        self.include_subscriptions = kwargs.pop('include_subscriptions', False)
         super().__init__(*args, **kwargs)
-        if not include_subscriptions:
-            self.fields.pop('subscriptions', None)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.include_subscriptions:
+            fields.pop('subscriptions', None)
+        return fields
 
     def get_subscriptions(self, obj):
-        subscriptions = Subscription.objects.filter(subscriber=obj).order_by('-start_date')
-        return SubscriptionSerializer(subscriptions, many=True).data
+        # Includes subscriptions moved to the archive tier
+        nested = self.nested_fields.get('subscriptions')
+        model_fields = [name for name in nested if name in Subscription._fields] if nested else None
+        subscriptions = subscription_history(obj.pk, fields=model_fields)
+        return SubscriptionSerializer(subscriptions, many=True, fields=nested).data
 
     def validate_name(self, value):
         if not value.strip():
@@ -212,6 +285,11 @@ class MagazineSubscriberSerializer(DocumentSerializer):
             raise serializers.ValidationError("State can only contain letters, spaces, and hyphens.")
         return value.strip()
 
+    def validate_district(self, value):
+        if value and not re.fullmatch(r"[A-Za-z\s\-\.]+", value):
+            raise serializers.ValidationError("District can only contain letters, spaces, periods, and hyphens.")
+        return value.strip() if value else value
+
     def validate_city_town(self, value):
         if not re.fullmatch(r"[A-Za-z\s\-]+", value):
             raise serializers.ValidationError("City/Town can only contain letters, spaces, and hyphens.")
@@ -225,8 +303,10 @@ class MagazineSubscriberSerializer(DocumentSerializer):
         return value.strip()
 
     def validate_pincode(self, value):
-        if not re.fullmatch(r"\d{6}", value):
-            raise serializers.ValidationError("Pincode must be exactly 6 digits.")
+        if not re.fullmatch(r"[1-9]\d{5}", value):
+            raise serializers.ValidationError("Pincode must be exactly 6 digits and cannot start with 0.")
+        if settings.PINCODE_VALIDATION_STRICT and directory_available() and lookup_pincode(value) is None:
+            raise serializers.ValidationError("Unknown pincode.")
         return value
 
     def validate_phone(self, value):
@@ -244,18 +324,37 @@ class MagazineSubscriberSerializer(DocumentSerializer):
             return value
         return value.lower()
 
+    def validate(self, data):
+        # Fill city/district/state from the pincode directory where not given
+        entry = lookup_pincode(data['pincode']) if data.get('pincode') else None
+        if entry:
+            for field in ('city_town', 'district', 'state'):
+                if not data.get(field) and getattr(entry, field):
+                    data[field] = getattr(entry, field)
+            state = data.get('state')
+            if settings.PINCODE_VALIDATION_STRICT and state and entry.state and state.lower() != entry.state.lower():
+                raise serializers.ValidationError({"state": f"Pincode {entry.pincode} is in {entry.state}."})
+
+        if not self.partial:
+            missing = {
+                field: "This field is required." for field in ('city_town', 'state') if not data.get(field)
+            }
+            if missing:
+                raise serializers.ValidationError(missing)
+        return data
+
     # No extra DB queries here, rely on PrimaryKeyRelatedField's built-in validation.
 
     class Meta:
         model = MagazineSubscriber
         fields = [
             '_id', 'name', 'registration_number', 'address', 'city_town',
-            'state', 'pincode', 'phone', 'email', 'category', 'stype',
+            'district', 'state', 'pincode', 'phone', 'email', 'category', 'stype',
             'notes', 'hasActiveSubscriptions', 'isDeleted', 'subscriptions',
-            'created_at'
+            'created_at', 'updated_at'
         ]
 
-class AdminUserSerializer(DocumentSerializer):
+class AdminUserSerializer(SparseFieldsMixin, DocumentSerializer):
     class Meta:
         model = AdminUser
         fields = [
@@ -0,0 +1,235 @@
+"""
+Slow MongoDB command log.
+
+`SlowQueryListener` watches every command and, when one runs longer than the
+threshold configured for its collection, hands it to a background thread. That
+thread runs `explain` for the command and stores the result in a capped
+collection. Nothing beyond a dict lookup and a queue put happens on the
+request path.
+"""
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from mongoengine.connection import get_db
+from pymongo import monitoring
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+from .instrumentation import current_stats
+from .metrics import JOB_QUEUE_DEPTH, JOBS_DROPPED
+
+logger = logging.getLogger(__name__)
+
+# Commands we keep around until they finish, because they can be explained
+EXPLAINABLE_COMMANDS = {'find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify'}
+
+# Session and transaction fields that `explain` refuses
+NON_EXPLAINABLE_FIELDS = {'lsid', 'txnNumber', 'autocommit', 'startTransaction', 'writeConcern', 'readConcern'}
+
+
+def slow_query_settings():
+    return {
+        'enabled': getattr(settings, 'SLOW_QUERY_LOG_ENABLED', True),
+        'thresholds': getattr(settings, 'SLOW_QUERY_THRESHOLDS_MS', {'default': 200}),
+        'collection': getattr(settings, 'SLOW_QUERY_COLLECTION', 'slow_queries'),
+        'size_bytes': getattr(settings, 'SLOW_QUERY_LOG_SIZE_BYTES', 16 * 1024 * 1024),
+        'queue_size': getattr(settings, 'SLOW_QUERY_QUEUE_SIZE', 1000),
+    }
+
+
+def query_shape(value):
+    """Replaces literal values with their type so queries group by shape."""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [query_shape(value[0])] if value else []
+    if hasattr(value, 'pattern'):
+        return '<regex>'
+    return f"<{type(value).__name__}>"
+
+
+def command_filter(command_name, command):
+    """Extracts the (filter, sort) pair from a command document."""
+    if command_name == 'find':
+        return command.get('filter', {}), command.get('sort')
+    if command_name in ('count', 'distinct', 'findAndModify'):
+        return command.get('query', {}), command.get('sort')
+    if command_name == 'aggregate':
+        pipeline = command.get('pipeline') or []
+        match = pipeline[0].get('$match', {}) if pipeline else {}
+        sort = next((stage['$sort'] for stage in pipeline if '$sort' in stage), None)
+        return match, sort
+    if command_name == 'update':
+        updates = command.get('updates') or [{}]
+        return updates[0].get('q', {}), None
+    if command_name == 'delete':
+        deletes = command.get('deletes') or [{}]
+        return deletes[0].get('q', {}), None
+    return {}, None
+
+
+def summarize_plan(plan):
+    """Flattens a winning plan into its stage names and the indexes it uses."""
+    stages, indexes = [], []
+    pending = [plan or {}]
+    while pending:
+        node = pending.pop()
+        if 'stage' in node:
+            stages.append(node['stage'])
+        if node.get('indexName'):
+            indexes.append(node['indexName'])
+        if 'inputStage' in node:
+            pending.append(node['inputStage'])
+        pending.extend(node.get('inputStages', []))
+        if 'queryPlan' in node:
+            pending.append(node['queryPlan'])
+    return {'stages': stages, 'indexes': indexes, 'collection_scan': 'COLLSCAN' in stages}
+
+
+def winning_plan(explain_result):
+    planner = explain_result.get('queryPlanner')
+    if planner is None:
+        # Aggregations nest the planner output under their first stage
+        for stage in explain_result.get('stages', []):
+            if '$cursor' in stage:
+                planner = stage['$cursor'].get('queryPlanner')
+                break
+    return (planner or {}).get('winningPlan', {})
+
+
+class SlowQueryRecorder:
+    """Background thread that explains slow commands and stores them."""
+
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._collection_ready = False
+        self.dropped = 0
+
+    @property
+    def thread(self):
+        return self._thread
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, entry):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(entry)
+            JOB_QUEUE_DEPTH.labels('slow_query_explain').inc()
+        except queue.Full:
+            self.dropped += 1
+            JOBS_DROPPED.labels('slow_query_explain').inc()
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so every worker process starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            config = slow_query_settings()
+            self._queue = queue.Queue(maxsize=config['queue_size'])
+            self._thread = threading.Thread(target=self._run, name='slow-query-recorder', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            try:
+                self.record(entry)
+            except Exception:
+                logger.exception("Failed to record slow query")
+            finally:
+                JOB_QUEUE_DEPTH.labels('slow_query_explain').dec()
+                self._queue.task_done()
+
+    def record(self, entry):
+        config = slow_query_settings()
+        db = get_db()
+        command = entry.pop('_command')
+        try:
+            explain_result = db.command('explain', command, verbosity='queryPlanner')
+            plan = winning_plan(explain_result)
+            entry['explain'] = {'plan': summarize_plan(plan), 'winning_plan': plan}
+        except PyMongoError as exc:
+            entry['explain'] = {'error': str(exc)}
+        self._log_collection(db, config).insert_one(entry)
+
+    def _log_collection(self, db, config):
+        name = config['collection']
+        if not self._collection_ready:
+            try:
+                db.create_collection(name, capped=True, size=config['size_bytes'])
+            except CollectionInvalid:
+                pass  # created by another worker
+            self._collection_ready = True
+        return db[name]
+
+
+recorder = SlowQueryRecorder()
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    def __init__(self):
+        self._inflight = {}
+
+    def started(self, event):
+        if event.command_name in EXPLAINABLE_COMMANDS:
+            self._inflight[(event.connection_id, event.request_id)] = event.command
+
+    def succeeded(self, event):
+        command = self._inflight.pop((event.connection_id, event.request_id), None)
+        if command is None or threading.current_thread() is recorder.thread:
+            return
+        config = slow_query_settings()
+        if not config['enabled']:
+            return
+        collection = command.get(event.command_name)
+        if not isinstance(collection, str) or collection == config['collection']:
+            return
+
+        duration_ms = event.duration_micros / 1000.0
+        thresholds = config['thresholds']
+        threshold = thresholds.get(collection, thresholds.get('default', 200))
+        if duration_ms < threshold:
+            return
+
+        query, sort = command_filter(event.command_name, command)
+        stats = current_stats()
+        recorder.submit({
+            'recorded_at': datetime.utcnow(),
+            'database': event.database_name,
+            'collection': collection,
+            'command': event.command_name,
+            'duration_ms': round(duration_ms, 3),
+            'threshold_ms': threshold,
+            'filter_shape': query_shape(query),
+            'sort': sort,
+            'view': stats.view if stats else None,
+            'action': stats.action if stats else None,
+            '_command': {
+                key: value for key, value in command.items()
+                if not key.startswith('$') and key not in NON_EXPLAINABLE_FIELDS
+            },
+        })
+
+    def failed(self, event):
+        self._inflight.pop((event.connection_id, event.request_id), None)
+
+
+slow_query_listener = SlowQueryListener()
+
+
+def recent_slow_queries(collection=None, limit=100):
+    config = slow_query_settings()
+    query = {'collection': collection} if collection else {}
+    cursor = get_db()[config['collection']].find(query, {'explain.winning_plan': 0}).sort('$natural', -1).limit(limit)
+    return list(cursor)
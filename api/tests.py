@@ -1,3 +1,417 @@
-from django.test import TestCase
+import os
+import time
+import unittest
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from urllib.parse import parse_qs, urlparse
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import mongoengine
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import resolve
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from magazine.mongo import event_listeners, reconnect
+
+from .instrumentation import assert_max_queries
+from .middleware import LongRunningRouteMiddleware
+from .models import AdminUser, MagazineSubscriber, OutboxEvent, SubscriberCategory, SubscriberType, Subscription
+from .reconciliation import StatementError, UnpaidPool, column_map, parse_date, reconcile, to_paise
+from .sync import SyncExpired, decode_cursor, encode_cursor, format_watermark, parse_watermark, window_for
+from .views import MagazineSubscriberViewSet, SubscriptionViewSet, SyncViewSet
+
+# A scratch database the MongoDB tests fill and drop, e.g. mongodb://localhost:27017/magazine_test
+TEST_MONGO = os.getenv('MONGO_TEST_CONNECTION_STRING')
+
+
+class UrlConfTests(SimpleTestCase):
+    def test_api_urls_import_and_resolve(self):
+        import api.urls  # noqa: F401
+        match = resolve('/api/subscriptions/')
+        self.assertIs(match.func.cls, SubscriptionViewSet)
+        self.assertEqual(match.func.actions, {'get': 'list', 'post': 'create'})
+
+
+
+class LongRunningRouteTests(SimpleTestCase):
+    def call(self, path):
+        middleware = LongRunningRouteMiddleware(lambda request: HttpResponse('served'))
+        return middleware(RequestFactory().get(path))
+
+    @override_settings(SERVER_ROLE='api', REPORTS_BASE_URL='https://reports.example.in')
+    def test_api_role_redirects_report_routes(self):
+        response = self.call('/api/subscribers/generate_pdf_report/?template=a4-landscape-5col')
+        self.assertEqual(response.status_code, 307)
+        self.assertEqual(
+            response['Location'], 'https://reports.example.in/api/subscribers/generate_pdf_report/?template=a4-landscape-5col',
+        )
+        self.assertEqual(self.call('/api/subscribers/').content, b'served')
+
+    @override_settings(SERVER_ROLE='api', REPORTS_BASE_URL='')
+    def test_api_role_refuses_report_routes_without_a_reports_pool(self):
+        self.assertEqual(self.call('/api/subscribers/report/').status_code, 421)
+
+    @override_settings(SERVER_ROLE='web', REPORTS_BASE_URL='')
+    def test_other_roles_serve_report_routes(self):
+        self.assertEqual(self.call('/api/subscribers/report/').content, b'served')
+
+
+@unittest.skipUnless(TEST_MONGO, "Set MONGO_TEST_CONNECTION_STRING to a scratch database.")
+@override_settings(MONGO_TRANSACTIONS=False)
+class MongoTestCase(SimpleTestCase):
+    """Runs against TEST_MONGO instead of the configured database, which is dropped afterwards."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        mongoengine.disconnect_all()
+        cls.db = mongoengine.connect(host=TEST_MONGO, event_listeners=event_listeners()).get_default_database()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db.client.drop_database(cls.db.name)
+        reconnect()
+        super().tearDownClass()
+
+
+def create_subscribers(count):
+    """`count` subscribers spread over three categories and three types; returns them."""
+    categories = [SubscriberCategory(name=f"Category {n}").save() for n in range(3)]
+    types = [SubscriberType(name=f"Type {n}").save() for n in range(3)]
+    return [
+        MagazineSubscriber(
+            name=f"Subscriber {n}", registration_number=f"TC/{n}", email=f"subscriber.{n}@example.in",
+            address=f"{n}, Temple Street", city_town="Udupi", state="Karnataka", pincode="576101",
+            phone=f"{9000000000 + n}", category=categories[n % 3], stype=types[n % 3],
+        ).save()
+        for n in range(count)
+    ]
+
+
+class ReportQueryBudgetTests(MongoTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        create_subscribers(30)
+
+    def get_report(self, **params):
+        request = APIRequestFactory().get('/api/subscribers/report/', params)
+        return MagazineSubscriberViewSet.as_view({'get': 'report'})(request)
+
+    def test_report_names_are_resolved_in_bulk(self):
+        with assert_max_queries(MagazineSubscriberViewSet.query_budgets['report']):
+            response = self.get_report()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 30)
+        self.assertEqual({row['Category'] for row in response.data}, {f"Category {n}" for n in range(3)})
+        self.assertEqual({row['Type'] for row in response.data}, {f"Type {n}" for n in range(3)})
+
+    def test_report_with_filters_stays_within_budget(self):
+        with assert_max_queries(MagazineSubscriberViewSet.query_budgets['report']):
+            response = self.get_report(subscriberCategory="Category 1", subscriberType="Type 1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 10)
+
+
+
+class SubscriberQueryBudgetTests(MongoTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.subscribers = create_subscribers(30)
+
+    def test_list_stays_within_budget(self):
+        request = APIRequestFactory().get('/api/subscribers/', {'page_renewal': 1})
+        with assert_max_queries(MagazineSubscriberViewSet.query_budgets['list']):
+            response = MagazineSubscriberViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(response.status_code, 200)
+        results = response.data['renewal']['results']
+        self.assertEqual(len(results), 20)
+        categories = {subscriber.pk: subscriber.category.pk for subscriber in self.subscribers}
+        self.assertTrue(all(row['category'] == categories[row['_id']] for row in results))
+
+    def test_inactive_list_stays_within_budget(self):
+        request = APIRequestFactory().get('/api/subscribers/', {'page_inactive': 1})
+        with assert_max_queries(MagazineSubscriberViewSet.query_budgets['list']):
+            response = MagazineSubscriberViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(response.status_code, 200)
+
+    def test_retrieve_stays_within_budget(self):
+        subscriber = self.subscribers[0]
+        request = APIRequestFactory().get(f'/api/subscribers/{subscriber.pk}/')
+        with assert_max_queries(MagazineSubscriberViewSet.query_budgets['retrieve']):
+            response = MagazineSubscriberViewSet.as_view({'get': 'retrieve'})(request, _id=subscriber.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['category'], subscriber.category.pk)
+        self.assertEqual(response.data['subscriptions'], [])
+
+
+class DuplicatesEndpointTests(SimpleTestCase):
+    @override_settings(THROTTLE_ENABLED=False)
+    def test_non_integer_paging_is_rejected(self):
+        view = MagazineSubscriberViewSet.as_view({'get': 'duplicates'})
+        for params in ({'page': 'two'}, {'page_size': '20abc'}):
+            response = view(APIRequestFactory().get('/api/subscribers/duplicates/', params))
+            self.assertEqual(response.status_code, 400, params)
+
+
+@override_settings(THROTTLE_ENABLED=False)
+class MergeSubscribersTests(MongoTestCase):
+    def setUp(self):
+        self.db.client.drop_database(self.db.name)
+        self.survivor, self.duplicate = create_subscribers(2)
+        running = datetime.utcnow() + timedelta(days=90)
+        Subscription._get_collection().insert_many([
+            {'_id': f"SUB{n}", 'subscriber': self.duplicate.pk, 'start_date': datetime(2024, 1, 10), 'end_date': running}
+            for n in range(2)
+        ])
+
+    def merge(self, duplicate_id):
+        request = APIRequestFactory().post(
+            f'/api/subscribers/{self.survivor.pk}/merge/', {'duplicate': duplicate_id}, format='json',
+        )
+        return MagazineSubscriberViewSet.as_view({'post': 'merge'})(request, _id=self.survivor.pk)
+
+    def test_merge_moves_subscriptions_and_retires_the_duplicate(self):
+        response = self.merge(self.duplicate.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['subscriptions_moved'], 2)
+        self.assertTrue(response.data['subscriber']['hasActiveSubscriptions'])
+
+        subscriptions = Subscription._get_collection()
+        self.assertEqual(subscriptions.count_documents({'subscriber': self.survivor.pk}), 2)
+        self.assertEqual(subscriptions.count_documents({'subscriber': self.duplicate.pk}), 0)
+
+        duplicate = MagazineSubscriber.objects.get(pk=self.duplicate.pk)
+        self.assertTrue(duplicate.isDeleted)
+        self.assertFalse(duplicate.hasActiveSubscriptions)
+        self.assertIn(f"Merged into {self.survivor.pk}", duplicate.notes)
+
+        events = OutboxEvent._get_collection()
+        retired = events.find_one(
+            {'collection': MagazineSubscriber._get_collection_name(), 'doc_id': self.duplicate.pk, 'op': 'update'},
+        )
+        self.assertIn('isDeleted', retired['changed'])
+        moved = events.find({'collection': Subscription._get_collection_name(), 'changed': ['subscriber']})
+        self.assertEqual(sorted(event['doc_id'] for event in moved), ['SUB0', 'SUB1'])
+
+    def test_a_retired_duplicate_is_not_merged_again(self):
+        self.assertEqual(self.merge(self.duplicate.pk).status_code, 200)
+        response = self.merge(self.duplicate.pk)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], "The duplicate is already inactive.")
+        self.assertEqual(Subscription._get_collection().count_documents({'subscriber': self.survivor.pk}), 2)
+
+
+def unpaid_pool(entries):
+    """An UnpaidPool over (amount in paise, start date, subscription id) entries, without MongoDB."""
+    pool = UnpaidPool.__new__(UnpaidPool)
+    pool.by_amount, pool.payment_ids = defaultdict(list), {}
+    for amount, start, subscription_id in entries:
+        pool.by_amount[amount].append((start, subscription_id))
+        pool.payment_ids[subscription_id] = None
+    for found in pool.by_amount.values():
+        found.sort()
+    pool.starts = {amount: [start for start, _ in found] for amount, found in pool.by_amount.items()}
+    return pool
+
+
+class StatementParsingTests(SimpleTestCase):
+    def test_column_map_matches_bank_header_names(self):
+        header = ['Txn Date', 'Description', 'Ref No.', 'Debit', 'Credit Amount']
+        self.assertEqual(column_map(header), {'date': 0, 'reference': 2, 'amount': 4})
+
+    def test_column_map_reference_is_optional(self):
+        self.assertEqual(column_map(['Value Date', 'Amount (INR)']), {'date': 0, 'amount': 1})
+
+    def test_column_map_requires_amount_and_date(self):
+        with self.assertRaisesMessage(StatementError, "no amount or date column"):
+            column_map(['Narration', 'UTR'])
+
+    def test_to_paise(self):
+        self.assertEqual(to_paise('1,200.50'), 120050)
+        self.assertEqual(to_paise('₹ 499'), 49900)
+        self.assertEqual(to_paise('Rs. 250.5'), 25050)
+        self.assertEqual(to_paise('INR 1,000'), 100000)
+        self.assertEqual(to_paise('750.00 Cr'), 75000)
+        self.assertEqual(to_paise(Decimal('300.005')), 30000)
+
+    def test_to_paise_rejects_non_credits(self):
+        for value in (None, '', '0', '-100', 'NA'):
+            self.assertIsNone(to_paise(value), value)
+
+    def test_parse_date(self):
+        self.assertEqual(parse_date('2024-03-05'), date(2024, 3, 5))
+        self.assertEqual(parse_date('05/03/2024'), date(2024, 3, 5))
+        self.assertEqual(parse_date('05.03.2024'), date(2024, 3, 5))
+        self.assertEqual(parse_date(' 05-Mar-2024 '), date(2024, 3, 5))
+        self.assertEqual(parse_date('05/03/24 14:32:10'), date(2024, 3, 5))
+
+    def test_parse_date_unreadable(self):
+        self.assertIsNone(parse_date('yesterday'))
+        self.assertIsNone(parse_date('31/02/2024'))
+
+
+class UnpaidPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.pool = unpaid_pool([
+            (50000, date(2024, 1, 10), 'SUB1'),
+            (50000, date(2024, 3, 10), 'SUB2'),
+            (50000, date(2024, 6, 10), 'SUB3'),
+            (90000, date(2024, 3, 10), 'SUB4'),
+        ])
+
+    def test_candidates_by_amount_within_the_date_window(self):
+        self.assertEqual(self.pool.candidates(50000, date(2024, 2, 20), set()), ['SUB2'])
+        self.assertEqual(self.pool.candidates(90000, date(2024, 2, 20), set()), ['SUB4'])
+
+    def test_candidates_window_bounds(self):
+        # Paid up to 45 days before the start or up to 30 days after it
+        pool = unpaid_pool([(50000, date(2024, 1, 10), 'SUB1')])
+        self.assertEqual(pool.candidates(50000, date(2023, 11, 26), set()), ['SUB1'])
+        self.assertEqual(pool.candidates(50000, date(2023, 11, 25), set()), [])
+        self.assertEqual(pool.candidates(50000, date(2024, 2, 9), set()), ['SUB1'])
+        self.assertEqual(pool.candidates(50000, date(2024, 2, 10), set()), [])
+
+    def test_candidates_skip_claimed_and_unknown_amounts(self):
+        self.assertEqual(self.pool.candidates(50000, date(2024, 2, 20), {'SUB2'}), [])
+        self.assertEqual(self.pool.candidates(12300, date(2024, 2, 20), set()), [])
+
+
+class ReconcileMatchingTests(SimpleTestCase):
+    def run_statement(self, lines, by_reference=None, pool=None):
+        found = defaultdict(list, by_reference or {})
+        with mock.patch('api.reconciliation._by_reference', return_value=found), \
+                mock.patch('api.reconciliation.UnpaidPool', return_value=pool or unpaid_pool([])):
+            return reconcile(['Date,Reference,Amount'] + lines, apply=False)
+
+    def reasons(self, result):
+        return [entry['reason'] for entry in result['ambiguous']]
+
+    def test_reconcile_endpoint_requires_an_admin(self):
+        request = APIRequestFactory().post('/api/subscriptions/reconcile/', {}, format='multipart')
+        response = SubscriptionViewSet.as_view({'post': 'reconcile'})(request)
+        self.assertEqual(response.status_code, 403)
+
+    def test_reference_shared_by_several_subscriptions_is_ambiguous(self):
+        docs = [{'_id': 'SUB1', 'payment_id': 'UTR1', 'plan': {'price': Decimal('500')}},
+                {'_id': 'SUB2', 'payment_id': 'UTR1', 'plan': {'price': Decimal('500')}}]
+        result = self.run_statement(['2024-03-01,UTR1,500'], by_reference={'UTR1': docs})
+        self.assertEqual(self.reasons(result), ['Several subscriptions have this payment id.'])
+        self.assertEqual(result['ambiguous'][0]['candidates'], ['SUB1', 'SUB2'])
+        self.assertEqual(result['summary']['matched'], 0)
+
+    def test_reference_with_a_different_amount_is_ambiguous(self):
+        docs = [{'_id': 'SUB1', 'payment_id': 'UTR1', 'payment_status': 'Pending', 'plan': {'price': Decimal('500')}}]
+        result = self.run_statement(['2024-03-01,UTR1,450'], by_reference={'UTR1': docs})
+        self.assertEqual(self.reasons(result), ['Amount differs from the plan price.'])
+
+    def test_second_line_for_a_matched_subscription_is_ambiguous(self):
+        docs = [{'_id': 'SUB1', 'payment_id': 'UTR1', 'payment_status': 'Pending', 'plan': {'price': Decimal('500')}}]
+        result = self.run_statement(['2024-03-01,UTR1,500', '2024-03-02,UTR1,500'], by_reference={'UTR1': docs})
+        self.assertEqual([entry['line'] for entry in result['matched']], [2])
+        self.assertEqual(self.reasons(result), ['Subscription already matched by another line.'])
+
+    def test_several_unpaid_candidates_are_ambiguous(self):
+        pool = unpaid_pool([(50000, date(2024, 3, 10), 'SUB1'), (50000, date(2024, 3, 20), 'SUB2')])
+        result = self.run_statement(['2024-03-01,,500'], pool=pool)
+        self.assertEqual(self.reasons(result), ['Several unpaid subscriptions match amount and date.'])
+        self.assertEqual(result['ambiguous'][0]['candidates'], ['SUB1', 'SUB2'])
+
+    def test_claimed_candidate_leaves_a_single_match(self):
+        pool = unpaid_pool([(50000, date(2024, 3, 10), 'SUB1'), (50000, date(2024, 3, 20), 'SUB2')])
+        docs = [{'_id': 'SUB1', 'payment_id': 'UTR1', 'payment_status': 'Pending', 'plan': {'price': Decimal('500')}}]
+        result = self.run_statement(['2024-03-01,UTR1,500', '2024-03-02,,500'], by_reference={'UTR1': docs}, pool=pool)
+        self.assertEqual([(entry['subscription'], entry['method']) for entry in result['matched']],
+                         [('SUB1', 'reference'), ('SUB2', 'amount_date')])
+        self.assertEqual(result['summary']['ambiguous'], 0)
+
+
+class SyncCursorTests(SimpleTestCase):
+    def test_watermark_round_trip(self):
+        moment = datetime(2024, 3, 5, 10, 15, 30, 123000)
+        self.assertEqual(format_watermark(moment), '2024-03-05T10:15:30.123Z')
+        self.assertEqual(parse_watermark(format_watermark(moment)), moment)
+
+    def test_watermark_with_offset_is_converted_to_utc(self):
+        self.assertEqual(parse_watermark('2024-03-05T15:45:30+05:30'), datetime(2024, 3, 5, 10, 15, 30))
+        self.assertIsNone(parse_watermark(''))
+        with self.assertRaises(ValidationError):
+            parse_watermark('last tuesday')
+
+    def test_cursor_round_trip(self):
+        since, until = datetime(2024, 3, 1), datetime(2024, 3, 5, 10, 15, 30, 123000)
+        after = (datetime(2024, 3, 2, 8, 0, 0, 5000), 'SUBS00000042')
+        self.assertEqual(decode_cursor(encode_cursor(since, until, 6, after)), (since, until, 6, after))
+        self.assertEqual(decode_cursor(encode_cursor(None, until, 8, None)), (None, until, 8, None))
+
+    def test_invalid_cursor(self):
+        for cursor in ('not a cursor', 'e30=', encode_cursor(None, datetime(2024, 3, 1), 0, None)[:-4]):
+            with self.assertRaises(ValidationError, msg=cursor):
+                decode_cursor(cursor)
+
+    @override_settings(SYNC_WATERMARK_LAG_SECONDS=5, SYNC_TOMBSTONE_RETENTION_DAYS=30)
+    def test_window(self):
+        since, until = window_for(None)
+        self.assertIsNone(since)
+        self.assertLess(until, datetime.utcnow() - timedelta(seconds=4))
+        self.assertEqual(until.microsecond % 1000, 0)
+        recent = datetime.utcnow() - timedelta(days=1)
+        self.assertEqual(window_for(recent)[0], recent)
+        with self.assertRaises(SyncExpired):
+            window_for(datetime.utcnow() - timedelta(days=31))
+
+    def test_sync_requires_an_admin(self):
+        response = SyncViewSet.as_view({'get': 'list'})(APIRequestFactory().get('/api/sync/'))
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(SYNC_WATERMARK_LAG_SECONDS=0)
+class SyncPagingTests(MongoTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.subscribers = create_subscribers(10)
+        cls.admin = AdminUser(username='sync', password='-', email='sync@example.in', first_name='Sync',
+                              last_name='Admin', aadhaar='000000000000', mobile='9999999999')
+
+    def sync(self, **params):
+        """Follows `next` to the last page; returns the pages and the watermark."""
+        pages, cursor = [], None
+        while True:
+            query = dict(params, cursor=cursor) if cursor else params
+            request = APIRequestFactory().get('/api/sync/', query)
+            force_authenticate(request, user=self.admin)
+            response = SyncViewSet.as_view({'get': 'list'})(request)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            if response.data['next'] is None:
+                return pages, response.data['watermark']
+            cursor = parse_qs(urlparse(response.data['next']).query)['cursor'][0]
+
+    def synced_ids(self, pages, name):
+        return [row['_id'] for page in pages for row in page['changes'][name]]
+
+    def test_full_sync_then_delta(self):
+        # Watermarks keep milliseconds; step past the last write so it is below the window's end
+        time.sleep(0.01)
+        pages, watermark = self.sync(limit=4)
+        self.assertGreater(len(pages), 1)
+        self.assertEqual(sorted(self.synced_ids(pages, 'subscribers')), sorted(s.pk for s in self.subscribers))
+        self.assertEqual(len(self.synced_ids(pages, 'subscriber_categories')), 3)
+        self.assertEqual(len(self.synced_ids(pages, 'subscriber_types')), 3)
+
+        time.sleep(0.01)
+        deleted = self.subscribers[0]
+        deleted.delete()
+        changed = self.subscribers[1]
+        changed.notes = "Moved house"
+        changed.save()
+        pages, _ = self.sync(since=watermark)
+        self.assertEqual(self.synced_ids(pages, 'subscribers'), [changed.pk])
+        self.assertEqual(
+            [row for page in pages for row in page['deleted']], [{'collection': 'subscribers', 'id': deleted.pk}],
+        )
@@ -0,0 +1,159 @@
+"""
+Request throttling and load shedding.
+
+Every viewset action belongs to a throttle scope. The viewset can declare it
+in `throttle_scopes = {'generate_pdf_report': 'report', ...}`; otherwise the
+scope is 'read' for safe methods and 'write' for the rest.
+
+- TokenBucketThrottle (a DRF throttle) gives every auth token one bucket per
+  scope, sized by THROTTLE_RATES. Unauthenticated calls are keyed by client
+  address. An empty bucket answers 429 with Retry-After.
+- ConcurrencyLimitMiddleware caps how many requests of a scope run at once
+  across all workers (CONCURRENCY_LIMITS). A request over the cap is answered
+  503 with Retry-After straight away, instead of queueing behind the others.
+
+Buckets and running-request leases live in a small SQLite file
+(THROTTLE_STORE_PATH), so every gunicorn worker on the host shares them.
+Each update is one BEGIN IMMEDIATE transaction. A lease left behind by a
+killed worker expires after CONCURRENCY_LEASE_SECONDS. If the store fails,
+the request is let through.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import THROTTLED_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker waits for another worker's store transaction
+STORE_TIMEOUT_SECONDS = 1.0
+
+
+def throttle_scope_for(view_class, action, method):
+    scopes = getattr(view_class, 'throttle_scopes', None) or {}
+    return scopes.get(action) or ('read' if method in SAFE_METHODS else 'write')
+
+
+class LocalStore:
+    """Token buckets and concurrency leases shared by the processes of one host."""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS lease (id TEXT PRIMARY KEY, scope TEXT NOT NULL, expires REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS lease_scope ON lease (scope, expires)",
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        # One connection per thread, reopened after a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=STORE_TIMEOUT_SECONDS, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Losing the last updates in a power cut only resets some buckets
+            conn.execute('PRAGMA synchronous=OFF')
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def take(self, key, capacity, rate, now=None):
+        """
+        Takes a token from bucket `key` (`capacity` tokens, refilled at `rate`
+        per second). Returns 0 when allowed, else the seconds until a token is due.
+        """
+        now = time.time() if now is None else now
+        with self.transaction() as conn:
+            row = conn.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+            if tokens < 1:
+                return (1 - tokens) / rate
+            conn.execute(
+                'INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens - 1, now),
+            )
+            return 0.0
+
+    def acquire(self, scope, limit, lease_seconds, now=None):
+        """A lease id if fewer than `limit` requests of `scope` hold one, else None."""
+        now = time.time() if now is None else now
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM lease WHERE scope = ? AND expires < ?', (scope, now))
+            (held,) = conn.execute('SELECT COUNT(*) FROM lease WHERE scope = ?', (scope,)).fetchone()
+            if held >= limit:
+                return None
+            lease_id = uuid.uuid4().hex
+            conn.execute('INSERT INTO lease (id, scope, expires) VALUES (?, ?, ?)', (lease_id, scope, now + lease_seconds))
+            return lease_id
+
+    def release(self, lease_id):
+        self.connection().execute('DELETE FROM lease WHERE id = ?', (lease_id,))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = LocalStore(settings.THROTTLE_STORE_PATH)
+    return _store
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Per-token, per-scope token buckets; rates come from THROTTLE_RATES."""
+
+    def allow_request(self, request, view):
+        self.delay = None
+        # Operations of a batch were paid for by the batch request itself
+        if not settings.THROTTLE_ENABLED or getattr(request, 'batch_operation', False):
+            return True
+        scope = throttle_scope_for(type(view), getattr(view, 'action', None), request.method)
+        rate = settings.THROTTLE_RATES.get(scope)
+        if rate is None:
+            return True
+        capacity, per_second = rate
+
+        # Tokens are hashed so the store file holds no credentials
+        ident = str(request.auth) if request.auth else self.get_ident(request)
+        key = f"{scope}:{hashlib.sha256(ident.encode()).hexdigest()[:32]}"
+        try:
+            wait = get_store().take(key, capacity, per_second)
+        except sqlite3.Error:
+            logger.warning("Throttle store unavailable; letting the request through", exc_info=True)
+            return True
+        if wait:
+            self.delay = wait
+            THROTTLED_REQUESTS.labels(scope, 'rate').inc()
+            return False
+        return True
+
+    def wait(self):
+        return self.delay
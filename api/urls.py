@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AdminUserViewSet, MagazineSubscriberViewSet, SubscriptionViewSet, SubscriptionPlanViewSet, SubscriberCategoryViewSet, SubscriberTypeViewSet, SubscriptionLanguageViewSet, SubscriptionModeViewSet, PaymentModeViewSet
+from .views import AdminUserViewSet, BatchViewSet, MagazineSubscriberViewSet, SubscriptionViewSet, SubscriptionPlanViewSet, SubscriberCategoryViewSet, SubscriberTypeViewSet, SubscriptionLanguageViewSet, SubscriptionModeViewSet, PaymentModeViewSet, PincodeViewSet, SlowQueryViewSet, SyncViewSet
 
 router = DefaultRouter()
 router.register(r'subscribers', MagazineSubscriberViewSet, basename='subscriber')
@@ -12,6 +12,10 @@ router.register(r'subscription-languages', SubscriptionLanguageViewSet, basename
 router.register(r'subscription-modes', SubscriptionModeViewSet, basename='subscriptionmode')
 router.register(r'payment-modes', PaymentModeViewSet, basename='paymentmode')
 router.register(r'adminusers', AdminUserViewSet, basename='adminuser')
+router.register(r'batch', BatchViewSet, basename='batch')
+router.register(r'pincodes', PincodeViewSet, basename='pincode')
+router.register(r'slow-queries', SlowQueryViewSet, basename='slowquery')
+router.register(r'sync', SyncViewSet, basename='sync')
 
 from django.http import HttpResponse
 
@@ -1,13 +1,14 @@
-from pymongo import MongoClient, ReturnDocument
-from django.conf import settings  # Import settings from Django
+from pymongo import ReturnDocument
+from mongoengine.connection import get_db
+
+def get_counter_collection():
+    # Reuse the MongoEngine default connection instead of opening a new
+    # MongoClient for every generated id
+    return get_db()['counters']
 
 def get_next_sequence_value(collection_name):
-    # Use the MongoDB connection string from settings.py
-    client = MongoClient(settings.MONGOENGINE_CONNECTION_STRING)
-    db = client[settings.MONGOENGINE_DATABASE_NAME]
-    
     # Collection where sequence counters are stored
-    counter = db['counters']
+    counter = get_counter_collection()
 
     # Increment the sequence value for the given collection
     sequence_document = counter.find_one_and_update(
@@ -16,10 +17,31 @@ def get_next_sequence_value(collection_name):
         return_document=ReturnDocument.AFTER,
         upsert=True
     )
-    
+
     # Return the updated sequence value
     return sequence_document['sequence_value']
 
 def generate_id(prefix, collection_name):
     next_value = get_next_sequence_value(collection_name)
     return f"{prefix}{next_value:06d}"
+
+def allocate_sequence_block(collection_name, size):
+    """
+    Reserves `size` consecutive sequence values with a single counter update
+    and returns the first one. Used by bulk writers that cannot afford one
+    round trip per generated id.
+    """
+    if size <= 0:
+        raise ValueError("Block size must be greater than zero.")
+    sequence_document = get_counter_collection().find_one_and_update(
+        {'_id': collection_name},
+        {'$inc': {'sequence_value': size}},
+        return_document=ReturnDocument.AFTER,
+        upsert=True
+    )
+    return sequence_document['sequence_value'] - size + 1
+
+def generate_id_block(prefix, collection_name, size):
+    """Returns `size` ids in the same format as `generate_id`, allocated in one round trip."""
+    first = allocate_sequence_block(collection_name, size)
+    return [f"{prefix}{value:06d}" for value in range(first, first + size)]
@@ -1,23 +1,31 @@
 # Third-party libraries
 import hashlib
+import logging
+import re
+from datetime import datetime
 
 # Rest Framework
 from rest_framework import status
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.decorators import action
 from rest_framework.exceptions import AuthenticationFailed, PermissionDenied, NotFound
-from rest_framework.permissions import AllowAny
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import SAFE_METHODS, AllowAny
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from rest_framework_mongoengine import viewsets
 from rest_framework.pagination import PageNumberPagination  # Added for pagination
+from rest_framework.viewsets import ViewSet
 
-# FPDF
-from fpdf import FPDF
+from django.conf import settings
 from django.http import HttpResponse
 
+from magazine.mongo import read_preference, reader
+
 # Local app models
 from .models import (
     AdminUser,
+    DuplicateCandidate,
     MagazineSubscriber,
     PaymentMode,
     SubscriberCategory,
@@ -29,6 +37,19 @@ from .models import (
     UserToken,
 )
 
+from .batch import BatchError, parse_operations, run_batch
+from .archive import TieredSubscribers, archived_subscriber, is_archived, restore_subscriber
+from .duplicates import merge_subscribers
+from .filters import SubscriptionFilterBackend
+from .geo import cached_distribution
+from .labels import get_template as get_label_template, render_labels, subscriber_label_fields
+from .pagination import KeysetPagination
+from .permissions import IsAdminUser
+from .pincodes import directory_available, lookup_pincode
+from .reconciliation import StatementError, reconcile as reconcile_statement
+from .slowlog import recent_slow_queries
+from .sync import SyncExpired, decode_cursor, encode_cursor, format_watermark, parse_watermark, sync_page, window_for
+
 # Local app serializers
 from .serializers import (
     AdminUserSerializer,
@@ -40,8 +61,19 @@ from .serializers import (
     SubscriptionModeSerializer,
     SubscriptionPlanSerializer,
     SubscriptionSerializer,
+    parse_fields,
 )
 
+logger = logging.getLogger(__name__)
+
+
+def _names(model, ids):
+    """pk -> name of the `model` documents in `ids`, in one query."""
+    if not ids:
+        return {}
+    return {doc['_id']: doc.get('name') for doc in reader(model).find({'_id': {'$in': list(ids)}}, {'name': 1})}
+
+
 # Added Pagination class
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 20
@@ -52,7 +84,12 @@ class StandardResultsSetPagination(PageNumberPagination):
 class TokenAuthentication(BaseAuthentication):
     def authenticate(self, request):
         token = request.data.get('token')  # Get the token from the request body
-        print("Got called")
+        logger.debug("Token authentication attempted")
+        if not token:
+            # GET requests carry no body, so also accept "Authorization: Token <token>"
+            header = request.META.get('HTTP_AUTHORIZATION', '').split()
+            if len(header) == 2 and header[0].lower() == 'token':
+                token = header[1]
         if not token:
             return None  # No token provided, continue to other authentication methods
 
@@ -63,7 +100,41 @@ class TokenAuthentication(BaseAuthentication):
 
         return (user_token.user, token)  # Return user and token if valid
 
-class SubscriberCategoryViewSet(viewsets.ModelViewSet):
+class SparseFieldsViewMixin:
+    """
+    `?fields=name,phone` on GET requests limits the response to those fields
+    and loads only them from MongoDB. Dotted names pick fields of a nested
+    serializer, e.g. `subscriptions.start_date`. Writes ignore the parameter.
+    """
+
+    def requested_fields(self):
+        request = getattr(self, 'request', None)
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        return parse_fields(request.query_params.get('fields'))
+
+    def projected_fields(self):
+        """Model fields to load for the requested fields, or None for all of them."""
+        fields = self.requested_fields()
+        if fields is None:
+            return None
+        model = self.get_serializer_class().Meta.model
+        names = {name.partition('.')[0] for name in fields}
+        return ['_id'] + sorted(name for name in names if name in model._fields and name != '_id')
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.requested_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        projection = self.projected_fields()
+        return queryset.only(*projection) if projection else queryset
+
+
+class SubscriberCategoryViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     lookup_field = '_id'
     serializer_class = SubscriberCategorySerializer
     authentication_classes = [TokenAuthentication]
@@ -78,7 +149,7 @@ class SubscriberCategoryViewSet(viewsets.ModelViewSet):
         self.check_object_permissions(self.request, obj)
         return obj
 
-class SubscriberTypeViewSet(viewsets.ModelViewSet):
+class SubscriberTypeViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     lookup_field = '_id'
     serializer_class = SubscriberTypeSerializer
     authentication_classes = [TokenAuthentication]
@@ -93,7 +164,7 @@ class SubscriberTypeViewSet(viewsets.ModelViewSet):
         self.check_object_permissions(self.request, obj)
         return obj
 
-class SubscriptionLanguageViewSet(viewsets.ModelViewSet):
+class SubscriptionLanguageViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     lookup_field = '_id'
     serializer_class = SubscriptionLanguageSerializer
     authentication_classes = [TokenAuthentication]
@@ -108,7 +179,7 @@ class SubscriptionLanguageViewSet(viewsets.ModelViewSet):
         self.check_object_permissions(self.request, obj)
         return obj
 
-class SubscriptionModeViewSet(viewsets.ModelViewSet):
+class SubscriptionModeViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     lookup_field = '_id'
     serializer_class = SubscriptionModeSerializer
     authentication_classes = [TokenAuthentication]
@@ -123,7 +194,7 @@ class SubscriptionModeViewSet(viewsets.ModelViewSet):
         self.check_object_permissions(self.request, obj)
         return obj
 
-class SubscriptionPlanViewSet(viewsets.ModelViewSet):
+class SubscriptionPlanViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     lookup_field = '_id'
     serializer_class = SubscriptionPlanSerializer
     authentication_classes = [TokenAuthentication]
@@ -138,7 +209,7 @@ class SubscriptionPlanViewSet(viewsets.ModelViewSet):
         self.check_object_permissions(self.request, obj)
         return obj
 
-class PaymentModeViewSet(viewsets.ModelViewSet):
+class PaymentModeViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     lookup_field = '_id'
     serializer_class = PaymentModeSerializer
     authentication_classes = [TokenAuthentication]
@@ -154,20 +225,46 @@ class PaymentModeViewSet(viewsets.ModelViewSet):
         return obj
 
 
-class MagazineSubscriberViewSet(viewsets.ModelViewSet):
+class MagazineSubscriberViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     lookup_field = '_id'
     serializer_class = MagazineSubscriberSerializer
     authentication_classes = [TokenAuthentication]
 
     pagination_class = StandardResultsSetPagination  # Added pagination
 
+    # MongoDB commands each action may issue (token lookup included)
+    query_budgets = {
+        # Token, two counts and the page; the inactive tab counts and pages both tiers
+        'list': 7,
+        'retrieve': 6,
+        'report': 7,
+        'generate_pdf_report': 6,
+        'duplicates': 4,
+        # Token, one batch of dirty pincodes (api/geo.py), two name lookups and the rollup aggregate
+        'geo': 10,
+    }
+
+    # See api/throttling.py; other actions are 'read' or 'write' by method
+    throttle_scopes = {
+        'report': 'report',
+        'generate_pdf_report': 'report',
+        'generate_report_dummy': 'report',
+        'geo': 'report',
+    }
+
+    # Served by secondaries when available (see magazine/mongo.py)
+    analytical_actions = {'report', 'generate_pdf_report', 'geo'}
+
     def get_queryset(self):
         return MagazineSubscriber.objects.order_by('-_id')
 
     def get_object(self):
         queryset = self.filter_queryset(self.get_queryset())
         filter_kwargs = {self.lookup_field: self.kwargs[self.lookup_field]}
-        obj = queryset.get(**filter_kwargs)
+        # Fall back to the archive tier for long-deleted subscribers
+        obj = queryset.filter(**filter_kwargs).first() or archived_subscriber(self.kwargs[self.lookup_field])
+        if obj is None:
+            raise NotFound("Subscriber not found.")
         self.check_object_permissions(self.request, obj)
         return obj
 
@@ -176,24 +273,106 @@ class MagazineSubscriberViewSet(viewsets.ModelViewSet):
         # 1. Grab the instance (will 404 if not found)
         subscriber = self.get_object()
 
-        # 2. Idempotency: if already active, tell the client
-        if not subscriber.isDeleted:
+        # 2. Bring archived subscribers back to the hot tier
+        if is_archived(subscriber):
+            restore_subscriber(subscriber.pk)
+
+        # 3. Flip the flag only if still deleted; a concurrent activate loses cleanly
+        if not MagazineSubscriber.conditional_set(
+            subscriber.pk, {'isDeleted': True}, {'isDeleted': False}, unset=['deleted_at'],
+        ):
             return Response(
                 {'detail': 'Subscriber is already active.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-
-        # 3. Flip the flag and persist
-        subscriber.isDeleted = False
-        subscriber.save()
+        Subscription.update_active_subscription_flag(subscriber.pk)
+        subscriber = MagazineSubscriber.objects.get(pk=subscriber.pk)
 
         # 4. Re-serialize and return the full updated resource
         data = self.get_serializer(subscriber).data
         return Response(data, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['get'])
+    def duplicates(self, request):
+        """
+        Open duplicate candidate pairs found by `find_duplicates`, highest score
+        first, with a short summary of both subscribers.
+        """
+        try:
+            page_size = int(request.query_params.get('page_size', 20))
+            page = int(request.query_params.get('page', 1))
+        except ValueError:
+            return Response({'error': "page and page_size must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        page_size, page = max(1, min(page_size, 100)), max(page, 1)
+
+        candidates = DuplicateCandidate.objects(status='open').order_by('-score')
+        total_count = candidates.count()
+        candidates = list(candidates.skip((page - 1) * page_size).limit(page_size))
+
+        ids = {c.subscriber_a for c in candidates} | {c.subscriber_b for c in candidates}
+        summaries = {
+            doc['_id']: doc
+            for doc in MagazineSubscriber._get_collection().find(
+                {'_id': {'$in': list(ids)}},
+                {'name': 1, 'address': 1, 'city_town': 1, 'pincode': 1, 'phone': 1, 'email': 1},
+            )
+        }
+
+        results = [
+            {
+                'id': candidate.pk,
+                'score': candidate.score,
+                'reasons': candidate.reasons,
+                'detected_at': candidate.detected_at,
+                'subscribers': [summaries.get(candidate.subscriber_a), summaries.get(candidate.subscriber_b)],
+            }
+            for candidate in candidates
+        ]
+        return Response({'results': results, 'count': total_count, 'page': page}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def geo(self, request):
+        """
+        Active subscribers by state; pass `state` for its districts and
+        `state` + `district` for pincodes. Each row is split by category and type.
+        """
+        state = request.query_params.get('state') or None
+        district = request.query_params.get('district') or None
+        if district and not state:
+            return Response({'detail': 'district requires state.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(cached_distribution(state, district), status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'])
+    def merge(self, request, _id=None):
+        """Merges the subscriber named in `duplicate` into this one."""
+        survivor = self.get_object()
+        duplicate_id = request.data.get('duplicate')
+        if not duplicate_id:
+            return Response({'detail': 'duplicate is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        duplicate = MagazineSubscriber.objects(pk=duplicate_id).first()
+        if duplicate is None:
+            raise NotFound(f"Subscriber {duplicate_id} not found.")
+
+        try:
+            moved = merge_subscribers(survivor, duplicate)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        survivor.reload()
+        data = self.get_serializer(survivor).data
+        return Response({'subscriber': data, 'subscriptions_moved': moved}, status=status.HTTP_200_OK)
+
+    def perform_update(self, serializer):
+        if is_archived(serializer.instance):
+            raise PermissionDenied("Archived subscribers must be activated before they can be edited.")
+        serializer.save()
+
     def perform_destroy(self, instance):
-        instance.isDeleted = True
-        instance.save()
+        if is_archived(instance):
+            return
+        MagazineSubscriber.conditional_set(
+            instance.pk, {'isDeleted': False}, {'isDeleted': True, 'deleted_at': datetime.utcnow()},
+        )
 
     # --- ADDITION: Override get_serializer to include subscriptions only on detail (retrieve) ---
     def get_serializer(self, *args, **kwargs):
@@ -235,7 +414,11 @@ class MagazineSubscriberViewSet(viewsets.ModelViewSet):
             page_num = page_renewal
             key = 'renewal'
         elif page_inactive > 0:
-            target_qs = base_queryset.filter(isDeleted=True)
+            # Deleted subscribers live in both the hot and the archive tier
+            archive_filters = {}
+            if search_filter and query and search_filter in MagazineSubscriber._fields:
+                archive_filters[search_filter] = {'$regex': re.escape(query), '$options': 'i'}
+            target_qs = TieredSubscribers(archive_filters, fields=self.projected_fields())
             page_num = page_inactive
             key = 'inactive'
         else:
@@ -302,32 +485,13 @@ class MagazineSubscriberViewSet(viewsets.ModelViewSet):
         updated_link = f"{url}?{query_params.urlencode()}"
         return updated_link
 
-    @action(detail=False, methods=['get'])
-    def report(self, request):
-        """
-        Fetches filtered subscriber data and returns a formatted report.
-        """
-        # Get query parameters
-        char_limit = int(request.query_params.get('char_limit', 42))
+    def _report_queryset(self, request):
+        """Subscribers matching the report filters in the query string (at most 500)."""
         subscriber_status = request.query_params.get('subscriberStatus', 'active')
         subscriber_type = request.query_params.get('subscriberType', None)
         subscriber_category = request.query_params.get('subscriberCategory', None)
         subscription_plan = request.query_params.get('subscriptionPlan', None)
 
-        # Helper function to split an address into multiple lines based on character limit.
-        def split_address(address, char_limit):
-            if not address:
-                return []
-            lines = []
-            while len(address) > char_limit:
-                split_at = address[:char_limit].rfind(' ')
-                if split_at == -1:  # If no space found, split at the char limit
-                    split_at = char_limit
-                lines.append(address[:split_at].strip())
-                address = address[split_at:].strip()
-            lines.append(address)
-            return lines
-
         # Filter subscribers based on provided filters
         filters = {}
         if subscriber_status == 'active':
@@ -360,7 +524,35 @@ class MagazineSubscriberViewSet(viewsets.ModelViewSet):
                 None # Do Nothing
 
         # Limit result to 500 records to avoid timeout
-        subscribers = self.get_queryset().filter(**filters)[:500]
+        return self.get_queryset().filter(**filters).read_preference(read_preference())[:500]
+
+    @action(detail=False, methods=['get'])
+    def report(self, request):
+        """
+        Fetches filtered subscriber data and returns a formatted report.
+        """
+        # Get query parameters
+        char_limit = int(request.query_params.get('char_limit', 42))
+
+        # Helper function to split an address into multiple lines based on character limit.
+        def split_address(address, char_limit):
+            if not address:
+                return []
+            lines = []
+            while len(address) > char_limit:
+                split_at = address[:char_limit].rfind(' ')
+                if split_at == -1:  # If no space found, split at the char limit
+                    split_at = char_limit
+                lines.append(address[:split_at].strip())
+                address = address[split_at:].strip()
+            lines.append(address)
+            return lines
+
+        # One find for the page (its limit fits in the first batch) and one per
+        # reference collection for the names, instead of a lookup per row
+        subscribers = list(self._report_queryset(request).no_dereference().batch_size(500))
+        categories = _names(SubscriberCategory, {s.category.id for s in subscribers if s.category})
+        types = _names(SubscriberType, {s.stype.id for s in subscribers if s.stype})
 
         report = []
         for subscriber in subscribers:
@@ -368,8 +560,8 @@ class MagazineSubscriberViewSet(viewsets.ModelViewSet):
             report.append({
                 "Name": subscriber.name,
                 "Active": not subscriber.isDeleted,  # True for active, False for inactive
-                "Category": subscriber.category.name if subscriber.category else "N/A",
-                "Type": subscriber.stype.name if subscriber.stype else "N/A",
+                "Category": categories.get(getattr(subscriber.category, 'id', None)) or "N/A",
+                "Type": types.get(getattr(subscriber.stype, 'id', None)) or "N/A",
                 "Address line 1": address_lines[0] if len(address_lines) > 0 else "",
                 "Address line 2": address_lines[1] if len(address_lines) > 1 else "",
                 "City": subscriber.city_town or "",
@@ -384,84 +576,29 @@ class MagazineSubscriberViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def generate_pdf_report(self, request):
         """
-        Generates a PDF report with subscriber data in A4 landscape,
-        using 5 columns per page, 6 lines per cell, 60 chars per line (no textwrap).
+        Generates a PDF of subscriber address labels (default template: A4
+        landscape, 5 columns) for the same filters as `report`.
         """
         try:
-            report_data = self.report(request).data
-
-            pdf = FPDF(orientation='L', unit='mm', format='A4')
-            pdf.set_auto_page_break(auto=True, margin=15)
-
-            margin = 10
-            header_cell_height = 10
-            header_spacing = 5
-            header_height = header_cell_height + header_spacing
-
-            def add_page_with_header():
-                pdf.add_page()
-                pdf.set_font("Arial", size=10, style='B')
-                status = request.query_params.get('subscriberStatus', 'active')
-                category = request.query_params.get('subscriberCategory', None) or "ALL"
-                sub_type = request.query_params.get('subscriberType', None) or "ALL"
-                subscription_plan = request.query_params.get('subscriptionPlan', None) or "ALL"
-                header = f"Status: {status.capitalize()} | Category: {category} | Type: {sub_type} | Subscription Plan: {subscription_plan}"
-                pdf.cell(0, header_cell_height, header, align='C', ln=True)
-                pdf.ln(header_spacing)
-
-            add_page_with_header()
-
-            page_width, page_height = 297, 210
-            usable_width = page_width - 2 * margin
-            usable_height = page_height - 2 * margin - header_height
-
-            columns = 5
-            line_height = 5
-            max_chars_per_line = 60
-            box_height = line_height * 6
-            rows_per_page = int(usable_height // box_height)
-            box_width = usable_width / columns
-
-            pdf.set_font("Arial", size=8)
-
-            def sanitize(val):
-                return str(val) if val not in (None, '', 'null', 'None') else None
-
-            for idx, sub in enumerate(report_data):
-                if idx > 0 and idx % (columns * rows_per_page) == 0:
-                    add_page_with_header()
-
-                col = idx % columns
-                row = (idx // columns) % rows_per_page
-                x = margin + col * box_width
-                y = margin + header_height + row * box_height
-
-                pdf.rect(x, y, box_width, box_height)
-
-                fields = [
-                    sanitize(sub.get("Name")),
-                    sanitize(sub.get("Address line 1")),
-                    sanitize(sub.get("Address line 2")),
-                    sanitize(f"{sub.get('City','')}, {sub.get('District','')}".strip(", ")),
-                    sanitize(f"{sub.get('State','')}, {sub.get('Pincode','')}".strip(", ")),
-                    sanitize(sub.get("Phone Number")),
-                ]
-
-                pdf.set_xy(x + 2, y + 2)
-                for val in fields:
-                    if not val:
-                        continue
-                    # Slice text into max_chars_per_line chunks, max 6 lines
-                    for line_no in range(6):
-                        start = line_no * max_chars_per_line
-                        if start >= len(val):
-                            break
-                        chunk = val[start:start + max_chars_per_line]
-                        pdf.cell(box_width - 4, line_height, chunk, ln=True)
-                        pdf.set_x(x + 2)
-                pdf.ln(line_height)
-
-            pdf_bytes = pdf.output(dest='S').encode('latin1')
+            template = get_label_template(request.query_params.get('template'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            status_param = request.query_params.get('subscriberStatus', 'active')
+            category = request.query_params.get('subscriberCategory', None) or "ALL"
+            sub_type = request.query_params.get('subscriberType', None) or "ALL"
+            subscription_plan = request.query_params.get('subscriptionPlan', None) or "ALL"
+            header = f"Status: {status_param.capitalize()} | Category: {category} | Type: {sub_type} | Subscription Plan: {subscription_plan}"
+
+            subscribers = self._report_queryset(request).only(
+                'name', 'address', 'city_town', 'district', 'state', 'pincode', 'phone'
+            )
+            labels = (
+                subscriber_label_fields(sub.name, sub.address, sub.city_town, sub.district, sub.state, sub.pincode, sub.phone)
+                for sub in subscribers
+            )
+            pdf_bytes = render_labels([(header, labels)], template)
             return HttpResponse(
                 pdf_bytes,
                 content_type='application/pdf',
@@ -478,116 +615,44 @@ class MagazineSubscriberViewSet(viewsets.ModelViewSet):
         """
         import random
         import string
-        from fpdf import FPDF
-        from django.http import HttpResponse
-        from rest_framework.response import Response
+
+        try:
+            base_template = get_label_template(request.query_params.get('template', 'a4-landscape-4x6'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
             # Generate distinct dummy data
-            def create_dummy_entry(index, category, stype):
-                return {
-                    "Name": f"Subscriber {index} " + ''.join(random.choices(string.ascii_uppercase, k=5)),
-                    "Address line 1": f"{random.randint(1, 999)} Elm Street",
-                    "Address line 2": f"Apartment {random.randint(1, 50)}B",
-                    "City": f"City-{index}",
-                    "District": f"District-{random.randint(1, 10)}",
-                    "State": f"State-{random.randint(1, 5)}",
-                    "Pincode": f"{random.randint(100000, 999999)}",
-                    "Phone Number": f"{random.randint(100, 999)}-{random.randint(1000, 9999)}-{random.randint(1000, 9999)}",
-                    "Category": category,
-                    "Type": stype,
-                }
+            def create_dummy_entry(index):
+                return subscriber_label_fields(
+                    f"Subscriber {index} " + ''.join(random.choices(string.ascii_uppercase, k=5)),
+                    f"{random.randint(1, 999)} Elm Street, Apartment {random.randint(1, 50)}B",
+                    f"City-{index}",
+                    f"District-{random.randint(1, 10)}",
+                    f"State-{random.randint(1, 5)}",
+                    f"{random.randint(100000, 999999)}",
+                    f"{random.randint(100, 999)}-{random.randint(1000, 9999)}-{random.randint(1000, 9999)}",
+                )
 
             filters = [
                 ("active", "Domestic", "Regular", 37),
                 ("active", "NRI", "Donor", 41),
             ]
 
-            # Generate distinct dummy data for each filter combination
-            report_data = []
-            for status, category, stype, count in filters:
-                report_data += [create_dummy_entry(i + 1, category, stype) for i in range(count)]
-
-            char_limit = int(request.query_params.get('char_limit', 42))
             cols = int(request.query_params.get('cols', 4))  # Default to 4 columns
             rows = int(request.query_params.get('rows', 6))  # Default to 6 rows
+            template = base_template.with_grid(cols, rows)
+
+            # One section (starting on a new page) per filter combination
+            sections = [
+                (
+                    f"Status: {status.capitalize()} | Category: {category or 'ALL'} | Type: {stype or 'ALL'}",
+                    [create_dummy_entry(i + 1) for i in range(count)],
+                )
+                for status, category, stype, count in filters
+            ]
 
-            # Initialize FPDF in landscape mode
-            pdf = FPDF(orientation='L', unit='mm', format='A4')
-            pdf.set_auto_page_break(auto=True, margin=15)
-            pdf.set_font("Arial", size=8)  # Set font size to 9
-
-            def add_page_with_header(status, category, stype):
-                pdf.add_page()
-                pdf.set_font("Arial", style='B', size=8)  # Header slightly larger
-                header = f"Status: {status.capitalize()} | Category: {category or 'ALL'} | Type: {stype or 'ALL'}"
-                pdf.cell(0, 10, header, align='C', ln=True)
-                pdf.ln(5)
-
-            # Layout parameters
-            page_width = 297  # A4 landscape width in mm
-            page_height = 210  # A4 landscape height in mm
-            margin = 10  # Page margin
-            usable_width = page_width - 2 * margin
-            usable_height = page_height - 2 * margin - 10  # Adjust for header
-            column_width = usable_width / cols
-            box_height = usable_height / rows
-
-            current_filter_index = 0  # Track current filter set
-            entries_in_current_filter = 0  # Count entries per filter set
-
-            for _, subscriber in enumerate(report_data):
-                # Switch filter set when reaching its limit
-                if (
-                    (current_filter_index == 0 and entries_in_current_filter >= 37)
-                    or (current_filter_index == 1 and entries_in_current_filter >= 41)
-                ):
-                    current_filter_index += 1
-                    entries_in_current_filter = 0
-
-                # Add a new page with the current filter's header
-                if entries_in_current_filter % (cols * rows) == 0:  # Fit dynamically based on columns and rows
-                    status, category, stype, _ = filters[current_filter_index]
-                    add_page_with_header(status, category, stype)
-
-                # Determine column and row positions
-                column = entries_in_current_filter % cols
-                row = (entries_in_current_filter // cols) % rows
-
-                # Calculate position
-                x_position = margin + (column * column_width)
-                y_position = margin + (row * box_height) + 15  # Offset to avoid header overlap
-
-                # Draw a rectangle for the boundary
-                pdf.rect(x_position, y_position, column_width, box_height)
-
-                # Handle None/null values
-                def sanitize(value):
-                    return str(value) if value not in [None, 'null', 'None', ""] else None
-
-                # Write subscriber details inside the rectangle
-                values = [
-                    sanitize(subscriber.get("Name")),
-                    sanitize(subscriber.get("Address line 1")),
-                    sanitize(subscriber.get("Address line 2")),
-                    sanitize(f"{subscriber.get('City', '')}, {subscriber.get('District', '')}".strip(", ")),
-                    sanitize(f"{subscriber.get('State', '')}, {subscriber.get('Pincode', '')}".strip(", ")),
-                    sanitize(subscriber.get("Phone Number")),
-                ]
-                current_y = y_position + 2  # Padding inside the rectangle
-                pdf.set_xy(x_position + 2, current_y)  # Start writing with padding
-
-                # Write the values, skipping empty ones
-                for value in values:
-                    if value:  # Skip empty strings or None
-                        truncated_value = value[:char_limit - 3] + "..." if len(value) > char_limit else value
-                        pdf.cell(column_width - 4, 3, truncated_value, ln=True)  # Reduced line height
-                        pdf.set_xy(x_position + 2, pdf.get_y())
-
-                entries_in_current_filter += 1  # Increment entries for the current filter set
-
-            # Output PDF to response
-            pdf_output = pdf.output(dest='S').encode('latin1')
+            pdf_output = render_labels(sections, template)
             return HttpResponse(
                 pdf_output,
                 content_type="application/pdf",
@@ -598,10 +663,20 @@ class MagazineSubscriberViewSet(viewsets.ModelViewSet):
             # Handle errors gracefully
             return Response({"error": str(e)}, status=500)
 
-class SubscriptionViewSet(viewsets.ModelViewSet):
+class SubscriptionViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     lookup_field = '_id'
     serializer_class = SubscriptionSerializer
     authentication_classes = [TokenAuthentication]
+    # Filters and keyset pages are served by the subscription_*_keyset indexes
+    filter_backends = [SubscriptionFilterBackend]
+    pagination_class = KeysetPagination
+
+    query_budgets = {
+        'create': 16,
+        'list': 3,
+        'get_by_subscriber': 3,
+    }
+    throttle_scopes = {'reconcile': 'bulk'}
 
     def get_queryset(self):
         return Subscription.objects.all()
@@ -644,14 +719,30 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'], url_path='by_subscriber/(?P<subscriber_id>[^/.]+)')
     def get_by_subscriber(self, request, subscriber_id=None):
+        subscriptions = self.filter_queryset(Subscription.objects.filter(subscriber=subscriber_id))
+        page = self.paginate_queryset(subscriptions)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser], permission_classes=[IsAdminUser])
+    def reconcile(self, request):
+        """
+        Matches a bank/UPI statement (CSV upload in `file`) to subscriptions
+        and marks the matches paid; with dry_run=true it only reports.
+        """
+        statement = request.FILES.get('file')
+        if statement is None:
+            return Response({"error": "Upload the statement as 'file'."}, status=status.HTTP_400_BAD_REQUEST)
+        dry_run = str(request.data.get('dry_run', request.query_params.get('dry_run', ''))).lower() == 'true'
+        # Iterating the upload yields its lines without reading it into memory
+        rows = (line.decode('utf-8-sig', errors='replace') for line in statement)
         try:
-            subscriptions = Subscription.objects.filter(subscriber=subscriber_id)
-            serializer = self.get_serializer(subscriptions, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except Subscription.DoesNotExist:
-            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+            result = reconcile_statement(rows, apply=not dry_run)
+        except StatementError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
 
-class AdminUserViewSet(viewsets.ModelViewSet):
+class AdminUserViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     serializer_class = AdminUserSerializer
     lookup_field = '_id'
 
@@ -726,4 +817,92 @@ class AdminUserViewSet(viewsets.ModelViewSet):
                 return Response({"message": "Logged out successfully."}, status=status.HTTP_200_OK)
             return Response({"error": "Invalid token."}, status=status.HTTP_401_UNAUTHORIZED)
 
-        return Response({"error": "Token not provided."}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response({"error": "Token not provided."}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class SlowQueryViewSet(ViewSet):
+    """Read-only view of the slow MongoDB command log (see api/slowlog.py)."""
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        collection = request.query_params.get('collection')
+        try:
+            limit = int(request.query_params.get('limit', 100))
+        except ValueError:
+            return Response({'error': "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, 1000))
+        entries = recent_slow_queries(collection=collection, limit=limit)
+        for entry in entries:
+            entry['_id'] = str(entry['_id'])
+        return Response(entries, status=status.HTTP_200_OK)
+
+
+class SyncViewSet(ViewSet):
+    """Changes since a client watermark, across subscribers, subscriptions and reference data (see api/sync.py)."""
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            since, until, stage, after = decode_cursor(cursor)
+        else:
+            try:
+                since, until = window_for(parse_watermark(request.query_params.get('since')))
+            except SyncExpired as e:
+                return Response({'error': str(e)}, status=status.HTTP_410_GONE)
+            stage, after = 0, None
+        try:
+            limit = int(request.query_params.get('limit', settings.SYNC_PAGE_SIZE))
+        except ValueError:
+            return Response({'error': "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, settings.SYNC_MAX_PAGE_SIZE))
+
+        body, position = sync_page(since, until, stage, after, limit=limit, context={'request': request})
+        next_link = None
+        if position is not None:
+            url = remove_query_param(request.build_absolute_uri(), 'since')
+            next_link = replace_query_param(url, 'cursor', encode_cursor(since, until, *position))
+        # Store the watermark once `next` is null; it is the `since` of the next sync
+        body.update(watermark=format_watermark(until), next=next_link)
+        return Response(body, status=status.HTTP_200_OK)
+
+
+class PincodeViewSet(ViewSet):
+    """Place names for a pincode, from the pincode directory (see api/pincodes.py)."""
+    authentication_classes = [TokenAuthentication]
+    lookup_value_regex = r'\d{6}'
+
+    # Served from memory, no MongoDB commands beyond the token lookup
+    query_budgets = {'retrieve': 1}
+
+    def retrieve(self, request, pk=None):
+        if not directory_available():
+            return Response({'error': "The pincode directory is not configured."},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        entry = lookup_pincode(pk)
+        if entry is None:
+            raise NotFound(f"Unknown pincode: {pk}")
+        response = Response(entry._asdict(), status=status.HTTP_200_OK)
+        response['Cache-Control'] = 'private, max-age=86400'
+        return response
+
+
+class BatchViewSet(ViewSet):
+    """Runs many API operations in one call (see api/batch.py)."""
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAdminUser]
+    throttle_scopes = {'create': 'bulk'}
+
+    def create(self, request):
+        atomic = bool(request.data.get('atomic', False))
+        try:
+            operations = parse_operations(request.data)
+            committed, results = run_batch(request, operations, atomic=atomic)
+        except BatchError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {'atomic': atomic, 'committed': committed, 'results': results},
+            status=status.HTTP_200_OK if committed else status.HTTP_409_CONFLICT,
+        )
@@ -0,0 +1,69 @@
+# Gunicorn configuration, picked up automatically from the working directory.
+#
+# GUNICORN_ROLE selects the worker profile:
+#   web      serves every route (Heroku, single container). Default.
+#   api      interactive API only, short timeout. The long report routes
+#            (settings.LONG_RUNNING_ROUTES) are redirected to REPORTS_BASE_URL,
+#            a "reports" pool, or refused with 421 (api/middleware.py).
+#   reports  PDF and report generation, few threads, long timeout.
+#
+# Workers are threaded (gthread). The app is I/O-bound on blocking pymongo
+# calls: threads overlap that waiting without the monkeypatching an async
+# worker would need, and one slow PDF only holds one thread.
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'magazine.settings_production')
+
+# Prometheus multiprocess mode: workers write samples to this directory and
+# /metrics aggregates them. Must be set before any worker imports the app.
+prometheus_multiproc_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'magazine-prometheus')
+)
+# Cleared here, before the app is preloaded, so samples from a previous master
+# are not summed into ours
+shutil.rmtree(prometheus_multiproc_dir, ignore_errors=True)
+os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+
+role = os.environ.get('GUNICORN_ROLE', 'web')
+cpu_count = multiprocessing.cpu_count()
+
+PROFILES = {
+    'web': {'workers': min(2 * cpu_count + 1, 5), 'threads': 8, 'timeout': 300},
+    'api': {'workers': min(2 * cpu_count + 1, 9), 'threads': 8, 'timeout': 30},
+    'reports': {'workers': 2, 'threads': 2, 'timeout': 300},
+}
+profile = PROFILES[role]
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', profile['workers']))
+threads = int(os.environ.get('GUNICORN_THREADS', profile['threads']))
+timeout = profile['timeout']
+graceful_timeout = 30
+keepalive = 5
+
+# Import the app once in the master and fork it: faster boots and shared
+# memory. Safe because MongoDB connects lazily and reconnects in post_fork.
+preload_app = True
+
+# Recycle workers now and then so slow leaks (PDF buffers) cannot accumulate
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Without preload the worker has not connected yet; nothing to replace
+    if server.cfg.preload_app:
+        from magazine.mongo import reconnect
+        reconnect()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,135 @@
+"""
+Non-blocking structured logging.
+
+Request threads only put records on a queue (`AsyncQueueHandler`). A listener
+thread formats them as JSON lines and writes them out. Each record carries the
+correlation id of the request that produced it, and high-volume DEBUG
+categories are sampled before they reach the queue.
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import traceback
+from datetime import datetime, timezone
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of DEBUG records for the configured logger prefixes,
+    e.g. {'pymongo': 0.01, 'api.db': 0.1}. INFO and above always pass.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = sorted((rates or {}).items(), key=lambda item: -len(item[0]))
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + '.'):
+                return random.random() < rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES and key not in payload:
+                payload[key] = value
+        if record.exc_text:
+            payload['exception'] = record.exc_text
+        elif record.exc_info:
+            payload['exception'] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that owns its listener thread. The thread is started lazily
+    and again in each forked process, since threads do not survive fork.
+    """
+
+    def __init__(self, handlers=(), queue_size=10000):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.target_handlers = list(handlers)
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # Freeze the message and traceback in the calling thread, but leave
+        # the JSON formatting to the listener
+        record = logging.makeLogRecord(vars(record))
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block a request on logging; count what we could not keep
+            self.dropped += 1
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Forked: the parent's records stay with the parent
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            self._listener = logging.handlers.QueueListener(
+                self.queue, *self.target_handlers, respect_handler_level=True
+            )
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def close(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+        super().close()
+
+
+def json_queue_handler(queue_size=10000, stream=None):
+    """Factory used from settings.LOGGING: JSON lines to stderr, through a queue."""
+    target = logging.StreamHandler(stream)
+    target.setFormatter(JsonFormatter())
+    return AsyncQueueHandler(handlers=[target], queue_size=queue_size)
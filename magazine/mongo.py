@@ -0,0 +1,105 @@
+"""
+MongoDB connection management.
+
+The default MongoEngine connection is registered from ApiConfig.ready() with
+connect=False, so no socket or monitor thread exists before the first query.
+gunicorn's post_fork hook calls `reconnect()` so that a client created in a
+preloading master is never shared with workers.
+
+`transaction()` runs a block in one multi-document transaction when
+MONGO_TRANSACTIONS is on (replica sets, Atlas). Otherwise the writes run one
+after another. MongoEngine cannot pass a session, so the block's writes join
+the transaction only when they pass `current_session()` to pymongo. The
+ChangeEventMixin documents do this for save() and delete().
+
+Reads default to the primary. Inside `analytical_reads()`, reads made with
+`reader()` or `read_preference()` go to a secondary. The secondary must be
+no more than MONGO_ANALYTICS_MAX_STALENESS_SECONDS behind; when none is
+eligible the primary serves them. Writes always go to the primary.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import mongoengine
+from django.conf import settings
+from mongoengine.connection import get_connection
+from pymongo.read_preferences import ReadPreference, SecondaryPreferred
+
+_session = ContextVar('mongo_session', default=None)
+_read_preference = ContextVar('mongo_read_preference', default=None)
+
+
+def event_listeners():
+    from api.instrumentation import command_tracker
+    from api.metrics import pool_metrics_listener
+    from api.slowlog import slow_query_listener
+    return [command_tracker, slow_query_listener, pool_metrics_listener]
+
+
+def connect():
+    return mongoengine.connect(
+        settings.MONGOENGINE_DATABASE_NAME,
+        host=settings.MONGOENGINE_CONNECTION_STRING,
+        event_listeners=event_listeners(),
+        **settings.MONGO_CLIENT_OPTIONS,
+    )
+
+
+def reconnect():
+    # Also clears the collection handles cached on every Document class
+    mongoengine.disconnect_all()
+    return connect()
+
+
+def current_session():
+    """The session of the enclosing `transaction()`, or None; pass it to pymongo writes and reads."""
+    return _session.get()
+
+
+@contextmanager
+def transaction():
+    """
+    Runs the block in a transaction if supported and yields its session (None
+    otherwise). Nested calls join the outer one. The transaction commits when
+    the block exits and aborts if it raises. A context manager cannot re-run
+    its block, so a TransientTransactionError reaches the caller and is not
+    retried.
+    """
+    session = _session.get()
+    if session is not None or not settings.MONGO_TRANSACTIONS:
+        yield session
+        return
+    with get_connection().start_session() as session, session.start_transaction():
+        token = _session.set(session)
+        try:
+            yield session
+        finally:
+            _session.reset(token)
+
+
+def analytical_read_preference():
+    if not settings.MONGO_ANALYTICS_ON_SECONDARIES:
+        return ReadPreference.PRIMARY
+    return SecondaryPreferred(max_staleness=settings.MONGO_ANALYTICS_MAX_STALENESS_SECONDS)
+
+
+@contextmanager
+def analytical_reads():
+    """Routes the block's reads made through `reader()` and `read_preference()` to secondaries."""
+    token = _read_preference.set(analytical_read_preference())
+    try:
+        yield
+    finally:
+        _read_preference.reset(token)
+
+
+def read_preference():
+    """The read preference of the current block, for `QuerySet.read_preference()`."""
+    return _read_preference.get() or ReadPreference.PRIMARY
+
+
+def reader(model):
+    """The collection of `model` for reads, with the read preference of the current block."""
+    collection = model._get_collection()
+    preference = _read_preference.get()
+    return collection if preference is None else collection.with_options(read_preference=preference)
@@ -12,12 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 import os
-import mongoengine
-import logging
-import django_heroku
 from dotenv import load_dotenv
-import pymongo
-import ssl
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -54,7 +49,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestIdMiddleware',
+    'api.middleware.LongRunningRouteMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.DbInstrumentationMiddleware',
+    'api.middleware.ConcurrencyLimitMiddleware',
+    'api.middleware.ReadRoutingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -104,8 +106,9 @@ MONGOENGINE_PASSWORD     = os.getenv('MONGOENGINE_PASSWORD')
 MONGOENGINE_HOST         = os.getenv('MONGOENGINE_HOST')
 MONGOENGINE_DATABASE_NAME= os.getenv('MONGOENGINE_DATABASE_NAME')
 
-# 3) build the URI
-MONGOENGINE_CONNECTION_STRING = (
+# 3) build the URI (MONGOENGINE_CONNECTION_STRING overrides it, e.g. for the
+#    local replica set in docker-compose.replicaset.yml)
+MONGOENGINE_CONNECTION_STRING = os.getenv('MONGOENGINE_CONNECTION_STRING') or (
     f"mongodb+srv://{MONGOENGINE_USER}:{MONGOENGINE_PASSWORD}"
     f"@{MONGOENGINE_HOST}/{MONGOENGINE_DATABASE_NAME}"
     "?retryWrites=true&w=majority&appName=narayana"
@@ -113,31 +116,160 @@ MONGOENGINE_CONNECTION_STRING = (
 
 DATABASE_URL = MONGOENGINE_CONNECTION_STRING
 
-# Establish the MongoEngine default connection with updated TLS configuration
-mongoengine.connect(
-    MONGOENGINE_DATABASE_NAME,
-    host=MONGOENGINE_CONNECTION_STRING,
+# MongoEngine connects from ApiConfig.ready() via magazine/mongo.py. With
+# connect=False no socket or monitor thread is opened until the first query,
+# so importing settings stays cheap and gunicorn can --preload safely.
+# MONGO_TLS=false is for local servers; pymongo rejects TLS options without TLS.
+MONGO_TLS = os.getenv('MONGO_TLS', 'true').lower() == 'true'
+MONGO_CLIENT_OPTIONS = {
+    'connect': False,
+    'tls': MONGO_TLS,
+    'serverSelectionTimeoutMS': 30000,
+    'socketTimeoutMS': 30000,
+}
+if MONGO_TLS:
+    MONGO_CLIENT_OPTIONS['tlsAllowInvalidCertificates'] = False
+
+# Multi-document transactions need a replica set (Atlas is one); turn off for
+# a standalone server and writes fall back to sequential (see magazine/mongo.py)
+MONGO_TRANSACTIONS = os.getenv('MONGO_TRANSACTIONS', 'true').lower() == 'true'
+
+# Read routing (see magazine/mongo.py). Actions a viewset lists in
+# `analytical_actions` read from secondaries at most this far behind the
+# primary (MongoDB's minimum is 90), or from the primary when none qualifies.
+MONGO_ANALYTICS_ON_SECONDARIES = os.getenv('MONGO_ANALYTICS_ON_SECONDARIES', 'true').lower() == 'true'
+MONGO_ANALYTICS_MAX_STALENESS_SECONDS = int(os.getenv('MONGO_ANALYTICS_MAX_STALENESS_SECONDS', '120'))
+
+# Per-request MongoDB instrumentation (see api/middleware.py)
+DB_INSTRUMENTATION_SLOWEST = 3
+# Turn on in test settings so endpoints over their declared query budget fail
+DB_QUERY_BUDGET_STRICT = os.getenv('DB_QUERY_BUDGET_STRICT', 'false').lower() == 'true'
+
+# Slow query log (see api/slowlog.py); thresholds are per collection
+SLOW_QUERY_LOG_ENABLED = True
+SLOW_QUERY_THRESHOLDS_MS = {
+    'default': 200,
+    'magazine_subscriber': 100,
+    'subscription': 100,
+}
+SLOW_QUERY_COLLECTION = 'slow_queries'
+SLOW_QUERY_LOG_SIZE_BYTES = 16 * 1024 * 1024
+
+# Logging: JSON lines written by a background listener thread (magazine/log.py),
+# tagged with the request's correlation id. DEBUG records from chatty loggers
+# are sampled at the rates below before they are queued.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_QUEUE_SIZE = 10000
+LOG_SAMPLING_RATES = {
+    'pymongo': 0.01,
+    'django.db.backends': 0.01,
+    'api.db': 0.1,
+}
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'magazine.log.RequestIdFilter'},
+        'sampling': {'()': 'magazine.log.SamplingFilter', 'rates': LOG_SAMPLING_RATES},
+    },
+    'handlers': {
+        'json': {
+            '()': 'magazine.log.json_queue_handler',
+            'queue_size': LOG_QUEUE_SIZE,
+            'filters': ['sampling', 'request_id'],
+        },
+    },
+    'root': {'handlers': ['json'], 'level': LOG_LEVEL},
+    'loggers': {
+        # pymongo logs every command and heartbeat at DEBUG
+        'pymongo': {'level': os.getenv('PYMONGO_LOG_LEVEL', 'WARNING')},
+    },
+}
+
+# Gunicorn role of this process (see gunicorn.conf.py). The "api" role does
+# not serve LONG_RUNNING_ROUTES, which would outlive its 30 s timeout: it
+# redirects them to REPORTS_BASE_URL (the "reports" pool), or answers 421
+# when that is unset (see api/middleware.py).
+SERVER_ROLE = os.getenv('GUNICORN_ROLE', 'web')
+LONG_RUNNING_ROUTES = (
+    r'^/api/subscribers/report/',
+    r'^/api/subscribers/generate_pdf_report/',
+    r'^/api/subscribers/generate_report_dummy/',
 )
+REPORTS_BASE_URL = os.getenv('REPORTS_BASE_URL', '').rstrip('/')
+
+# Renewal notices (see api/renewals.py)
+RENEWAL_NOTICE_SENDER = 'api.renewals.FileNoticeSender'
+RENEWAL_NOTICE_OUTPUT_DIR = os.path.join(BASE_DIR, 'var', 'renewal_notices')
+
+# Largest operation list accepted by POST /api/batch/ (see api/batch.py)
+BATCH_MAX_OPERATIONS = 200
+
+# Change-event outbox (see api/outbox.py); run `manage.py consume_events`
+OUTBOX_HANDLER_MODULES = ['api.event_handlers']
+OUTBOX_SETTLE_SECONDS = 2
+OUTBOX_POLL_INTERVAL_SECONDS = 1
+OUTBOX_RETENTION_DAYS = 7
+
+# Archive tier (see api/archive.py): deleted subscribers move out of the hot
+# collections after the retention period, subscriptions after the horizon
+SUBSCRIBER_ARCHIVE_RETENTION_DAYS = 365
+SUBSCRIPTION_ARCHIVE_HORIZON_DAYS = 5 * 365
+
+# Delta sync (see api/sync.py): clients older than the tombstone retention
+# must sync from scratch; the lag covers writes still committing
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 2000
+SYNC_WATERMARK_LAG_SECONDS = 5
+SYNC_TOMBSTONE_RETENTION_DAYS = 30
+
+# Dispatch manifests (see api/dispatch.py), one directory per issue
+DISPATCH_OUTPUT_DIR = os.path.join(BASE_DIR, 'var', 'dispatch')
+
+# Pincode directory (see api/pincodes.py). The compiled file is memory-mapped
+# and shared by all workers; it is built from PINCODE_DIRECTORY_SOURCE (the
+# India Post CSV) when missing. Without either, pincode autofill and strict
+# validation are off. In strict mode unknown pincodes are rejected.
+PINCODE_DIRECTORY_PATH = os.path.join(BASE_DIR, 'var', 'pincodes.bin')
+PINCODE_DIRECTORY_SOURCE = os.getenv('PINCODE_DIRECTORY_SOURCE')
+PINCODE_VALIDATION_STRICT = os.getenv('PINCODE_VALIDATION_STRICT', 'false').lower() == 'true'
+
+# Per-process cache; geo rollup answers (api/geo.py) are cached here
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'magazine',
+    }
+}
+GEO_ROLLUP_CACHE_SECONDS = 60
+# Dirty pincodes refreshed per run of `refresh_geo_rollups`; a cache miss
+# refreshes one batch (api/geo.py REFRESH_BATCH_SIZE) and leaves the rest
+GEO_ROLLUP_REFRESH_LIMIT = 1000
+
+# Cold start budget enforced by `manage.py check_startup`
+STARTUP_TIME_TARGET_SECONDS = float(os.getenv('STARTUP_TIME_TARGET_SECONDS', '3.0'))
+
+# Throttling and load shedding (see api/throttling.py); the store is shared by
+# the workers of one host
+THROTTLE_ENABLED = os.getenv('THROTTLE_ENABLED', 'true').lower() == 'true'
+THROTTLE_STORE_PATH = os.path.join(BASE_DIR, 'var', 'throttle.sqlite3')
+# Token bucket per auth token and scope: (burst size, requests refilled per second)
+THROTTLE_RATES = {
+    'read': (120, 10),
+    'write': (60, 2),
+    'report': (5, 0.05),
+    'bulk': (10, 0.2),
+}
+# Requests of a scope running at once across all workers
+CONCURRENCY_LIMITS = {
+    'report': 4,
+    'bulk': 4,
+}
+# Longest a request can hold a slot; matches the longest gunicorn timeout
+CONCURRENCY_LEASE_SECONDS = 300
+CONCURRENCY_RETRY_AFTER_SECONDS = 10
+
 
-# Setup logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
-
-# Try to connect using pymongo with increased timeouts and TLS enabled
-try:
-    mongo_client = pymongo.MongoClient(
-        MONGOENGINE_CONNECTION_STRING,
-        tls=True,  # Enable TLS/SSL
-        tlsAllowInvalidCertificates=False,  # Ensure certificates are valid
-        serverSelectionTimeoutMS=30000,  # Increase to 30 seconds
-        socketTimeoutMS=30000  # Increase to 30 seconds
-    )
-    logger.debug('MongoDB connection successful')
-except Exception as e:
-    logger.error(f'Error connecting to MongoDB: {e}')
-
-
-# Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -174,7 +306,15 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_DIRS = (os.path.join(BASE_DIR, 'static'),)
-django_heroku.settings(locals())
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedStaticFilesStorage'},
+}
+
+# django_heroku only matters on Heroku dynos; skip its imports elsewhere
+if 'DYNO' in os.environ:
+    import django_heroku
+    django_heroku.settings(locals(), logging=False, staticfiles=False)
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -192,6 +332,9 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.TokenBucketThrottle',
+    ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
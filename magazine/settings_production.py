@@ -0,0 +1,23 @@
+"""
+Production settings profile, selected by gunicorn.conf.py unless
+DJANGO_SETTINGS_MODULE is already set.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import MONGO_CLIENT_OPTIONS
+
+DEBUG = False
+
+# One pooled connection per gunicorn thread, plus headroom for background threads
+MONGO_CLIENT_OPTIONS = {
+    **MONGO_CLIENT_OPTIONS,
+    'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', '16')),
+    'minPoolSize': 0,
+    'maxIdleTimeMS': 60000,
+    'serverSelectionTimeoutMS': 5000,
+    'connectTimeoutMS': 5000,
+    'socketTimeoutMS': 60000,
+}
+
+STARTUP_TIME_TARGET_SECONDS = float(os.getenv('STARTUP_TIME_TARGET_SECONDS', '2.0'))